@@ -1,9 +1,18 @@
+import asyncio
+import time
 from typing import Any, Annotated
 from fastapi import Depends, Request, HTTPException
 from starlette.status import HTTP_401_UNAUTHORIZED
 
-from app.services.firebase import verify_id_token
-from app.services.user import get_or_create_user
+from app.core.metrics import AUTH_VERIFY_DURATION
+from app.core.settings import get_settings
+from app.core.tracing import record
+from app.services.firebase import verify_id_token as verify_firebase_token
+from app.services.google_auth import verify_google_token
+from app.services.sessions import verify_session
+from app.services.store import Store
+from app.services.tokens import get_token_cache
+from app.services.user import get_or_create_user, get_user_by_id
 
 # Used for testing or development purposes
 _STOCK_TOKENS = {}
@@ -33,10 +42,19 @@ def parse_auth_token(authorization: str) -> str:
     return scheme, token
 
 
-def verify_auth_token(authorization: str) -> dict[str, Any]:
+async def verify_id_token(token: str) -> dict[str, Any]:
+    """Verify an ID token locally when `google_client_id` is set, with Firebase otherwise."""
+    if get_settings().google_client_id:
+        return await verify_google_token(token)
+    return await asyncio.to_thread(verify_firebase_token, token)
+
+
+async def verify_auth_token(authorization: str) -> dict[str, Any]:
     """
     Get the valid data from the provided authorization token.
 
+    Verified claims are cached until the token expires, see `app.services.tokens`.
+
     Raises an HTTPException if the token is invalid.
     """
     if not authorization:
@@ -47,30 +65,82 @@ def verify_auth_token(authorization: str) -> dict[str, Any]:
     if token in _STOCK_TOKENS:
         return _STOCK_TOKENS[token]
 
+    token_cache = get_token_cache()
+    start_time = time.perf_counter()
+    result = "failed"
+
     try:
-        return verify_id_token(token)
-    except Exception as e:
-        raise_for_unauth(str(e))
+        claims = await token_cache.get(token)
+        if claims is not None:
+            result = "cached"
+            return claims
+
+        try:
+            claims = await verify_id_token(token)
+        except Exception as e:
+            raise_for_unauth(str(e))
+
+        if await token_cache.is_revoked(claims):
+            raise_for_unauth("Token has been revoked")
+
+        await token_cache.put(token, claims)
+        result = "verified"
+        return claims
+    finally:
+        elapsed = time.perf_counter() - start_time
+        AUTH_VERIFY_DURATION.observe(elapsed, result)
+        record("auth", elapsed)
+
+
+async def get_session_user(request: Request, store: Store) -> dict[str, Any] | None:
+    """Get the user of the request's session cookie, or None if there is no valid session."""
+    session = request.cookies.get(get_settings().session_cookie)
+    if not session:
+        return None
+
+    start_time = time.perf_counter()
+    claims = verify_session(session)
+    if claims is not None and await get_token_cache().is_revoked(claims):
+        claims = None
+    elapsed = time.perf_counter() - start_time
+    AUTH_VERIFY_DURATION.observe(elapsed, "session" if claims else "failed")
+    record("auth", elapsed)
+
+    if claims is None:
+        return None
+    return await get_user_by_id(store, claims["sub"])
 
 
-async def get_user(request: Request) -> "User":
+async def get_user(request: Request, store: Store) -> "User":
     """
-    Get the user information from the auth data.
+    Get the user information from the auth data, or the session cookie.
     """
     auth = request.headers.get("Authorization", "").strip()
-    return await get_or_create_user(verify_auth_token(auth))
+    if auth:
+        user = await get_or_create_user(store, await verify_auth_token(auth))
+    elif not (user := await get_session_user(request, store)):
+        raise_for_unauth("Authorization header or session required")
+
+    # Picked up by the logging middleware
+    request.state.user = user
+    return user
 
 
-async def get_user_maybe(request: Request) -> "UserMaybe":
+async def get_user_maybe(request: Request, store: Store) -> "UserMaybe":
     """
-    Get the user information from the auth data.
+    Get the user information from the auth data, or the session cookie.
     """
     # Need to check it like this to see if it is there
     if request.headers.get("Authorization") is None:
-        return None
-
-    auth = request.headers.get("Authorization", "").strip()
-    return await get_or_create_user(verify_auth_token(auth))
+        user = await get_session_user(request, store)
+    else:
+        auth = request.headers.get("Authorization", "").strip()
+        user = await get_or_create_user(store, await verify_auth_token(auth))
+
+    # Picked up by the logging middleware
+    if user:
+        request.state.user = user
+    return user
 
 
 User = Annotated[dict[str, Any], Depends(get_user)]
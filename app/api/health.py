@@ -1,4 +1,4 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 
 
 router = APIRouter(tags=["health"])
@@ -8,3 +8,9 @@ router = APIRouter(tags=["health"])
 async def health_check():
     """Health check endpoint to verify service is running."""
     return "ok"
+
+
+@router.get("/healthz/queue")
+async def queue_health(request: Request):
+    """Background processing stats: queue depth, lag of the oldest entry, and worker counters."""
+    return await request.app.state.worker.stats()
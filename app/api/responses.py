@@ -0,0 +1,89 @@
+import hashlib
+from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Mapping
+
+from fastapi.responses import ORJSONResponse, Response
+from starlette.datastructures import Headers
+from starlette.types import Receive, Scope, Send
+
+
+class ActivityStreamResponse(ORJSONResponse):
+    """
+    JSON-LD response with validators for conditional requests.
+
+    Successful GET and HEAD responses carry a strong `ETag` hashed from the body, and a `Last-Modified` from the
+    object's `updated` stamp. One whose `If-None-Match` or `If-Modified-Since` matches is answered
+    `304 Not Modified` without the body. Responses to other methods get no validators.
+
+    Content that is already encoded JSON `bytes` is sent as is.
+    """
+
+    media_type = 'application/ld+json; profile="https://www.w3.org/ns/activitystreams"'
+
+    def __init__(self, content, status_code: int = 200, *args, **kwargs):
+        super().__init__(content, status_code, *args, **kwargs)
+        self.last_modified = get_last_modified(content) if isinstance(content, dict) else None
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return super().render(content)
+
+    def validators(self) -> dict[str, str]:
+        """The `ETag` and `Last-Modified` headers of the response, the ones already set or else computed."""
+        validators = {"etag": self.headers.get("etag") or make_etag(self.body)}
+        if last_modified := self.headers.get("last-modified") or self.last_modified:
+            validators["last-modified"] = last_modified
+        return validators
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.status_code == 200 and scope["method"] in ("GET", "HEAD"):
+            self.headers.update(self.validators())
+            if is_not_modified(Headers(scope=scope), self.headers):
+                await not_modified(self.headers)(scope, receive, send)
+                return
+
+        await super().__call__(scope, receive, send)
+
+
+# Headers a 304 response repeats from the full response
+NOT_MODIFIED_HEADERS = ("etag", "last-modified", "cache-control", "vary")
+
+
+def not_modified(headers: Mapping[str, str]) -> Response:
+    """A `304 Not Modified` response, repeating the validators and caching headers of the full one."""
+    return Response(status_code=304, headers={key: headers[key] for key in NOT_MODIFIED_HEADERS if key in headers})
+
+
+def make_etag(body: bytes) -> str:
+    """A strong entity tag for a response body."""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def get_last_modified(content: dict) -> str | None:
+    """The HTTP date of an object's `updated` stamp, if it has one."""
+    try:
+        return format_datetime(datetime.fromisoformat(content["updated"]), usegmt=True)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def is_not_modified(request_headers: Mapping[str, str], response_headers: Mapping[str, str]) -> bool:
+    """Evaluate `If-None-Match`, or failing that `If-Modified-Since`, against the response validators."""
+    if if_none_match := request_headers.get("if-none-match"):
+        etag = response_headers.get("etag")
+        if not etag:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag.removeprefix("W/") in tags
+
+    if (if_modified_since := request_headers.get("if-modified-since")) and (
+        last_modified := response_headers.get("last-modified")
+    ):
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+    return False
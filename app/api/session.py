@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Request, Response
+from starlette.status import HTTP_204_NO_CONTENT
+
+from app.api.auth import User, get_user
+from app.api.responses import ActivityStreamResponse
+from app.core.settings import get_settings
+from app.services.sessions import create_session, revoke_sessions
+from app.services.store import Store
+
+router = APIRouter(tags=["auth"])
+
+
+@router.post("/auth")
+async def login(user: User):
+    """
+    Exchange a verified ID token, sent as a Bearer token, for a session cookie.
+
+    Returns the user, later requests can authenticate with the cookie alone.
+    """
+    settings = get_settings()
+    response = ActivityStreamResponse(user)
+    response.set_cookie(
+        settings.session_cookie,
+        create_session(user["id"], settings.session_max_age),
+        max_age=settings.session_max_age,
+        domain=settings.session_cookie_domain,
+        secure=settings.session_cookie_secure,
+        httponly=settings.session_cookie_httponly,
+        samesite=settings.session_cookie_samesite,
+    )
+    return response
+
+
+@router.delete("/auth", status_code=HTTP_204_NO_CONTENT)
+async def logout(request: Request, store: Store, everywhere: bool = False):
+    """Remove the session cookie, and with `everywhere` revoke every session of the user, on every device."""
+    settings = get_settings()
+    if everywhere:
+        user = await get_user(request, store)
+        await revoke_sessions(user["id"])
+
+    response = Response(status_code=HTTP_204_NO_CONTENT)
+    response.delete_cookie(
+        settings.session_cookie,
+        domain=settings.session_cookie_domain,
+        secure=settings.session_cookie_secure,
+        httponly=settings.session_cookie_httponly,
+        samesite=settings.session_cookie_samesite,
+    )
+    return response
@@ -0,0 +1,101 @@
+from typing import AsyncIterator
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from app.core.settings import get_settings
+from app.services.events import RESET, Event, EventHub, TooManyConnections, get_event_hub
+from app.services.fanout import get_streamed_collections
+from app.services.store import Store
+from .auth import User
+
+router = APIRouter(tags=["stream"])
+
+# Milliseconds a disconnected client waits before reconnecting
+RETRY_MS = 3000
+
+
+def format_event(event: Event) -> bytes:
+    """Encode an event as a Server-Sent Event, a reset tells the client to refetch the collection."""
+    event_id, data = event
+    if event_id is None:
+        return b"event: reset\ndata: {}\n\n"
+    return b"id: " + event_id.encode() + b"\ndata: " + data + b"\n\n"
+
+
+async def stream_events(
+    hub: EventHub, topics: list[str], last_event_id: str | None, heartbeat: float
+) -> AsyncIterator[bytes]:
+    """Stream the events of `topics` until the client disconnects or falls too far behind."""
+    # Subscribed here rather than in the endpoint, so the subscription is always closed with the stream
+    subscription = hub.subscribe(topics)
+    try:
+        # Taken along with the subscription, so events are neither missed nor sent twice
+        missed = hub.replay(subscription.topics, last_event_id) if last_event_id else []
+
+        yield f"retry: {RETRY_MS}\n\n".encode()
+        if missed is None:
+            yield format_event(RESET)
+        elif missed:
+            yield b"".join(format_event(event) for event in missed)
+
+        while not subscription.overflowed:
+            events = await subscription.get(heartbeat)
+            if events:
+                yield b"".join(format_event(event) for event in events)
+            else:
+                yield b": ping\n\n"
+    finally:
+        hub.unsubscribe(subscription)
+
+
+async def resume(first: bytes, stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Yield `first`, then the rest of `stream`, closing it with this one."""
+    try:
+        yield first
+        async for chunk in stream:
+            yield chunk
+    finally:
+        await stream.aclose()
+
+
+async def event_stream(request: Request, topics: list[str]) -> StreamingResponse:
+    """Respond with a stream of the events of `topics`, resuming after the request's `Last-Event-ID`."""
+    settings = get_settings()
+    stream = stream_events(
+        get_event_hub(), topics, request.headers.get("last-event-id"), settings.stream_heartbeat_interval
+    )
+
+    # Subscribing takes a connection slot, do it before the response starts so a full hub is refused with a 503.
+    # A started stream is closed even if the response is never sent, which gives the slot back
+    try:
+        first = await anext(stream)
+    except TooManyConnections:
+        raise HTTPException(status_code=503, detail="Too many streaming connections", headers={"Retry-After": "5"})
+
+    return StreamingResponse(
+        resume(first, stream),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/u/{user_key}/inbox/stream")
+async def stream_inbox(user_key: str, request: Request, user: User, store: Store):
+    """Stream the activities added to a user's inbox as Server-Sent Events, only to the user."""
+    actor_id = f"/u/{user_key}"
+    if user["id"] != actor_id:
+        raise HTTPException(status_code=403, detail="You can only stream your own inbox")
+
+    # Activities to large collections are merged into the inbox on read, so they are streamed from the collection
+    return await event_stream(request, [f"{actor_id}/inbox", *await get_streamed_collections(store, actor_id)])
+
+
+@router.get("/u/{user_key}/outbox/stream")
+async def stream_outbox(user_key: str, request: Request, user: User):
+    """Stream the activities added to a user's outbox as Server-Sent Events, only to the user."""
+    # Events carry the whole activity, including those addressed to followers or to someone directly
+    if user["id"] != f"/u/{user_key}":
+        raise HTTPException(status_code=403, detail="You can only stream your own outbox")
+
+    return await event_stream(request, [f"/u/{user_key}/outbox"])
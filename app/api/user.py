@@ -1,48 +1,245 @@
+import time
+import orjson
 from nanoid import generate
-from typing import Dict, Any
-from fastapi import APIRouter, HTTPException, Request, Body
+from typing import Dict, Any, Awaitable, Callable
+from urllib.parse import urlencode
+from fastapi import APIRouter, HTTPException, Request, Response, Body, Query
 
-from activity_store import ActivityStore
 from activity_store.utils import first_id
-from activity_bus import ActivityBus
+from app.core.settings import get_settings
+from app.services.bus import submit_activity
+from app.services.collections import MAX_PAGE_SIZE, collection_page, collection_root, get_root_cache
+from app.services.fanout import STREAMS_KEY, merge_streams_throttled
+from app.services.queue import QueueFull, get_queue
+from app.services.response_cache import get_response_cache
+from app.services.store import Store, dereference_encoded
+from app.services.submissions import enqueue_submission, enqueue_submissions
 from .auth import User, UserMaybe
+from .responses import ActivityStreamResponse, is_not_modified, not_modified
 
 
 router = APIRouter(tags=["user"])
 
 
+async def paged_collection(
+    store: Store,
+    collection_id: str,
+    page: bool,
+    limit: int | None,
+    after: str | None,
+    before: str | None,
+    since: str | None = None,
+) -> dict[str, Any]:
+    """Return the collection root, from the root cache when it's there, or one of its pages if a page was asked for."""
+    paged = page or after or before or since
+    root_cache = get_root_cache()
+    if not paged and (root := root_cache.get(collection_id)) is not None:
+        return root
+
+    loaded_at = time.monotonic()
+    collection = await store.dereference(collection_id)
+    if not collection:
+        raise HTTPException(status_code=404)
+    collection.pop(STREAMS_KEY, None)
+
+    if not paged:
+        root = collection_root(collection)
+        root_cache.set(collection_id, root, loaded_at=loaded_at)
+        return root
+
+    try:
+        return collection_page(
+            collection,
+            limit=limit or get_settings().collection_page_size,
+            after=after,
+            before=before,
+            since=since,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def collection_cache_key(
+    collection_id: str, page: bool, limit: int | None, after: str | None, before: str | None, since: str | None
+) -> str:
+    """
+    The response cache key of a collection request, built from the parameters `paged_collection` uses alone, so
+    other query parameters can't add entries.
+    """
+    if not (page or after or before or since):
+        return collection_id
+
+    params = {"limit": limit or get_settings().collection_page_size, "after": after, "before": before, "since": since}
+    return f"{collection_id}?{urlencode({name: value for name, value in params.items() if value})}"
+
+
+async def cached_response(
+    request: Request, collection_id: str, key: str, load: Callable[[], Awaitable[dict[str, Any]]]
+) -> Response:
+    """
+    Respond from the shared response cache under `key`, rendering `load()` on a miss.
+
+    Conditional requests are checked against the validators cached with the body, so a matching one is answered
+    `304 Not Modified` without loading or sending it.
+    """
+
+    async def load_encoded() -> tuple[bytes, dict[str, str]]:
+        response = ActivityStreamResponse(await load())
+        return response.body, response.validators()
+
+    body, validators = await get_response_cache().get_or_load(collection_id, key, load_encoded)
+    if is_not_modified(request.headers, validators):
+        return not_modified(validators)
+    return ActivityStreamResponse(body, headers=validators)
+
+
+async def check_outbox_owner(store: Store, user_key: str, user: dict[str, Any]) -> None:
+    """Raise unless the outbox exists and belongs to the authenticated user."""
+    # Check if user exists
+    outbox_user = await store.dereference(f"/u/{user_key}")
+    if not outbox_user:
+        raise HTTPException(status_code=404)
+
+    # Verify that the authenticated user matches the URL user
+    if user["id"] != outbox_user["id"]:
+        raise HTTPException(status_code=403, detail="You can only post to your own outbox")
+
+
+def prepare_activity(activity: dict[str, Any], user: dict[str, Any]) -> dict[str, Any]:
+    """Inject the actor and ID of an activity posted by the user, raises if the actor is someone else."""
+    # Inject actor if missing
+    if "actor" not in activity:
+        activity["actor"] = user["id"]
+
+    # Verify actor matches URL
+    if first_id(activity["actor"]) != user["id"]:
+        raise HTTPException(status_code=400, detail="Activity actor must match URL user")
+
+    # Generate ID if missing
+    if "id" not in activity:
+        activity["id"] = f"{user['id']}/activities/{generate()}"
+
+    return activity
+
+
+async def read_batch(request: Request) -> list[Any]:
+    """
+    Read a batch of activities, posted as a JSON array or as NDJSON (`application/x-ndjson`).
+
+    The body is read as it streams in, and refused with a 413 as soon as it is over the size limits. An NDJSON line
+    that isn't valid JSON is returned as a ValueError, to be reported for that item alone.
+    """
+    settings = get_settings()
+    max_size, max_bytes = settings.outbox_batch_max_size, settings.outbox_batch_max_bytes
+    too_many = HTTPException(status_code=413, detail=f"Batches are limited to {max_size} activities")
+    too_large = HTTPException(status_code=413, detail=f"Batches are limited to {max_bytes} bytes")
+
+    try:
+        content_length = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length")
+    if content_length > max_bytes:
+        raise too_large
+
+    ndjson = request.headers.get("content-type", "").startswith("application/x-ndjson")
+    activities: list[Any] = []
+
+    def add_line(line: bytes) -> None:
+        if not line.strip():
+            return
+        if len(activities) >= max_size:
+            raise too_many
+        try:
+            activities.append(orjson.loads(line))
+        except orjson.JSONDecodeError as e:
+            activities.append(ValueError(f"Invalid JSON: {e}"))
+
+    received = 0
+    chunks = []
+    pending = b""
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_bytes:
+            raise too_large
+        if ndjson:
+            *lines, pending = (pending + chunk).split(b"\n")
+            for line in lines:
+                add_line(line)
+        else:
+            chunks.append(chunk)
+
+    if ndjson:
+        add_line(pending)
+        return activities
+
+    try:
+        activities = orjson.loads(b"".join(chunks))
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+    if not isinstance(activities, list):
+        raise HTTPException(status_code=400, detail="Expected an array of activities")
+    if len(activities) > max_size:
+        raise too_many
+
+    return activities
+
+
 @router.get("/me")
-async def me(user: User):
+async def me(user: User, store: Store):
     """Returns the user info back to them"""
-    async with ActivityStore() as store:
-        # Get the inbox collection
-        return await store.dereference(user["id"])
+    return ActivityStreamResponse(await dereference_encoded(store, user["id"]))
 
 
 @router.get("/u/{user_key}/inbox")
-async def get_inbox(user_key: str, user: UserMaybe):
-    """Get a user's inbox."""
-    async with ActivityStore() as store:
-        # Get the inbox collection
-        inbox = await store.dereference(f"/u/{user_key}/inbox")
-        if not inbox:
-            raise HTTPException(status_code=404)
+async def get_inbox(
+    user_key: str,
+    request: Request,
+    user: UserMaybe,
+    store: Store,
+    page: bool = False,
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    before: str | None = None,
+    since: str | None = None,
+):
+    """Get a user's inbox, or a page of it."""
+    inbox_id = f"/u/{user_key}/inbox"
+
+    async def load():
+        # Bring in what was fanned out on read since the last time, other cached pages are stale if anything was
+        if await merge_streams_throttled(store, f"/u/{user_key}", inbox_id):
+            await get_response_cache().invalidate(inbox_id)
 
         # Return the inbox collection
-        return inbox
+        return await paged_collection(store, inbox_id, page, limit, after, before, since)
+
+    # Anonymous reads all see the same thing
+    if user is None:
+        key = collection_cache_key(inbox_id, page, limit, after, before, since)
+        return await cached_response(request, inbox_id, key, load)
+    return await load()
 
 
 @router.get("/u/{user_key}/outbox")
-async def get_outbox(user_key: str, request: Request):
-    """Get a user's outbox."""
-    async with ActivityStore() as store:
-        # Get the outbox collection
-        outbox = await store.dereference(f"/u/{user_key}/outbox")
-        if not outbox:
-            raise HTTPException(status_code=404)
+async def get_outbox(
+    user_key: str,
+    request: Request,
+    store: Store,
+    page: bool = False,
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: str | None = None,
+    before: str | None = None,
+    since: str | None = None,
+):
+    """Get a user's outbox, or a page of it."""
+    outbox_id = f"/u/{user_key}/outbox"
 
+    async def load():
         # Return the outbox collection
-        return outbox
+        return await paged_collection(store, outbox_id, page, limit, after, before, since)
+
+    key = collection_cache_key(outbox_id, page, limit, after, before, since)
+    return await cached_response(request, outbox_id, key, load)
 
 
 @router.post("/u/{user_key}/outbox")
@@ -50,30 +247,113 @@ async def post_to_outbox(
     user_key: str,
     request: Request,
     user: User,
+    store: Store,
+    response: Response,
     activity: Dict[str, Any] = Body(...),
 ):
-    """Post a new activity to a user's outbox."""
-    # Check if user exists
-    async with ActivityStore() as store:
-        outbox_user = await store.dereference(f"/u/{user_key}")
-        if not outbox_user:
-            raise HTTPException(status_code=404)
+    """
+    Post a new activity to a user's outbox.
+
+    In the "async" `outbox_submit_mode`, responds `202 Accepted` as soon as the activity is queued, with the
+    submission status object and its location.
+    """
+    await check_outbox_owner(store, user_key, user)
+    activity = prepare_activity(activity, user)
+
+    if get_settings().outbox_submit_mode == "async":
+        queue = get_queue()
+        if not queue.durable:
+            raise HTTPException(status_code=503, detail="Asynchronous submissions need a durable queue")
+        try:
+            submission = await enqueue_submission(store, queue, user, activity)
+        except QueueFull as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+        response.status_code = 202
+        response.headers["Location"] = submission["id"]
+        return submission
+
+    # Submit the activity to the bus
+    return await submit_activity(store, activity)
+
+
+@router.post("/u/{user_key}/outbox/batch")
+async def post_batch_to_outbox(user_key: str, request: Request, user: User, store: Store):
+    """
+    Post many activities to a user's outbox in one request, as a JSON array or NDJSON.
+
+    Responds with a result for every item, in order: "processed" or, in the "async" `outbox_submit_mode`,
+    "queued" with the ID of its submission status, or "failed" with the error.
+
+    In the "async" mode the whole batch is recorded and queued in bulk, all of it or none when the queue is full. In
+    the "sync" mode the activities are submitted to the bus one after the other, the bus has no bulk submit, so the
+    batch only saves the requests and the authentication.
+    """
+    settings = get_settings()
+
+    await check_outbox_owner(store, user_key, user)
+    activities = await read_batch(request)
+
+    results: list[dict[str, Any]] = [None] * len(activities)
+    prepared = []
+    for index, activity in enumerate(activities):
+        try:
+            if isinstance(activity, Exception):
+                raise activity
+            if not isinstance(activity, dict):
+                raise ValueError("Activity must be an object")
+            prepared.append((index, prepare_activity(activity, user)))
+        except (HTTPException, ValueError) as e:
+            results[index] = {"index": index, "status": "failed", "error": getattr(e, "detail", str(e))}
+
+    if settings.outbox_submit_mode == "async":
+        queue = get_queue()
+        if not queue.durable:
+            raise HTTPException(status_code=503, detail="Asynchronous submissions need a durable queue")
+
+        # Every submission status stored with one concurrent write, and the activities queued in order with one push
+        activities = [activity for _, activity in prepared]
+        try:
+            submissions = await enqueue_submissions(store, queue, user, activities)
+        except QueueFull as e:
+            for index, activity in prepared:
+                results[index] = {"index": index, "id": activity["id"], "status": "failed", "error": str(e)}
+        else:
+            for (index, activity), submission in zip(prepared, submissions):
+                results[index] = {
+                    "index": index,
+                    "id": activity["id"],
+                    "status": "queued",
+                    "submission": submission["id"],
+                }
+    else:
+        # The bus submits one activity at a time, and they go in order: they are all the user's, and later
+        # activities may depend on earlier ones
+        for index, activity in prepared:
+            try:
+                await submit_activity(store, activity)
+            except Exception as e:
+                results[index] = {"index": index, "id": activity["id"], "status": "failed", "error": str(e)}
+            else:
+                results[index] = {"index": index, "id": activity["id"], "status": "processed"}
 
-        # Verify that the authenticated user matches the URL user
-        if user["id"] != outbox_user["id"]:
-            raise HTTPException(status_code=403, detail="You can only post to your own outbox")
+    failed = sum(1 for result in results if result["status"] == "failed")
+    return {
+        "totalItems": len(results),
+        "accepted": len(results) - failed,
+        "failed": failed,
+        "items": results,
+    }
 
-        # Inject actor if missing
-        if "actor" not in activity:
-            activity["actor"] = user["id"]
 
-        # Verify actor matches URL
-        if first_id(activity["actor"]) != user["id"]:
-            raise HTTPException(status_code=400, detail="Activity actor must match URL user")
+@router.get("/u/{user_key}/submissions/{submission_key}")
+async def get_submission(user_key: str, submission_key: str, user: User, store: Store):
+    """Get the status of an outbox submission: pending, processed or failed."""
+    if user["id"] != f"/u/{user_key}":
+        raise HTTPException(status_code=403, detail="You can only see your own submissions")
 
-        # Generate ID if missing
-        if "id" not in activity:
-            activity["id"] = f"{user['id']}/activities/{generate()}"
+    submission = await dereference_encoded(store, f"/u/{user_key}/submissions/{submission_key}")
+    if not submission:
+        raise HTTPException(status_code=404)
 
-        # Submit the activity to the bus
-        return await ActivityBus(store=store).submit(activity)
+    return ActivityStreamResponse(submission)
@@ -0,0 +1,177 @@
+"""
+Minimal Prometheus metrics, rendered in the text exposition format at `/metrics`.
+
+Counters and histograms are plain dicts keyed by label values, cheap enough to update on every request. Values
+that already live elsewhere (cache counters, queue depth) are read by collectors when the metrics are scraped.
+"""
+
+import inspect
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable
+
+# Latency buckets in seconds, from sub-millisecond store hits to slow requests
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Samples = list[tuple[str, dict[str, str], float]]
+Collector = Callable[[], Samples | Awaitable[Samples]]
+
+_METRICS: list["Metric"] = []
+_COLLECTORS: list[tuple[str, str, str, Collector]] = []
+_CACHES: dict[str, Any] = {}
+
+
+class Metric(ABC):
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        _METRICS.append(self)
+
+    @abstractmethod
+    def samples(self) -> Samples:
+        """The current `(name, labels, value)` samples of the metric."""
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Samples:
+        return [(self.name, dict(zip(self.labelnames, labels)), value) for labels, value in self._values.items()]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = buckets
+        # Per label set: a count per bucket plus one for +Inf, then the sum
+        self._values: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self._values.get(labels)
+        if counts is None:
+            counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self) -> Samples:
+        samples = []
+        for labels, counts in self._values.items():
+            labels = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, "le": str(bound)}, cumulative))
+            samples.append((f"{self.name}_count", labels, cumulative))
+            samples.append((f"{self.name}_sum", labels, counts[-1]))
+        return samples
+
+
+def register_collector(name: str, type: str, help: str, collector: Collector) -> None:
+    """Register a function, sync or async, returning `(name, labels, value)` samples read at scrape time."""
+    _COLLECTORS.append((name, type, help, collector))
+
+
+def register_cache(name: str, cache: Any) -> None:
+    """Expose the hit and miss counters of a cache with a `stats()` method."""
+    _CACHES[name] = cache
+
+
+def escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+async def render_metrics() -> str:
+    """Render every metric and collector in the Prometheus text format."""
+    lines = []
+
+    def add(name: str, type: str, help: str, samples: Samples) -> None:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {type}")
+        lines.extend(f"{sample}{format_labels(labels)} {value}" for sample, labels, value in samples)
+
+    for metric in _METRICS:
+        add(metric.name, metric.type, metric.help, metric.samples())
+
+    for name, type, help, collector in _COLLECTORS:
+        samples = collector()
+        if inspect.isawaitable(samples):
+            samples = await samples
+        add(name, type, help, samples)
+
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUEST_DURATION = Histogram(
+    "activity_serve_http_request_duration_seconds",
+    "HTTP request latency by route template and status.",
+    ("method", "route", "status"),
+)
+STORE_CALL_DURATION = Histogram(
+    "activity_serve_store_call_duration_seconds",
+    "ActivityStore call latency by operation, the count is the number of calls.",
+    ("operation",),
+)
+STORE_CALL_ERRORS = Counter(
+    "activity_serve_store_call_errors_total",
+    "ActivityStore calls that raised, by operation.",
+    ("operation",),
+)
+AUTH_VERIFY_DURATION = Histogram(
+    "activity_serve_auth_verify_duration_seconds",
+    "Bearer token and session verification latency, by result: cached, verified, session or failed.",
+    ("result",),
+)
+DELIVERIES = Counter(
+    "activity_serve_deliveries_total",
+    "Remote delivery attempts, by result: delivered, retried or dead.",
+    ("result",),
+)
+BUS_SUBMIT_DURATION = Histogram(
+    "activity_serve_bus_submit_duration_seconds",
+    "ActivityBus submit latency, including the submit listeners.",
+)
+
+
+def cache_stat(name: str, key: str) -> Collector:
+    def collect() -> Samples:
+        return [(name, {"cache": cache_name}, cache.stats()[key]) for cache_name, cache in _CACHES.items()]
+
+    return collect
+
+
+register_collector(
+    "activity_serve_cache_hits_total",
+    "counter",
+    "Cache hits, by cache.",
+    cache_stat("activity_serve_cache_hits_total", "hits"),
+)
+register_collector(
+    "activity_serve_cache_misses_total",
+    "counter",
+    "Cache misses, by cache.",
+    cache_stat("activity_serve_cache_misses_total", "misses"),
+)
+register_collector(
+    "activity_serve_cache_hit_ratio",
+    "gauge",
+    "Cache hit ratio, by cache.",
+    cache_stat("activity_serve_cache_hit_ratio", "hit_ratio"),
+)
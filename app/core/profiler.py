@@ -0,0 +1,55 @@
+"""
+A small sampling profiler for profiling single requests in production.
+
+A background thread samples the stack of the event loop thread on an interval. Samples are reported as collapsed
+stacks (`outer;inner;leaf count` per line), the input of flamegraph.pl and speedscope.
+"""
+
+import sys
+import threading
+from collections import Counter
+from types import FrameType
+
+
+def frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """
+    Samples the stack of one thread every `interval` seconds, between `start` and `stop`.
+
+    The event loop runs every request on one thread, so the samples include whatever else the server was doing
+    concurrently, and time spent waiting on I/O shows up in the event loop's select.
+    """
+
+    def __init__(self, interval: float = 0.001, thread_id: int | None = None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.samples: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """Return the samples as collapsed stacks, most sampled first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
@@ -0,0 +1,83 @@
+import asyncio
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable
+
+import structlog
+
+from app.core.settings import get_settings
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+logger = structlog.get_logger(__name__)
+
+
+@lru_cache
+def get_redis() -> "Redis | None":
+    """Return the shared async Redis client, or None if `redis_url` is not configured."""
+    url = get_settings().redis_url
+    if not url:
+        return None
+
+    from redis.asyncio import Redis
+
+    return Redis.from_url(url)
+
+
+class RedisSubscriber:
+    """
+    Listens to a Redis pub/sub channel in a background task, resubscribing after a disconnection.
+
+    Pub/sub doesn't replay the messages published while disconnected, so `on_resubscribe` is called once the
+    subscription is re-established, for the subscriber to recover from what it missed.
+    """
+
+    def __init__(
+        self,
+        redis: Any,
+        channel: str,
+        on_message: Callable[[bytes], None],
+        on_resubscribe: Callable[[], None],
+        retry_delay: float = 1.0,
+    ):
+        self.redis = redis
+        self.channel = channel
+        self.on_message = on_message
+        self.on_resubscribe = on_resubscribe
+        self.retry_delay = retry_delay
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _listen(self) -> None:
+        missed = False
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                if missed:
+                    self.on_resubscribe()
+                    missed = False
+
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.on_message(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Redis subscription disconnected", channel=self.channel, error=str(e))
+                await asyncio.sleep(self.retry_delay)
+            finally:
+                await pubsub.aclose()
+            missed = True
@@ -1,3 +1,6 @@
+from functools import lru_cache
+from typing import Literal
+
 from pydantic_settings import BaseSettings
 from pydantic import ConfigDict
 
@@ -15,11 +18,107 @@ class Settings(BaseSettings):
     session_cookie_secure: bool = True
     session_cookie_samesite: str = "lax"
     session_cookie_domain: str | None = None
+    session_secret: str | None = None  # signs session cookies, share it between server processes
 
-    # Google OAuth verification settings
+    # Google OAuth verification settings, ID tokens are verified locally with audience `google_client_id`, or by
+    # Firebase when it is not set
     google_client_id: str | None = None
+    google_certs_url: str = "https://www.googleapis.com/oauth2/v1/certs"
+    google_issuers: list[str] = ["https://accounts.google.com", "accounts.google.com"]
+
+    # Serving with `python run.py`, every server process keeps its own in-memory caches: more than one needs Redis,
+    # so they are kept coherent through its invalidation channel, and a shared `session_secret`
+    host: str = "0.0.0.0"
+    port: int = 8000
+    web_concurrency: int = 1  # server processes
+    server_reload: bool = False  # development only, always a single process
+    server_max_requests: int | None = None  # recycle a server process after this many requests, needs several
+    server_graceful_timeout: int = 30  # seconds in-flight requests get to finish on shutdown or recycle
+
+    # Activity store connections, opened once in the app lifespan
+    store_pool_size: int = 1  # keep at 1 for the memory backend
+    store_connect_timeout: float = 10.0  # seconds
+
+    # Create the system collections and namespace objects when the app starts
+    bootstrap_on_startup: bool = False
+
+    # Background processing, set `worker_concurrency` to 0 to only run standalone `python -m app.worker` workers
+    worker_concurrency: int = 1
+    worker_batch_size: int = 10
+    worker_idle_delay: float = 0.5  # seconds
+    worker_shutdown_timeout: float = 10.0  # seconds
+    queue_max_depth: int = 10_000  # producers wait while the queue is deeper than this
+    queue_put_timeout: float = 5.0  # seconds
+    queue_claim_timeout: float = 300.0  # seconds before an unacknowledged entry is requeued at startup, with Redis
+
+    # Outbox POSTs either process the activity before responding ("sync"), or queue it for the workers and
+    # respond `202 Accepted` with a submission status resource ("async"), which needs Redis for a durable queue
+    outbox_submit_mode: Literal["sync", "async"] = "sync"
+    outbox_batch_max_size: int = 1000  # activities per batch POST
+    outbox_batch_max_bytes: int = 10 * 1024 * 1024  # body size of a batch POST
+
+    # Collection paging
+    collection_page_size: int = 20
+    collection_index_cache_size: int = 1000  # collections whose item positions are kept, for page cursors
+
+    # Verified token cache, entries also expire at the token's own `exp`
+    token_cache_size: int = 10_000
+    token_cache_ttl: int = 300  # seconds
+    token_revocation_check_ttl: float = 5.0  # seconds a revocation lookup in Redis is reused, per user
+
+    # Identity to user cache, invalidated when the user is updated through the bus
+    user_cache_size: int = 10_000
+    user_cache_ttl: int = 300  # seconds
+    link_identities_by_email: bool = False  # attach new logins to the user of an identity with the same verified email
+    provision_lock_timeout: float = 30.0  # seconds, cross-worker lock around first login, needs Redis
+
+    # Anonymous collection reads, invalidated by bus submits
+    response_cache_size: int = 10_000
+    response_cache_ttl: int = 60  # seconds
+    response_cache_stale_ttl: int = 5  # seconds stale entries are served while they refresh
+
+    # Fan-out of activities to local inboxes, collections larger than the threshold (e.g. the followers of a
+    # popular user) are merged into their members' inboxes when those are read instead
+    fanout_read_threshold: int = 5_000
+    fanout_batch_size: int = 500  # inboxes read and written concurrently
+    fanout_stream_size: int = 1_000  # recent activities kept for merging on read
+    fanout_cache_ttl: int = 10  # seconds a process caches the stream registry and collection members
+    fanout_lock_timeout: float = 10.0  # seconds, cross-process lock around each inbox update, needs Redis
+
+    # Live inbox and outbox updates as Server-Sent Events, clients reconnecting with a `Last-Event-ID` get what they
+    # missed if it is still among the process' last `stream_buffer_size` events
+    stream_max_connections: int = 10_000  # per server process, more are refused with a 503
+    stream_queue_size: int = 100  # events queued for a slow client before it is disconnected
+    stream_buffer_size: int = 10_000
+    stream_heartbeat_interval: float = 15.0  # seconds of silence before a keep-alive comment is sent
+
+    # Delivery of local activities to remote inboxes, only when `activity_serve_base_url` is set, since remote
+    # servers need absolute IDs. Off by default: deliveries aren't signed with HTTP Signatures yet
+    delivery_enabled: bool = False
+    delivery_max_connections: int = 100  # pooled HTTP connections, for all hosts
+    delivery_host_concurrency: int = 4  # requests in flight to any one host
+    delivery_batch_size: int = 20  # deliveries sent to an inbox before yielding the host slot
+    delivery_timeout: float = 10.0  # seconds
+    delivery_max_attempts: int = 8  # then the delivery is dead-lettered
+    delivery_backoff_base: float = 1.0  # seconds before the first retry, doubling with each attempt
+    delivery_backoff_max: float = 3600.0  # seconds
+
+    # Shared Redis, optional, used as a cross-worker tier for caches
+    redis_url: str | None = None
+
+    # Request tracing in a `Server-Timing` header, and on-demand profiling of requests sent with an
+    # `X-Profile: <profile_token>` header, disabled without a token
+    server_timing: bool = True
+    profile_token: str | None = None
+    profile_interval: float = 0.001  # seconds between stack samples
 
     # CORS settings
     allow_origins: list[str] = ["*"]
 
     model_config = ConfigDict(env_file=".env", case_sensitive=False)
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """Return the process-wide settings, loaded on first use."""
+    return Settings()
@@ -0,0 +1,60 @@
+"""
+Per-request tracing of the calls a request spends its time in.
+
+The tracing middleware starts a trace for each request in a context variable, store, bus and auth calls made while
+handling it record their durations into it. Outside of a request, e.g. in the worker, recording does nothing.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Iterator
+
+# Spans of the current request, in the order they finished
+Trace = list[tuple[str, float]]
+
+_TRACE: ContextVar[Trace | None] = ContextVar("trace", default=None)
+
+
+def start_trace() -> tuple[Trace, Token]:
+    """Start a trace for the current context, the token resets it with `end_trace`."""
+    trace: Trace = []
+    return trace, _TRACE.set(trace)
+
+
+def end_trace(token: Token) -> None:
+    _TRACE.reset(token)
+
+
+def record(name: str, duration: float) -> None:
+    """Record a span of `duration` seconds in the current trace, if there is one."""
+    trace = _TRACE.get()
+    if trace is not None:
+        trace.append((name, duration))
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time the enclosed block into the current trace."""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start_time)
+
+
+def summarize(trace: Trace) -> dict[str, dict[str, float]]:
+    """Total the spans of a trace by name, as `{name: {"count": n, "ms": total}}`."""
+    summary: dict[str, dict[str, float]] = {}
+    for name, duration in trace:
+        entry = summary.setdefault(name, {"count": 0, "ms": 0.0})
+        entry["count"] += 1
+        entry["ms"] += duration * 1000
+    return summary
+
+
+def server_timing(trace: Trace) -> str:
+    """Format a trace as a `Server-Timing` header value, one metric per span name."""
+    return ", ".join(
+        f'{name};dur={entry["ms"]:.2f};desc="{entry["count"]}x"' for name, entry in summarize(trace).items()
+    )
@@ -1,20 +1,91 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import structlog
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.core.settings import Settings
+from app.core.settings import get_settings
 from app.api import router as api_router
 from app.middleware.logging import LoggingMiddleware
+from app.middleware.metrics import MetricsMiddleware
 from app.middleware.normalize import NormalizeMiddleware
+from app.middleware.profile import ProfileMiddleware
+from app.middleware.tracing import TracingMiddleware
+from app.services.bootstrap import bootstrap_system
+from app.services.delivery import get_deliverer
+from app.services.events import get_event_hub
+from app.services.firebase import get_firebase_app
+from app.services.google_auth import get_signing_keys
+from app.services.invalidation import get_invalidation_channel
+from app.services.queue import get_queue
+from app.services.store import StorePool
+from app.worker import create_worker
+
+logger = structlog.get_logger(__name__)
+
+
+async def warm_up_auth() -> None:
+    """Load what token verification needs off the request path, so the first login doesn't wait for it."""
+    try:
+        if get_settings().google_client_id:
+            await get_signing_keys().refresh()
+        else:
+            await asyncio.to_thread(get_firebase_app)
+    except Exception as e:
+        logger.warning("Auth warm-up failed", error=str(e))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared backend connections and start the background worker for the lifetime of the app."""
+    settings = get_settings()
+    if settings.outbox_submit_mode == "async" and not get_queue().durable:
+        raise RuntimeError("OUTBOX_SUBMIT_MODE=async needs REDIS_URL, queued submissions would be lost on restart")
+
+    warm_up = asyncio.create_task(warm_up_auth())
+
+    # Keeps this process' in-memory caches coherent with the other server processes
+    invalidation = get_invalidation_channel()
+    await invalidation.start()
+
+    # Live updates published by the other server and worker processes
+    event_hub = get_event_hub()
+    await event_hub.start()
+
+    try:
+        async with StorePool(size=settings.store_pool_size, timeout=settings.store_connect_timeout) as store_pool:
+            app.state.store_pool = store_pool
+
+            if settings.bootstrap_on_startup:
+                await bootstrap_system(store_pool.get())
+
+            deliverer = get_deliverer()
+            await deliverer.start(store_pool)
 
-settings = Settings()
+            worker = app.state.worker = create_worker(store_pool)
+            if worker.concurrency:
+                await worker.recover()
+            worker.start()
+            try:
+                yield
+            finally:
+                await worker.stop(settings.worker_shutdown_timeout)
+                await deliverer.stop()
+    finally:
+        warm_up.cancel()
+        await event_hub.stop()
+        await invalidation.stop()
 
 
 def create_app() -> FastAPI:
     """Create and configure the FastAPI application."""
+    settings = get_settings()
     app = FastAPI(
         title="Activity Serve",
         description="ActivityPub-compatible server built with FastAPI",
         version="0.1.0",
+        lifespan=lifespan,
     )
 
     # Add CORS middleware
@@ -27,8 +98,11 @@ def create_app() -> FastAPI:
     )
 
     # Add custom middleware
-    # app.add_middleware(LoggingMiddleware)
-    # app.add_middleware(NormalizeMiddleware)
+    app.add_middleware(MetricsMiddleware)
+    app.add_middleware(TracingMiddleware, server_timing=settings.server_timing)
+    app.add_middleware(LoggingMiddleware)
+    app.add_middleware(NormalizeMiddleware)
+    app.add_middleware(ProfileMiddleware, token=settings.profile_token, interval=settings.profile_interval)
 
     # Include API routers
     app.include_router(api_router)
@@ -36,4 +110,11 @@ def create_app() -> FastAPI:
     return app
 
 
-app = create_app()
+def __getattr__(name: str):
+    # `app.main:app` is created on first access, so importing this module (e.g. for `create_app` in tests) doesn't
+    # build an app, use `uvicorn --factory app.main:create_app` to skip the module attribute altogether
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,59 +1,68 @@
 import time
 import structlog
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.tracing import summarize
 
 logger = structlog.get_logger(__name__)
 
 
-class LoggingMiddleware(BaseHTTPMiddleware):
-    """Middleware for structured logging of HTTP requests."""
-    
-    async def dispatch(
-        self, request: Request, call_next: RequestResponseEndpoint
-    ) -> Response:
-        start_time = time.time()
-        
-        # Extract request details
-        method = request.method
-        path = request.url.path
-        
+class LoggingMiddleware:
+    """
+    Middleware for structured logging of HTTP requests.
+
+    A plain ASGI middleware: it only watches the response start message for the status, so it adds no task
+    and never touches the body.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter_ns()
+        status = None
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
         # Process the request through the next middleware/endpoint
         try:
-            response = await call_next(request)
-            
-            # Calculate request duration
-            duration_ms = round((time.time() - start_time) * 1000)
-            
-            # Extract user_id from request state if available
-            user_id = getattr(request.state, "user", {}).get("id", None)
-            
-            # Log the request details
-            log_data = {
-                "method": method,
-                "path": path,
-                "status": response.status_code,
-                "duration_ms": duration_ms
-            }
-            
-            if user_id:
-                log_data["user_id"] = user_id
-            
-            logger.info("HTTP request", **log_data)
-            
-            return response
+            await self.app(scope, receive, send_with_status)
         except Exception as e:
-            # Calculate request duration
-            duration_ms = round((time.time() - start_time) * 1000)
-            
             # Log the error
             logger.exception(
                 "HTTP request error",
-                method=method,
-                path=path,
+                method=scope["method"],
+                path=scope["path"],
                 error=str(e),
-                duration_ms=duration_ms
+                duration_ms=(time.perf_counter_ns() - start_time) / 1_000_000,
             )
-            
+
             # Re-raise the exception
-            raise
\ No newline at end of file
+            raise
+
+        # Log the request details
+        log_data = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status,
+            "duration_ms": (time.perf_counter_ns() - start_time) / 1_000_000,
+        }
+
+        # Extract user_id and the trace from request state if available
+        state = scope.get("state", {})
+        user = state.get("user")
+        if user:
+            log_data["user_id"] = user.get("id")
+
+        if trace := state.get("trace"):
+            log_data["timings"] = summarize(trace)
+
+        logger.info("HTTP request", **log_data)
@@ -1,88 +1,92 @@
-import json
 from typing import Any
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-import structlog
-
-logger = structlog.get_logger(__name__)
-
-
-class NormalizeMiddleware(BaseHTTPMiddleware):
-    """Middleware for normalizing all incoming and outgoing IDs."""
-    
-    async def dispatch(
-        self, request: Request, call_next: RequestResponseEndpoint
-    ) -> Response:
-        # Process the request and get the response
-        response = await call_next(request)
-        
-        # Check if the response content type is JSON
-        if response.headers.get("content-type") == "application/json":
-            # Read the response body
-            response_body = b""
-            async for chunk in response.body_iterator:
-                response_body += chunk
-            
-            # Parse the JSON response
+
+import orjson
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Fields that hold a bare ID and are normalized along with `id`
+REFERENCE_KEYS = frozenset(("id", "actor", "object", "target", "origin", "inReplyTo"))
+
+
+def is_json(content_type: bytes) -> bool:
+    """Check a content-type header for a JSON media type, including `application/ld+json` etc."""
+    media_type = content_type.partition(b";")[0].strip()
+    return media_type == b"application/json" or media_type.endswith(b"+json")
+
+
+def normalize_ids(data: Any) -> Any:
+    """Normalize all IDs in a JSON structure."""
+    if isinstance(data, dict):
+        return {
+            key: normalize_id(value) if key in REFERENCE_KEYS and isinstance(value, str) else normalize_ids(value)
+            for key, value in data.items()
+        }
+    elif isinstance(data, list):
+        return [normalize_ids(item) for item in data]
+    else:
+        return data
+
+
+def normalize_id(id_str: str) -> str:
+    """Normalize a single ID string."""
+    # Remove trailing slashes
+    if id_str.endswith("/"):
+        id_str = id_str[:-1]
+
+    return id_str
+
+
+class NormalizeMiddleware:
+    """
+    Middleware for normalizing all outgoing IDs.
+
+    A plain ASGI middleware: non-JSON responses stream straight through, and JSON bodies are only decoded and
+    re-encoded when they contain a string ending in a slash, i.e. there may be something to normalize.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        chunks = []
+
+        async def send_normalized(message: Message) -> None:
+            nonlocal start_message
+
+            if message["type"] == "http.response.start":
+                content_type = next((value for key, value in message["headers"] if key == b"content-type"), b"")
+                if is_json(content_type):
+                    # Hold the start until we know whether the body changes
+                    start_message = message
+                    return
+            elif start_message is not None and message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+
+                body = chunks[0] if len(chunks) == 1 else b"".join(chunks)
+                await self._send_body(start_message, body, send)
+                return
+
+            await send(message)
+
+        await self.app(scope, receive, send_normalized)
+
+    async def _send_body(self, start_message: Message, body: bytes, send: Send) -> None:
+        if b'/"' in body:
             try:
-                json_response = json.loads(response_body.decode("utf-8"))
-                
-                # Normalize IDs in the JSON response
-                normalized_response = self._normalize_ids(json_response)
-                
-                # Create a new response with normalized IDs
-                new_response = Response(
-                    content=json.dumps(normalized_response),
-                    status_code=response.status_code,
-                    headers=dict(response.headers),
-                    media_type="application/json"
-                )
-                
-                return new_response
-            except json.JSONDecodeError:
+                body = orjson.dumps(normalize_ids(orjson.loads(body)))
+            except orjson.JSONDecodeError:
                 # If the response is not valid JSON, return it as is
                 pass
-            
-            # Reconstruct the original response if we didn't modify it
-            return Response(
-                content=response_body,
-                status_code=response.status_code,
-                headers=dict(response.headers),
-                media_type=response.media_type
-            )
-        
-        # Return the original response for non-JSON responses
-        return response
-    
-    def _normalize_ids(self, data: Any) -> Any:
-        """Normalize all IDs in a JSON structure."""
-        if isinstance(data, dict):
-            # If it's a dictionary, normalize IDs for each key-value pair
-            result = {}
-            
-            for key, value in data.items():
-                # Normalize ID field
-                if key == "id" and isinstance(value, str):
-                    result[key] = self._normalize_id(value)
-                # Normalize ID values in special ActivityPub fields
-                elif key in ["actor", "object", "target", "origin", "inReplyTo"] and isinstance(value, str):
-                    result[key] = self._normalize_id(value)
-                else:
-                    # Recursively normalize values
-                    result[key] = self._normalize_ids(value)
-            
-            return result
-        elif isinstance(data, list):
-            # If it's a list, normalize each item
-            return [self._normalize_ids(item) for item in data]
-        else:
-            # For other types, return as is
-            return data
-    
-    def _normalize_id(self, id_str: str) -> str:
-        """Normalize a single ID string."""
-        # Remove trailing slashes
-        if id_str.endswith("/"):
-            id_str = id_str[:-1]
-        
-        return id_str
\ No newline at end of file
+            else:
+                headers = [(key, value) for key, value in start_message["headers"] if key != b"content-length"]
+                headers.append((b"content-length", str(len(body)).encode()))
+                start_message = {**start_message, "headers": headers}
+
+        await send(start_message)
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,65 @@
+import hmac
+
+import structlog
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.profiler import Sampler
+
+logger = structlog.get_logger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+
+
+class ProfileMiddleware:
+    """
+    Middleware profiling a single request on demand.
+
+    Requests with an `X-Profile` header matching the configured token are run under the sampling profiler, and
+    answered with the collapsed stacks instead of the response. Without a token, profiling is disabled.
+    """
+
+    def __init__(self, app: ASGIApp, token: str | None = None, interval: float = 0.001):
+        self.app = app
+        self.token = token.encode() if token else None
+        self.interval = interval
+
+    def is_profiled(self, scope: Scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return hmac.compare_digest(value, self.token)
+        return False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or self.token is None or not self.is_profiled(scope):
+            await self.app(scope, receive, send)
+            return
+
+        status = None
+
+        async def discard(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        sampler = Sampler(self.interval)
+        sampler.start()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            sampler.stop()
+
+        logger.info("Profiled request", method=scope["method"], path=scope["path"], samples=sampler.samples.total())
+
+        body = sampler.collapsed().encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/plain; charset=utf-8"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"x-profile-status", str(status).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,35 @@
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.tracing import end_trace, server_timing, start_trace
+
+
+class TracingMiddleware:
+    """
+    Middleware tracing the store, bus and auth calls of each request.
+
+    The spans recorded before the response starts are sent in a `Server-Timing` header, the whole trace is left in
+    the request state for the logging middleware.
+    """
+
+    def __init__(self, app: ASGIApp, server_timing: bool = True):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace, token = start_trace()
+        scope.setdefault("state", {})["trace"] = trace
+
+        async def send_with_timing(message: Message) -> None:
+            if message["type"] == "http.response.start" and trace:
+                MutableHeaders(scope=message).append("Server-Timing", server_timing(trace))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing if self.server_timing else send)
+        finally:
+            end_trace(token)
@@ -1,13 +1,17 @@
+import asyncio
 from datetime import datetime, UTC
-from activity_bus import ActivityBus
 
+from activity_store import ActivityStore
 
-async def bootstrap_system() -> None:
-    return
+from app.services.store import store_many
+from app.services.user import backfill_identity_index
 
-    """Bootstrap system collections and namespace objects."""
-    store = ActivityBus()
 
+async def bootstrap_system(store: ActivityStore) -> None:
+    """
+    Bootstrap system collections and namespace objects, safe to run again: only the missing objects are created,
+    existing ones and the items of the collections are left as they are.
+    """
     # Create system namespace collection
     ns_collection = {
         "@context": "https://www.w3.org/ns/activitystreams",
@@ -19,8 +23,6 @@ async def bootstrap_system() -> None:
         "items": [],
     }
 
-    await store.store(ns_collection)
-
     # Create Identity type in namespace
     identity_type = {
         "@context": [
@@ -34,8 +36,6 @@ async def bootstrap_system() -> None:
         "published": datetime.now(UTC).isoformat(),
     }
 
-    await store.store(identity_type)
-
     # Create system behaviors collection
     behaviors_collection = {
         "@context": "https://www.w3.org/ns/activitystreams",
@@ -47,4 +47,10 @@ async def bootstrap_system() -> None:
         "items": [],
     }
 
-    await store.store(behaviors_collection)
+    # Every process runs this at startup, so never overwrite what is already there
+    objects = [ns_collection, identity_type, behaviors_collection]
+    existing = await asyncio.gather(*[store.dereference(obj["id"]) for obj in objects])
+    await store_many(store, [obj for obj, found in zip(objects, existing) if not found])
+
+    # Identities stored before the identity index existed, only done once
+    await backfill_identity_index(store)
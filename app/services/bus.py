@@ -0,0 +1,80 @@
+import time
+from typing import Any, Awaitable, Callable
+
+import structlog
+from activity_store import ActivityStore
+
+from app.core.metrics import BUS_SUBMIT_DURATION
+from app.core.tracing import record
+from app.services.queue import get_queue
+
+logger = structlog.get_logger(__name__)
+
+Listener = Callable[[ActivityStore, dict[str, Any]], Awaitable[None]]
+
+_LISTENERS: list[Listener] = []
+_AFTER_LISTENERS: list[Listener] = []
+
+
+def on_submit(listener: Listener) -> Listener:
+    """
+    Register a coroutine to be called with every activity submitted through `submit_activity`, before it returns.
+
+    These delay the response, keep them to cheap work like cache invalidation.
+    """
+    _LISTENERS.append(listener)
+    return listener
+
+
+def after_submit(listener: Listener) -> Listener:
+    """Register a coroutine to be called with every submitted activity by the background workers, after the fact."""
+    _AFTER_LISTENERS.append(listener)
+    return listener
+
+
+async def run_listeners(store: ActivityStore, activity: dict[str, Any], listeners: list[Listener]) -> None:
+    """Call listeners in order, logging their errors: the activity was submitted whatever they do."""
+    for listener in listeners:
+        try:
+            await listener(store, activity)
+        except Exception:
+            logger.exception("Submit listener failed", listener=listener.__qualname__, activity_id=activity.get("id"))
+
+
+async def run_after_submit(store: ActivityStore, activity: dict[str, Any]) -> None:
+    """Run the `after_submit` listeners, called by the workers for the entries `submit_activity` queued."""
+    await run_listeners(store, activity, _AFTER_LISTENERS)
+
+
+async def submit_activity(store: ActivityStore, activity: dict[str, Any]) -> dict[str, Any]:
+    """Submit an activity to the bus, let the listeners react to it, and queue it for the `after_submit` ones."""
+    from activity_bus import ActivityBus
+
+    start_time = time.perf_counter()
+    try:
+        result = await ActivityBus(store=store).submit(activity)
+    finally:
+        elapsed = time.perf_counter() - start_time
+        BUS_SUBMIT_DURATION.observe(elapsed)
+        record("bus.submit", elapsed)
+
+    submitted = result or activity
+    await run_listeners(store, submitted, _LISTENERS)
+
+    if _AFTER_LISTENERS:
+        queue = get_queue()
+        if not queue.consumed:
+            # No worker reads this process' queue, e.g. `worker_concurrency` is 0 without Redis
+            await run_after_submit(store, submitted)
+            return result
+
+        try:
+            # Never held back by the queue's backpressure, that would stall the request
+            await queue.put({"activity": submitted, "after_submit": True}, wait=False)
+        except Exception as e:
+            logger.warning(
+                "Queueing submit listeners failed, running them now", activity_id=submitted.get("id"), error=str(e)
+            )
+            await run_after_submit(store, submitted)
+
+    return result
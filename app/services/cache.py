@@ -0,0 +1,76 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """A bounded least-recently-used cache with optional per-entry expiry."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[Any, float | None]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value, counting the hit or miss."""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self._data[key]
+            self._removed(key, value)
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        """Set a value, evicting the least recently used entries past `maxsize`."""
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            evicted, (evicted_value, _) = self._data.popitem(last=False)
+            self._removed(evicted, evicted_value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove a key, returning its value if it was present."""
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return default
+        self._removed(key, entry[0])
+        return entry[0]
+
+    def items(self) -> list[tuple[Hashable, Any]]:
+        """Return a snapshot of the cached key/value pairs, including expired ones."""
+        return [(key, value) for key, (value, _) in self._data.items()]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def _removed(self, key: Hashable, value: Any) -> None:
+        """Called when an entry expires, is evicted or popped, for subclasses that index the entries."""
+
+    def stats(self) -> dict[str, Any]:
+        """Return the size and hit/miss counters of the cache."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
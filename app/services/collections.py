@@ -0,0 +1,200 @@
+import base64
+import binascii
+import time
+from functools import lru_cache
+from typing import Any
+from urllib.parse import urlencode
+
+from activity_store.utils import first_id
+
+from app.core.metrics import register_cache
+from app.core.settings import get_settings
+from app.services.cache import LRUCache
+from app.services.invalidation import get_invalidation_channel
+
+ITEM_KEYS = ("orderedItems", "items")
+MAX_PAGE_SIZE = 100
+
+
+class RootCache(LRUCache):
+    """
+    Cache of collection roots, so a root request doesn't dereference and count the whole collection.
+
+    `invalidate` drops a root in every server process, through the invalidation channel. A root loaded before the
+    last invalidation of its collection is not cached, `set` takes the time its load started for that.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float | None = None):
+        super().__init__(maxsize, ttl)
+        self._invalidated = LRUCache(maxsize, ttl)
+
+    def set(self, key: str, value: Any, ttl: float | None = None, loaded_at: float | None = None) -> None:
+        """Cache a root, unless its collection was invalidated since `loaded_at`, a `time.monotonic()`."""
+        if loaded_at is not None and self._invalidated.get(key, 0.0) >= loaded_at:
+            return
+        super().set(key, value, ttl)
+
+    def drop(self, collection_id: str | None) -> None:
+        """Drop a root from this process, or every root with None."""
+        if collection_id is None:
+            self.clear()
+            return
+        self._invalidated.set(collection_id, time.monotonic())
+        self.pop(collection_id)
+
+    async def invalidate(self, collection_id: str) -> None:
+        """Drop a collection's root, after the collection changed."""
+        await get_invalidation_channel().publish("collection-roots", collection_id)
+
+
+@lru_cache
+def get_root_cache() -> RootCache:
+    """Return the process-wide cache of collection roots."""
+    settings = get_settings()
+    root_cache = RootCache(maxsize=settings.response_cache_size, ttl=settings.response_cache_ttl)
+    register_cache("collection_roots", root_cache)
+    get_invalidation_channel().subscribe("collection-roots", root_cache.drop)
+    return root_cache
+
+
+@lru_cache
+def get_position_cache() -> LRUCache:
+    """Return the process-wide cache of item positions, by collection ID, see `index_of`."""
+    position_cache = LRUCache(maxsize=get_settings().collection_index_cache_size)
+    register_cache("collection_positions", position_cache)
+    return position_cache
+
+
+def index_of(collection_id: str, items: list[Any], item_id: str) -> int:
+    """
+    Find the index of an item in a collection, raises ValueError if it is not there.
+
+    Positions are counted from the back of the collection, which new items don't change, and cached: a lookup is
+    checked against the items and the positions are only rebuilt when it misses, e.g. after items were removed.
+    """
+    position_cache = get_position_cache()
+    positions = position_cache.get(collection_id)
+    if positions is not None and (position := positions.get(item_id)) is not None:
+        index = len(items) - 1 - position
+        if 0 <= index < len(items) and first_id(items[index]) == item_id:
+            return index
+
+    positions = {first_id(item): len(items) - 1 - index for index, item in enumerate(items)}
+    position_cache.set(collection_id, positions)
+    if item_id not in positions:
+        raise ValueError("Unknown cursor")
+    return len(items) - 1 - positions[item_id]
+
+
+def encode_cursor(item_id: str) -> str:
+    """Encode an item ID as an opaque page cursor."""
+    return base64.urlsafe_b64encode(item_id.encode()).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> str:
+    """Decode a page cursor back into the item ID, raises ValueError if it is malformed."""
+    try:
+        return base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def encode_since(position: int, item_id: str) -> str:
+    """Encode a delta cursor: how many items a collection had, and the newest of them."""
+    return encode_cursor(f"{position}:{item_id}")
+
+
+def decode_since(cursor: str) -> tuple[int, str]:
+    """Decode a delta cursor into its position and item ID, raises ValueError if it is malformed."""
+    position, _, item_id = decode_cursor(cursor).partition(":")
+    if not position.isdigit():
+        raise ValueError("Invalid cursor")
+    return int(position), item_id
+
+
+def get_items(collection: dict[str, Any]) -> list[Any]:
+    """Get the items of a collection, whether they are stored as `orderedItems` or `items`."""
+    for key in ITEM_KEYS:
+        if items := collection.get(key):
+            return items
+    return []
+
+
+def page_url(collection_id: str, **params: Any) -> str:
+    """Build the URL of a page of a collection."""
+    params = {key: value for key, value in params.items() if value is not None}
+    return f"{collection_id}?{urlencode({'page': 'true', **params})}"
+
+
+def collection_root(collection: dict[str, Any]) -> dict[str, Any]:
+    """
+    Return the root of a paged collection: its metadata, `totalItems` and a link to the `first` page,
+    without the items themselves.
+    """
+    root = {key: value for key, value in collection.items() if key not in ITEM_KEYS}
+    root.setdefault("totalItems", len(get_items(collection)))
+    root["first"] = page_url(collection["id"])
+    return root
+
+
+def collection_page(
+    collection: dict[str, Any],
+    limit: int,
+    after: str | None = None,
+    before: str | None = None,
+    since: str | None = None,
+) -> dict[str, Any]:
+    """
+    Return one OrderedCollectionPage of a collection.
+
+    Pages are keyset paginated: `after` and `before` are opaque cursors naming the item a page starts
+    after or ends before, so a page stays stable when items are added to the collection.
+
+    `since` is a delta cursor, from the `prev` link of the first page: the page has the oldest `limit` items
+    added after it, and its own `prev` link the cursor to fetch what's added after them. Items are only ever
+    added to the front of a collection, so an item's position counted from the back doesn't change, and the
+    cursor's item is found there without a scan unless items were removed since.
+
+    Raises a ValueError if a cursor is malformed or names an item that is not in the collection.
+    """
+    items = get_items(collection)
+    collection_id = collection["id"]
+
+    if after is not None:
+        start = index_of(collection_id, items, decode_cursor(after)) + 1
+        end = start + limit
+    elif before is not None:
+        end = index_of(collection_id, items, decode_cursor(before))
+        start = max(end - limit, 0)
+    elif since is not None:
+        position, item_id = decode_since(since)
+        end = len(items) - position
+        if not item_id and position == 0:
+            end = len(items)
+        elif not (0 <= end < len(items) and first_id(items[end]) == item_id):
+            end = index_of(collection_id, items, item_id)
+        start = max(end - limit, 0)
+    else:
+        start, end = 0, limit
+
+    page_items = items[start:end]
+
+    page = {
+        "@context": collection.get("@context", "https://www.w3.org/ns/activitystreams"),
+        "id": page_url(collection_id, limit=limit, after=after, before=before, since=since),
+        "type": "OrderedCollectionPage",
+        "partOf": collection_id,
+        "totalItems": collection.get("totalItems", len(items)),
+        "orderedItems": page_items,
+    }
+
+    if page_items and end < len(items):
+        page["next"] = page_url(collection_id, limit=limit, after=encode_cursor(first_id(page_items[-1])))
+    if page_items and start > 0:
+        page["prev"] = page_url(collection_id, limit=limit, before=encode_cursor(first_id(page_items[0])))
+    elif start == 0:
+        # Nothing newer yet, the items added from now on
+        head = first_id(items[0]) if items else ""
+        page["prev"] = page_url(collection_id, limit=limit, since=encode_since(len(items), head))
+
+    return page
@@ -0,0 +1,517 @@
+"""
+Delivery of local activities to remote inboxes.
+
+Every activity submitted through the bus is checked for remote recipients: absolute `http(s)` IDs in its audience,
+and the remote members of the actor's own collections it is addressed to, like its followers. Recipients are
+resolved to their inbox, or their server's shared inbox, so one server gets one copy however many of its actors are
+addressed. The activity is encoded once, with absolute IDs, and queued per destination inbox.
+
+Each destination is drained by one task, in batches, so deliveries to an inbox stay in order and reuse the pooled
+connection, while a per-host semaphore bounds the requests in flight to any one server. A failed delivery stays at
+the head of its inbox's queue and is retried with exponential backoff, holding back the later ones, until it is
+delivered or dead-lettered once it runs out of attempts or fails permanently.
+
+Remote requests only go to public addresses: a host is resolved before connecting, refused if any of its addresses
+is loopback, private, link-local or otherwise not globally routable, and the connection is made to the address that
+was checked, so a DNS answer changing in between can't redirect it. Redirects are not followed.
+
+Pending deliveries live in memory: the ones not yet delivered when the process stops are logged and dropped.
+"""
+
+import asyncio
+import ipaddress
+import random
+import socket
+from collections import deque
+from datetime import datetime, UTC
+from functools import lru_cache
+from typing import Any, Awaitable, Callable
+from urllib.parse import urlsplit
+
+import httpx
+import orjson
+import structlog
+from activity_store import ActivityStore
+from activity_store.utils import first_id
+from nanoid import generate
+
+from app.core.metrics import DELIVERIES, register_collector
+from app.core.settings import get_settings
+from app.services.bus import after_submit
+from app.services.cache import LRUCache
+from app.services.collections import get_items
+from app.services.response_cache import AUDIENCE_KEYS
+from app.services.store import StorePool
+
+logger = structlog.get_logger(__name__)
+
+COLLECTION_TYPES = frozenset(("Collection", "OrderedCollection"))
+
+PUBLIC = frozenset(("https://www.w3.org/ns/activitystreams#Public", "as:Public", "Public"))
+
+# Fields holding IDs, made absolute before an activity leaves the server
+LINK_KEYS = frozenset(
+    (
+        *AUDIENCE_KEYS,
+        "id",
+        "actor",
+        "object",
+        "target",
+        "origin",
+        "inReplyTo",
+        "attributedTo",
+        "inbox",
+        "outbox",
+        "followers",
+        "following",
+        "partOf",
+        "first",
+        "next",
+        "prev",
+    )
+)
+
+# Blind recipients are delivered to, but never shown
+PRIVATE_KEYS = ("bto", "bcc")
+
+ACTIVITY_JSON = 'application/ld+json; profile="https://www.w3.org/ns/activitystreams"'
+ACTOR_HEADERS = {"Accept": f"{ACTIVITY_JSON}, application/activity+json"}
+DELIVERY_HEADERS = {"Content-Type": ACTIVITY_JSON}
+
+# Responses worth retrying, other 4xx responses won't get better
+RETRY_STATUSES = frozenset((408, 425, 429))
+
+# Resolves a host and port to the address to connect to, raises ForbiddenAddress if it isn't public
+Resolver = Callable[[str, int], Awaitable[str]]
+
+
+class ForbiddenAddress(ValueError):
+    """A remote URL that resolves to an address the server must not connect to."""
+
+
+def is_public_address(address: str) -> bool:
+    ip = ipaddress.ip_address(address)
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def resolve_public(host: str, port: int) -> str:
+    """Resolve a host to the address to connect to, refusing hosts with any non-public address."""
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise httpx.ConnectError(f"Cannot resolve {host}: {e}") from e
+
+    addresses = [info[4][0] for info in infos]
+    if not addresses or not all(is_public_address(address) for address in addresses):
+        raise ForbiddenAddress(f"{host} does not resolve to a public address")
+    return addresses[0]
+
+
+def is_remote(value: Any) -> bool:
+    return isinstance(value, str) and value.startswith(("https://", "http://")) and value not in PUBLIC
+
+
+def get_audience(activity: dict[str, Any]) -> set[str]:
+    """The IDs an activity is addressed to, actors and collections."""
+    audience = set()
+    for key in AUDIENCE_KEYS:
+        values = activity.get(key) or []
+        if not isinstance(values, list):
+            values = [values]
+        audience.update(audience_id for value in values if isinstance(audience_id := first_id(value), str))
+    return audience
+
+
+def get_remote_recipients(activity: dict[str, Any]) -> set[str]:
+    """The remote actors an activity is addressed to."""
+    return {recipient_id for recipient_id in get_audience(activity) if is_remote(recipient_id)}
+
+
+def get_owned_collections(activity: dict[str, Any]) -> set[str]:
+    """
+    The local collections an activity is addressed to that belong to its actor, like its followers.
+
+    Only these are expanded to their members, an actor can't reach the members of someone else's collections.
+    """
+    actor = first_id(activity.get("actor"))
+    if not isinstance(actor, str) or not actor.startswith("/"):
+        return set()
+    return {audience_id for audience_id in get_audience(activity) if audience_id.startswith(f"{actor}/")}
+
+
+async def get_remote_members(store: ActivityStore, activity: dict[str, Any]) -> set[str]:
+    """The remote members of the actor's own collections an activity is addressed to."""
+    collection_ids = sorted(get_owned_collections(activity))
+    collections = await asyncio.gather(*[store.dereference(collection_id) for collection_id in collection_ids])
+    return {
+        member
+        for collection in collections
+        if collection and collection.get("type") in COLLECTION_TYPES
+        for item in get_items(collection)
+        if is_remote(member := first_id(item))
+    }
+
+
+def absolutize(data: Any, base_url: str) -> Any:
+    """Prefix the local, relative IDs in a JSON structure with the base URL."""
+    if isinstance(data, dict):
+        return {
+            key: absolutize_link(value, base_url) if key in LINK_KEYS else absolutize(value, base_url)
+            for key, value in data.items()
+        }
+    if isinstance(data, list):
+        return [absolutize(item, base_url) for item in data]
+    return data
+
+
+def absolutize_link(value: Any, base_url: str) -> Any:
+    if isinstance(value, str):
+        return base_url + value if value.startswith("/") else value
+    if isinstance(value, list):
+        return [absolutize_link(item, base_url) for item in value]
+    return absolutize(value, base_url)
+
+
+def encode_for_delivery(activity: dict[str, Any], base_url: str) -> bytes:
+    """Encode an activity as it is sent to every destination: absolute IDs, blind recipients removed."""
+    public = {key: value for key, value in activity.items() if key not in PRIVATE_KEYS}
+    return orjson.dumps(absolutize(public, base_url.rstrip("/")))
+
+
+class Deliverer:
+    """
+    Delivers activities to remote inboxes over one pooled HTTP client.
+
+    `submit` returns right away, `join` waits until everything submitted was delivered or dead-lettered.
+    """
+
+    def __init__(
+        self,
+        base_url: str | None,
+        max_connections: int = 100,
+        host_concurrency: int = 4,
+        batch_size: int = 20,
+        timeout: float = 10.0,
+        max_attempts: int = 8,
+        backoff_base: float = 1.0,
+        backoff_max: float = 3600.0,
+        actor_cache_size: int = 10_000,
+        actor_cache_ttl: float = 3600,
+        address_cache_ttl: float = 60,
+        transport: httpx.AsyncBaseTransport | None = None,
+        resolver: Resolver = resolve_public,
+    ):
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.host_concurrency = host_concurrency
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.transport = transport
+        self.resolver = resolver
+        self.actors = LRUCache(actor_cache_size, ttl=actor_cache_ttl)
+        self.addresses = LRUCache(actor_cache_size, ttl=address_cache_ttl)
+        self.client: httpx.AsyncClient | None = None
+        self.store_pool: StorePool | None = None
+        self.delivered = 0
+        self.retried = 0
+        self.dead = 0
+        self._hosts: dict[str, asyncio.Semaphore] = {}
+        self._pending: dict[str, deque[dict[str, Any]]] = {}
+        self._draining: dict[str, asyncio.Task] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._retrying: set[str] = set()
+        self._outstanding = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def started(self) -> bool:
+        return self.client is not None
+
+    async def start(self, store_pool: StorePool | None = None) -> None:
+        """Open the HTTP client, dead letters are stored through `store_pool` when given."""
+        if self.base_url is None:
+            logger.info("Remote delivery disabled, it needs DELIVERY_ENABLED and ACTIVITY_SERVE_BASE_URL")
+            return
+
+        self.store_pool = store_pool
+        self._hosts.clear()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.client = httpx.AsyncClient(
+            transport=self.transport,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            headers={"User-Agent": "activity-serve"},
+        )
+
+    async def stop(self) -> None:
+        """Cancel every pending delivery and close the client."""
+        client, self.client = self.client, None
+        if client is None:
+            return
+
+        dropped = sum(len(queue) for queue in self._pending.values())
+
+        tasks = [*self._tasks, *self._draining.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        self._pending.clear()
+        self._outstanding = 0
+        self._idle.set()
+        await client.aclose()
+
+        if dropped:
+            logger.warning("Remote deliveries dropped on shutdown", count=dropped)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "pending": sum(len(queue) for queue in self._pending.values()),
+            "retrying": len(self._retrying),
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "dead": self.dead,
+        }
+
+    async def join(self) -> None:
+        """Wait until every submitted activity was delivered or dead-lettered."""
+        await self._idle.wait()
+
+    def submit(self, activity: dict[str, Any], recipients: set[str] | None = None) -> None:
+        """Deliver an activity to its remote recipients, by default those it is addressed to, in the background."""
+        if not self.started:
+            return
+
+        if recipients is None:
+            recipients = get_remote_recipients(activity)
+        if not recipients:
+            return
+
+        job = {
+            "activity": activity.get("id"),
+            "actor": first_id(activity.get("actor")),
+            "body": encode_for_delivery(activity, self.base_url),
+        }
+        self._begin()
+        self._spawn(self._resolve(job, recipients))
+
+    def backoff(self, attempts: int) -> float:
+        """Seconds to wait before the next attempt, doubling with each attempt, with jitter."""
+        delay = min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        """
+        Send a request to a remote URL, connecting to the public address its host was checked to resolve to.
+
+        Raises ForbiddenAddress for URLs that aren't http(s), or whose host resolves to a non-public address.
+        """
+        parts = urlsplit(url)
+        host = parts.hostname
+        if parts.scheme not in ("http", "https") or not host:
+            raise ForbiddenAddress(f"Not a remote URL: {url}")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+
+        address = self.addresses.get((host, port))
+        if address is None:
+            address = await self.resolver(host, port)
+            self.addresses.set((host, port), address)
+
+        # The URL names the address, the Host header and TLS server name still name the host
+        bracketed = f"[{host}]" if ":" in host else host
+        pinned = parts._replace(netloc=f"[{address}]:{port}" if ":" in address else f"{address}:{port}")
+        headers = {**kwargs.pop("headers", {}), "Host": f"{bracketed}:{parts.port}" if parts.port else bracketed}
+        return await self.client.request(
+            method, pinned.geturl(), headers=headers, extensions={"sni_hostname": host}, **kwargs
+        )
+
+    async def get_inbox(self, actor_id: str) -> str | None:
+        """The inbox to deliver to for an actor: its server's shared inbox, or its own."""
+        actor = self.actors.get(actor_id)
+        if actor is None:
+            response = await self.request("GET", actor_id, headers=ACTOR_HEADERS)
+            response.raise_for_status()
+            actor = response.json()
+            self.actors.set(actor_id, actor)
+
+        endpoints = actor.get("endpoints")
+        shared_inbox = endpoints.get("sharedInbox") if isinstance(endpoints, dict) else None
+        return first_id(shared_inbox or actor.get("inbox"))
+
+    def _begin(self) -> None:
+        self._outstanding += 1
+        self._idle.clear()
+
+    def _end(self) -> None:
+        self._outstanding -= 1
+        if self._outstanding <= 0:
+            self._outstanding = 0
+            self._idle.set()
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _resolve(self, job: dict[str, Any], recipients: set[str]) -> None:
+        """Resolve the recipients' inboxes and queue one delivery per distinct inbox."""
+        try:
+            # Actors on the same server mostly share an inbox, so a large following is a few deliveries
+            inboxes = set()
+            semaphore = asyncio.Semaphore(self.max_connections)
+
+            async def get_inbox(actor_id: str) -> str | None:
+                async with semaphore:
+                    return await self.get_inbox(actor_id)
+
+            results = await asyncio.gather(*[get_inbox(r) for r in recipients], return_exceptions=True)
+            for recipient, result in zip(recipients, results):
+                if isinstance(result, BaseException) or not is_remote(result):
+                    logger.warning("Remote recipient has no inbox", recipient=recipient, error=str(result))
+                    continue
+                inboxes.add(result)
+
+            for inbox in inboxes:
+                self._begin()
+                self._enqueue({**job, "inbox": inbox, "attempts": 0})
+        finally:
+            self._end()
+
+    def _enqueue(self, delivery: dict[str, Any]) -> None:
+        inbox = delivery["inbox"]
+        self._pending.setdefault(inbox, deque()).append(delivery)
+        if inbox not in self._draining:
+            self._draining[inbox] = asyncio.create_task(self._drain(inbox))
+
+    async def _drain(self, inbox: str) -> None:
+        """
+        Send the deliveries queued for one inbox, a batch at a time per host slot.
+
+        A delivery to retry stays first in the queue: the drain waits out its backoff, without the host slot, and
+        tries it again before any later one, so they still arrive in order.
+        """
+        host = urlsplit(inbox).netloc
+        semaphore = self._hosts.setdefault(host, asyncio.Semaphore(self.host_concurrency))
+        queue = self._pending[inbox]
+        try:
+            while queue:
+                delay = None
+                async with semaphore:
+                    for _ in range(min(self.batch_size, len(queue))):
+                        if (delay := await self._deliver(queue[0])) is not None:
+                            break
+                        queue.popleft()
+
+                if delay is not None:
+                    self._retrying.add(inbox)
+                    try:
+                        await asyncio.sleep(delay)
+                    finally:
+                        self._retrying.discard(inbox)
+        finally:
+            self._draining.pop(inbox, None)
+            if not queue:
+                self._pending.pop(inbox, None)
+
+    async def _deliver(self, delivery: dict[str, Any]) -> float | None:
+        """Send a delivery, returns the seconds to wait before retrying it, or None once it is done with."""
+        try:
+            response = await self.request("POST", delivery["inbox"], content=delivery["body"], headers=DELIVERY_HEADERS)
+        except ForbiddenAddress as e:
+            return self._failed(delivery, str(e), retry=False)
+        except httpx.HTTPError as e:
+            return self._failed(delivery, f"{type(e).__name__}: {e}", retry=True)
+
+        if response.is_success:
+            self.delivered += 1
+            DELIVERIES.inc("delivered")
+            self._end()
+            return None
+
+        status = response.status_code
+        return self._failed(delivery, f"HTTP {status}", retry=status >= 500 or status in RETRY_STATUSES)
+
+    def _failed(self, delivery: dict[str, Any], error: str, retry: bool) -> float | None:
+        delivery["attempts"] += 1
+        if retry and delivery["attempts"] < self.max_attempts:
+            self.retried += 1
+            DELIVERIES.inc("retried")
+            return self.backoff(delivery["attempts"])
+
+        self._spawn(self._dead_letter(delivery, error))
+        return None
+
+    async def _dead_letter(self, delivery: dict[str, Any], error: str) -> None:
+        """Record a delivery that won't be retried, next to the actor that sent it."""
+        self.dead += 1
+        DELIVERIES.inc("dead")
+        logger.warning(
+            "Remote delivery failed",
+            inbox=delivery["inbox"],
+            activity_id=delivery["activity"],
+            attempts=delivery["attempts"],
+            error=error,
+        )
+        try:
+            if self.store_pool is not None and delivery["actor"]:
+                await self.store_pool.get().store(
+                    {
+                        "@context": [
+                            "https://www.w3.org/ns/activitystreams",
+                            {"activity-serve": "https://example.org/ns/"},
+                        ],
+                        "id": f"{delivery['actor']}/dead-letters/{generate()}",
+                        "type": "DeadLetter",
+                        "attributedTo": delivery["actor"],
+                        "object": delivery["activity"],
+                        "target": delivery["inbox"],
+                        "attempts": delivery["attempts"],
+                        "error": error,
+                        "published": datetime.now(UTC).isoformat(),
+                    }
+                )
+        except Exception:
+            logger.exception("Storing a dead letter failed", inbox=delivery["inbox"])
+        finally:
+            self._end()
+
+
+@lru_cache
+def get_deliverer() -> Deliverer:
+    """Return the process-wide deliverer, configured from settings."""
+    settings = get_settings()
+    return Deliverer(
+        settings.activity_serve_base_url if settings.delivery_enabled else None,
+        max_connections=settings.delivery_max_connections,
+        host_concurrency=settings.delivery_host_concurrency,
+        batch_size=settings.delivery_batch_size,
+        timeout=settings.delivery_timeout,
+        max_attempts=settings.delivery_max_attempts,
+        backoff_base=settings.delivery_backoff_base,
+        backoff_max=settings.delivery_backoff_max,
+    )
+
+
+@after_submit
+async def deliver_submitted(store: ActivityStore, activity: dict[str, Any]) -> None:
+    """Hand activities submitted by local actors to the deliverer, with the remote members of their collections."""
+    actor = first_id(activity.get("actor"))
+    deliverer = get_deliverer()
+    if isinstance(actor, str) and actor.startswith("/") and deliverer.started:
+        deliverer.submit(activity, get_remote_recipients(activity) | await get_remote_members(store, activity))
+
+
+def collect_delivery_pending() -> list:
+    return [("activity_serve_delivery_pending", {}, get_deliverer().stats()["pending"])]
+
+
+register_collector(
+    "activity_serve_delivery_pending", "gauge", "Remote deliveries queued for sending.", collect_delivery_pending
+)
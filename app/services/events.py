@@ -0,0 +1,212 @@
+"""
+Live updates of collections, for streaming clients.
+
+Activities added to a collection are published under the collection's ID. A client subscribes to the collections it
+follows, and is sent their events as they happen. Each process keeps the last `stream_buffer_size` events, so a
+client reconnecting with the ID of the last event it saw is sent what it missed, or told to refetch when that is no
+longer available. With Redis, events reach the subscribers of every process through pub/sub.
+"""
+
+import asyncio
+import itertools
+import uuid
+from collections import deque
+from functools import lru_cache
+from typing import Any, Iterable
+
+import orjson
+import structlog
+from nanoid import generate
+
+from app.core.metrics import register_collector
+from app.core.redis import RedisSubscriber, get_redis
+from app.core.settings import get_settings
+
+logger = structlog.get_logger(__name__)
+
+REDIS_CHANNEL = "activity-serve:events"
+
+# An event ID and its encoded data, or (None, b"") when the subscriber may have missed events and should refetch
+Event = tuple[str | None, bytes]
+RESET: Event = (None, b"")
+
+
+class TooManyConnections(Exception):
+    """Raised when subscribing to a hub that already has as many subscribers as it allows."""
+
+
+class Subscription:
+    """The events of a set of topics, queued for one client until it reads them."""
+
+    def __init__(self, topics: frozenset[str], maxsize: int):
+        self.topics = topics
+        self.maxsize = maxsize
+        self.overflowed = False
+        self._events: deque[Event] = deque()
+        self._ready = asyncio.Event()
+
+    def put(self, event: Event) -> None:
+        # A client this far behind is disconnected, to resume from the hub's buffer when it reconnects
+        if len(self._events) >= self.maxsize:
+            self.overflowed = True
+        else:
+            self._events.append(event)
+        self._ready.set()
+
+    async def get(self, timeout: float) -> list[Event]:
+        """Wait up to `timeout` seconds for events, returns the queued events, none on timeout."""
+        if not self._events and not self.overflowed:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+
+        events = list(self._events)
+        self._events.clear()
+        return events
+
+
+class EventHub:
+    """Publishes events to the subscribers of this process, the stand-in for a single process or without Redis."""
+
+    def __init__(self, buffer_size: int = 10_000, queue_size: int = 100, max_connections: int | None = None):
+        self.buffer_size = buffer_size
+        self.queue_size = queue_size
+        self.max_connections = max_connections
+        self._subscribers: dict[str, set[Subscription]] = {}
+        self._connections = 0
+        self._buffer: deque[tuple[int, str, frozenset[str], bytes]] = deque()
+        self._positions: dict[str, int] = {}
+        self._sequence = itertools.count()
+
+    def __len__(self) -> int:
+        return self._connections
+
+    def subscribe(self, topics: Iterable[str]) -> Subscription:
+        """Subscribe to the events of `topics`, raises TooManyConnections when every connection slot is taken."""
+        # Checked and taken without awaiting, so concurrent subscribers can't both get the last slot
+        if self.max_connections is not None and self._connections >= self.max_connections:
+            raise TooManyConnections(f"The hub is limited to {self.max_connections} connections")
+
+        subscription = Subscription(frozenset(topics), self.queue_size)
+        for topic in subscription.topics:
+            self._subscribers.setdefault(topic, set()).add(subscription)
+        self._connections += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        for topic in subscription.topics:
+            subscribers = self._subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[topic]
+        self._connections -= 1
+
+    def replay(self, topics: frozenset[str], last_event_id: str) -> list[Event] | None:
+        """The buffered events of `topics` published after `last_event_id`, None if it is no longer buffered."""
+        position = self._positions.get(last_event_id)
+        if position is None:
+            return None
+
+        start = position - self._buffer[0][0] + 1
+        return [
+            (event_id, data)
+            for _, event_id, event_topics, data in itertools.islice(self._buffer, start, None)
+            if not topics.isdisjoint(event_topics)
+        ]
+
+    def dispatch(self, event_id: str, topics: frozenset[str], data: bytes) -> None:
+        """Buffer an event and queue it for the subscribers of its topics in this process."""
+        position = next(self._sequence)
+        self._buffer.append((position, event_id, topics, data))
+        self._positions[event_id] = position
+        while len(self._buffer) > self.buffer_size:
+            self._positions.pop(self._buffer.popleft()[1], None)
+
+        subscribers = set()
+        for topic in topics:
+            subscribers.update(self._subscribers.get(topic, ()))
+        for subscription in subscribers:
+            subscription.put((event_id, data))
+
+    def reset(self) -> None:
+        """Forget the buffered events and tell every subscriber to refetch, after events may have been missed."""
+        self._buffer.clear()
+        self._positions.clear()
+        for subscription in set().union(*self._subscribers.values()):
+            subscription.put(RESET)
+
+    async def publish(self, topics: Iterable[str], data: Any) -> None:
+        """Send `data` to the subscribers of any of `topics`."""
+        self.dispatch(generate(), frozenset(topics), orjson.dumps(data))
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class RedisEventHub(EventHub):
+    """
+    Publishes events to the subscribers of every process subscribed to the same Redis channel.
+
+    Events are best effort: a failed publish is only logged, and since pub/sub doesn't replay what was missed while
+    disconnected, every subscriber is told to refetch when the subscription is re-established.
+    """
+
+    def __init__(self, redis: Any, channel: str = REDIS_CHANNEL, retry_delay: float = 1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.redis = redis
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self.subscriber = RedisSubscriber(redis, channel, self.receive, self.reset, retry_delay)
+
+    async def publish(self, topics: Iterable[str], data: Any) -> None:
+        event_id, topics = generate(), sorted(topics)
+        self.dispatch(event_id, frozenset(topics), orjson.dumps(data))
+        try:
+            await self.redis.publish(
+                self.channel,
+                orjson.dumps({"origin": self.origin, "id": event_id, "topics": topics, "data": data}),
+            )
+        except Exception as e:
+            logger.warning("Publishing an event failed", error=str(e))
+
+    def receive(self, data: bytes) -> None:
+        """Dispatch an event published by another process."""
+        message = orjson.loads(data)
+        if message.get("origin") != self.origin:
+            self.dispatch(message["id"], frozenset(message["topics"]), orjson.dumps(message["data"]))
+
+    async def start(self) -> None:
+        await self.subscriber.start()
+
+    async def stop(self) -> None:
+        await self.subscriber.stop()
+
+
+@lru_cache
+def get_event_hub() -> EventHub:
+    """Return the event hub, shared through Redis when it is configured."""
+    settings = get_settings()
+    kwargs = {
+        "buffer_size": settings.stream_buffer_size,
+        "queue_size": settings.stream_queue_size,
+        "max_connections": settings.stream_max_connections,
+    }
+    redis = get_redis()
+    if redis is None:
+        return EventHub(**kwargs)
+    return RedisEventHub(redis, **kwargs)
+
+
+def collect_stream_connections() -> list:
+    return [("activity_serve_stream_connections", {}, len(get_event_hub()))]
+
+
+register_collector(
+    "activity_serve_stream_connections", "gauge", "Open streaming connections.", collect_stream_connections
+)
@@ -0,0 +1,290 @@
+"""
+Fan-out of activities to the inboxes of local recipients.
+
+Local recipients are the local actors in an activity's audience, directly or as members of a local collection like
+the author's followers. Their inboxes are read and written in concurrent batches, one write per inbox.
+
+Collections larger than `fanout_read_threshold` are fanned out on read instead: the activity is added once to the
+collection's stream, `<collection-id>/stream`, and merged into a member's inbox the next time it is read. The
+collections with a stream are listed in the `/system/fanout` registry.
+
+Read-modify-writes of inboxes, streams and the registry are serialized by a lock per object: in-process, and with
+Redis also across server and worker processes.
+"""
+
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Any, AsyncIterator
+
+from activity_store import ActivityStore
+from activity_store.utils import first_id
+
+from app.core.redis import get_redis
+from app.core.settings import get_settings
+from app.services.bus import after_submit
+from app.services.cache import LRUCache
+from app.services.collections import get_items
+from app.services.delivery import PRIVATE_KEYS, get_audience, get_owned_collections
+from app.services.events import get_event_hub
+from app.services.response_cache import get_response_cache
+
+REGISTRY_ID = "/system/fanout"
+LOCK_PREFIX = "activity-serve:fanout:"
+COLLECTION_TYPES = frozenset(("Collection", "OrderedCollection"))
+
+# Inbox field recording how much of each stream was merged into it
+STREAMS_KEY = "activity-serve:streams"
+
+_LOCKS: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+
+
+def get_lock(object_id: str) -> asyncio.Lock:
+    """The in-process lock serializing read-modify-writes of an object."""
+    lock = _LOCKS.get(object_id)
+    if lock is None:
+        lock = _LOCKS[object_id] = asyncio.Lock()
+    return lock
+
+
+@asynccontextmanager
+async def locked(object_id: str) -> AsyncIterator[None]:
+    """Hold an object's lock for a read-modify-write, across processes when Redis is set up."""
+    async with get_lock(object_id):
+        redis = get_redis()
+        if redis is None:
+            yield
+            return
+
+        timeout = get_settings().fanout_lock_timeout
+        async with redis.lock(f"{LOCK_PREFIX}{object_id}", timeout=timeout, blocking_timeout=timeout):
+            yield
+
+
+def is_local_actor(value: Any) -> bool:
+    # Local users live at /u/<user-key>
+    return isinstance(value, str) and value.startswith("/u/") and value.count("/") == 2
+
+
+def get_stream_id(collection_id: str) -> str:
+    return f"{collection_id}/stream"
+
+
+@lru_cache
+def get_fanout_cache() -> LRUCache:
+    """Recently read registry and collection members, for merging streams on read."""
+    return LRUCache(maxsize=1_000, ttl=get_settings().fanout_cache_ttl)
+
+
+async def resolve_recipients(store: ActivityStore, activity: dict[str, Any]) -> tuple[set[str], list[str]]:
+    """
+    Resolve the local audience of an activity.
+
+    Returns the local actors whose inboxes to write to, and the collections too large to expand, which are fanned
+    out on read. Only the actor's own collections are expanded, like its followers: an actor can't reach the
+    members of someone else's.
+    """
+    actor = first_id(activity.get("actor"))
+    actors = {audience_id for audience_id in get_audience(activity) if is_local_actor(audience_id)}
+    collection_ids = sorted(get_owned_collections(activity) - actors)
+    collections = await asyncio.gather(*[store.dereference(collection_id) for collection_id in collection_ids])
+
+    threshold = get_settings().fanout_read_threshold
+    large = []
+    for collection_id, collection in zip(collection_ids, collections):
+        if not collection or collection.get("type") not in COLLECTION_TYPES:
+            continue
+        members = [member for item in get_items(collection) if is_local_actor(member := first_id(item))]
+        if len(members) > threshold:
+            large.append(collection_id)
+        else:
+            actors.update(members)
+
+    actors.discard(actor)
+    return actors, large
+
+
+def prepend_items(inbox: dict[str, Any], item_ids: list[str]) -> bool:
+    """Add items to the front of an inbox, skipping the ones it has, returns True if it changed."""
+    items = get_items(inbox)
+    present = {first_id(item) for item in items}
+    new_ids = [item_id for item_id in item_ids if item_id not in present]
+    if not new_ids:
+        return False
+
+    key = "orderedItems" if "orderedItems" in inbox else "items"
+    inbox[key] = [*new_ids, *items]
+    if "totalItems" in inbox:
+        inbox["totalItems"] = len(inbox[key])
+    return True
+
+
+async def add_to_inbox(store: ActivityStore, inbox_id: str, activity_id: str) -> bool:
+    """Add an activity to an inbox, returns True if it changed."""
+    async with locked(inbox_id):
+        inbox = await store.dereference(inbox_id)
+        if not inbox or not prepend_items(inbox, [activity_id]):
+            return False
+        await store.store(inbox)
+        return True
+
+
+async def write_inboxes(store: ActivityStore, inbox_ids: list[str], activity_id: str) -> list[str]:
+    """Add an activity to inboxes, a batch at a time, returns the IDs of the inboxes that changed."""
+    batch_size = get_settings().fanout_batch_size
+    changed = []
+    for start in range(0, len(inbox_ids), batch_size):
+        batch = inbox_ids[start : start + batch_size]
+        results = await asyncio.gather(*[add_to_inbox(store, inbox_id, activity_id) for inbox_id in batch])
+        changed.extend(inbox_id for inbox_id, added in zip(batch, results) if added)
+    return changed
+
+
+async def append_to_stream(store: ActivityStore, collection_id: str, activity_id: str) -> None:
+    """Add an activity to a large collection's stream, registering the stream on first use."""
+    stream_id = get_stream_id(collection_id)
+    async with locked(stream_id):
+        stream = await store.dereference(stream_id) or {
+            "@context": "https://www.w3.org/ns/activitystreams",
+            "id": stream_id,
+            "type": "OrderedCollection",
+            "partOf": collection_id,
+            "orderedItems": [],
+            "totalItems": 0,
+        }
+        if stream["orderedItems"] and stream["orderedItems"][0] == activity_id:
+            return
+
+        # `totalItems` counts every activity ever added, members remember how far they have merged
+        stream["orderedItems"] = [activity_id, *stream["orderedItems"]][: get_settings().fanout_stream_size]
+        stream["totalItems"] += 1
+        await store.store(stream)
+
+    async with locked(REGISTRY_ID):
+        registry = await store.dereference(REGISTRY_ID) or {
+            "@context": "https://www.w3.org/ns/activitystreams",
+            "id": REGISTRY_ID,
+            "type": "Collection",
+            "items": [],
+        }
+        if collection_id not in registry["items"]:
+            registry["items"] = [*registry["items"], collection_id]
+            await store.store(registry)
+            get_fanout_cache().pop(REGISTRY_ID)
+
+
+@lru_cache
+def get_recent_merges() -> LRUCache:
+    """Inboxes this process merged streams into lately, see `merge_streams_throttled`."""
+    return LRUCache(maxsize=10_000, ttl=get_settings().fanout_cache_ttl)
+
+
+async def get_cached(store: ActivityStore, object_id: str) -> dict[str, Any] | None:
+    fanout_cache = get_fanout_cache()
+    obj = fanout_cache.get(object_id)
+    if obj is None:
+        obj = await store.dereference(object_id) or {}
+        fanout_cache.set(object_id, obj)
+    return obj
+
+
+async def get_members(store: ActivityStore, collection_id: str) -> frozenset[str]:
+    fanout_cache = get_fanout_cache()
+    key = ("members", collection_id)
+    members = fanout_cache.get(key)
+    if members is None:
+        collection = await store.dereference(collection_id) or {}
+        members = frozenset(first_id(item) for item in get_items(collection))
+        fanout_cache.set(key, members)
+    return members
+
+
+async def get_streamed_collections(store: ActivityStore, actor_id: str) -> list[str]:
+    """The large collections an actor belongs to, which are fanned out to it on read."""
+    registry = await get_cached(store, REGISTRY_ID)
+    return [
+        collection_id
+        for collection_id in (registry or {}).get("items", [])
+        if actor_id in await get_members(store, collection_id)
+    ]
+
+
+async def merge_streams(store: ActivityStore, actor_id: str, inbox_id: str) -> bool:
+    """
+    Merge the new activities of the large collections an actor belongs to into its inbox.
+
+    A member's first merge of a stream takes its most recent `collection_page_size` activities. Returns True if the
+    inbox changed.
+    """
+    member_of = await get_streamed_collections(store, actor_id)
+    if not member_of:
+        return False
+
+    async with locked(inbox_id):
+        inbox = await store.dereference(inbox_id)
+        if not inbox:
+            return False
+
+        merged = dict(inbox.get(STREAMS_KEY) or {})
+        new_ids = []
+        for collection_id in member_of:
+            stream = await store.dereference(get_stream_id(collection_id))
+            if not stream:
+                continue
+            total, items = stream["totalItems"], stream["orderedItems"]
+            unseen = total - merged[collection_id] if collection_id in merged else get_settings().collection_page_size
+            new_ids.extend(items[: min(unseen, len(items))])
+            merged[collection_id] = total
+
+        if merged == inbox.get(STREAMS_KEY):
+            return False
+
+        changed = prepend_items(inbox, new_ids)
+        inbox[STREAMS_KEY] = merged
+        await store.store(inbox)
+        return changed
+
+
+async def merge_streams_throttled(store: ActivityStore, actor_id: str, inbox_id: str) -> bool:
+    """`merge_streams`, at most once every `fanout_cache_ttl` seconds per inbox, for merging on every read."""
+    recent_merges = get_recent_merges()
+    if recent_merges.get(inbox_id):
+        return False
+    recent_merges.set(inbox_id, True)
+    return await merge_streams(store, actor_id, inbox_id)
+
+
+async def fan_out(store: ActivityStore, activity: dict[str, Any]) -> tuple[list[str], list[str]]:
+    """
+    Add an activity to the inboxes of its local recipients.
+
+    Returns the inboxes written to, and the large collections whose members get it on read.
+    """
+    activity_id = first_id(activity.get("id"))
+    if not activity_id:
+        return [], []
+
+    actors, large = await resolve_recipients(store, activity)
+    for collection_id in large:
+        await append_to_stream(store, collection_id, activity_id)
+
+    return await write_inboxes(store, [f"{actor}/inbox" for actor in actors], activity_id), large
+
+
+@after_submit
+async def fan_out_submitted(store: ActivityStore, activity: dict[str, Any]) -> None:
+    """Fan submitted activities out to local inboxes, mark the cached inboxes stale and push them to streams."""
+    response_cache = get_response_cache()
+    inbox_ids, large = await fan_out(store, activity)
+    for inbox_id in inbox_ids:
+        await response_cache.invalidate(inbox_id)
+
+    # Inbox streams also follow the large collections their actor belongs to
+    topics = [*inbox_ids, *large]
+    actor = first_id(activity.get("actor"))
+    if is_local_actor(actor):
+        topics.append(f"{actor}/outbox")
+    if topics:
+        public = {key: value for key, value in activity.items() if key not in PRIVATE_KEYS}
+        await get_event_hub().publish(topics, public)
@@ -1,13 +1,35 @@
-from typing import Any
-from firebase_admin import initialize_app, auth
+import threading
+from typing import TYPE_CHECKING, Any
 
-initialize_app()
+if TYPE_CHECKING:
+    from firebase_admin import App
+
+_INIT_LOCK = threading.Lock()
+
+
+def get_firebase_app() -> "App":
+    """
+    Get the Firebase app, initializing it on first use.
+
+    Importing firebase_admin and discovering credentials is slow, so it is kept out of imports and startup: the app
+    lifespan warms it up in a thread, without waiting for it.
+    """
+    with _INIT_LOCK:
+        import firebase_admin
+
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            return firebase_admin.initialize_app()
 
 
 def verify_id_token(id_token: str) -> dict[str, Any]:
     """Verify a Firebase Auth ID token."""
+    app = get_firebase_app()
+    from firebase_admin import auth
+
     try:
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = auth.verify_id_token(id_token, app=app)
         return decoded_token
     except Exception as e:
         raise ValueError(str(e))
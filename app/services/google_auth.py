@@ -0,0 +1,146 @@
+"""
+Local verification of Google ID tokens.
+
+Tokens are checked against Google's signing certificates, which are fetched once and then refreshed in the
+background before they expire, so no request waits on Google after the first, and a failing refresh leaves the
+current keys in use for a grace period. The signature check is CPU-bound and
+runs in a thread, off the event loop.
+"""
+
+import asyncio
+import re
+import time
+from functools import lru_cache
+from typing import Any
+
+import httpx
+import structlog
+from jose import jwk, jwt
+
+from app.core.settings import get_settings
+
+logger = structlog.get_logger(__name__)
+
+MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class SigningKeys:
+    """
+    Signing keys by key ID, loaded from a URL serving `{kid: x509 PEM certificate}`, like Google's certs endpoint.
+
+    Keys are kept for the `max-age` the endpoint sends, and refreshed in the background once within
+    `refresh_margin` of expiring, while the current keys keep being served. If refreshing fails, expired keys are
+    still served for up to `grace_period` seconds, so an outage of the endpoint doesn't become an auth outage.
+    Fetches, including the one for an unknown key ID in case the keys were rotated early, are attempted at most
+    once every `min_refresh_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        timeout: float = 5.0,
+        default_ttl: float = 3600,
+        refresh_margin: float = 300,
+        min_refresh_interval: float = 60,
+        grace_period: float = 3600,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.url = url
+        self.timeout = timeout
+        self.default_ttl = default_ttl
+        self.refresh_margin = refresh_margin
+        self.min_refresh_interval = min_refresh_interval
+        self.grace_period = grace_period
+        self.transport = transport
+        self._keys: dict[str, Any] = {}
+        self._expires_at = 0.0
+        self._attempted_at = float("-inf")
+        self._refreshing: asyncio.Task | None = None
+
+    def can_refresh(self, now: float) -> bool:
+        """Whether a fetch is in flight to join, or the last attempt was long enough ago to try again."""
+        return self._refreshing is not None or now - self._attempted_at >= self.min_refresh_interval
+
+    async def get(self, kid: str) -> Any | None:
+        """Return the key for a key ID, or None if it is unknown, raises if no usable keys could be loaded."""
+        now = time.time()
+        if not self._keys or now >= self._expires_at + self.grace_period:
+            if not self.can_refresh(now):
+                raise RuntimeError("Signing keys unavailable, the last refresh failed")
+            # Shielded, so a caller being cancelled doesn't cancel the fetch the others wait on
+            await asyncio.shield(self.refresh())
+        elif now >= self._expires_at - self.refresh_margin and self.can_refresh(now):
+            self.refresh()
+
+        key = self._keys.get(kid)
+        if key is None and self.can_refresh(now):
+            await asyncio.shield(self.refresh())
+            key = self._keys.get(kid)
+        return key
+
+    def refresh(self) -> asyncio.Task:
+        """Fetch the keys, sharing one fetch between every caller while it is in flight."""
+        if self._refreshing is None:
+            self._attempted_at = time.time()
+            self._refreshing = asyncio.create_task(self._fetch())
+            self._refreshing.add_done_callback(self._refreshed)
+        return self._refreshing
+
+    def _refreshed(self, task: asyncio.Task) -> None:
+        self._refreshing = None
+        if not task.cancelled() and (error := task.exception()):
+            # The current keys are kept, a lookup tries again after `min_refresh_interval`
+            logger.warning("Signing keys refresh failed", url=self.url, error=str(error))
+
+    async def _fetch(self) -> None:
+        async with httpx.AsyncClient(timeout=self.timeout, transport=self.transport) as client:
+            response = await client.get(self.url)
+            response.raise_for_status()
+
+        ttl = self.default_ttl
+        if match := MAX_AGE_RE.search(response.headers.get("cache-control", "")):
+            ttl = int(match.group(1))
+
+        keys = {kid: jwk.construct(pem, "RS256") for kid, pem in response.json().items()}
+        now = time.time()
+        self._keys = keys
+        self._expires_at = now + ttl
+
+
+@lru_cache
+def get_signing_keys() -> SigningKeys:
+    """Return the process-wide Google signing keys."""
+    return SigningKeys(get_settings().google_certs_url)
+
+
+async def verify_google_token(token: str) -> dict[str, Any]:
+    """
+    Verify a Google ID token and return its claims.
+
+    The audience must be the configured `google_client_id`. Raises ValueError if the token is invalid.
+    """
+    settings = get_settings()
+    try:
+        header = jwt.get_unverified_header(token)
+    except Exception as e:
+        raise ValueError(str(e))
+
+    try:
+        key = await get_signing_keys().get(header.get("kid"))
+    except Exception as e:
+        raise ValueError(f"Signing keys unavailable: {e}")
+    if key is None:
+        raise ValueError("Token is signed with an unknown key")
+
+    try:
+        return await asyncio.to_thread(
+            jwt.decode,
+            token,
+            key,
+            algorithms=["RS256"],
+            audience=settings.google_client_id,
+            issuer=settings.google_issuers,
+            options={"verify_at_hash": False},
+        )
+    except Exception as e:
+        raise ValueError(str(e))
@@ -0,0 +1,98 @@
+"""
+Cache invalidation messages between server processes.
+
+Each server process keeps its own in-memory caches. A cache subscribes to a topic with a handler that drops one key
+from it, or everything when the key is None. `publish` runs the handlers of this process right away, and with Redis
+those of every other process through pub/sub.
+"""
+
+import uuid
+from functools import lru_cache
+from typing import Any, Callable
+
+import orjson
+import structlog
+
+from app.core.redis import RedisSubscriber, get_redis
+
+logger = structlog.get_logger(__name__)
+
+REDIS_CHANNEL = "activity-serve:invalidate"
+
+# Drops a key from a cache, or everything with None
+Handler = Callable[[str | None], None]
+
+
+class LocalChannel:
+    """Delivers invalidations within this process only, the stand-in for a single process or without Redis."""
+
+    def __init__(self):
+        self._handlers: dict[str, list[Handler]] = {}
+
+    def subscribe(self, topic: str, handler: Handler) -> None:
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def dispatch(self, topic: str, key: str | None) -> None:
+        """Run the local handlers of a topic."""
+        for handler in self._handlers.get(topic, ()):
+            try:
+                handler(key)
+            except Exception:
+                logger.exception("Invalidation handler failed", topic=topic, key=key)
+
+    def dispatch_all(self) -> None:
+        """Clear every subscribed cache."""
+        for topic in self._handlers:
+            self.dispatch(topic, None)
+
+    async def publish(self, topic: str, key: str | None) -> None:
+        """Invalidate `key` in every cache subscribed to `topic`."""
+        self.dispatch(topic, key)
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class RedisChannel(LocalChannel):
+    """
+    Delivers invalidations to every process subscribed to the same Redis channel.
+
+    Pub/sub doesn't replay messages missed while disconnected, so the subscribed caches are cleared whenever the
+    subscription is re-established.
+    """
+
+    def __init__(self, redis: Any, channel: str = REDIS_CHANNEL, retry_delay: float = 1.0):
+        super().__init__()
+        self.redis = redis
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        # Whatever was published while we weren't listening is lost
+        self.subscriber = RedisSubscriber(redis, channel, self.receive, self.dispatch_all, retry_delay)
+
+    async def publish(self, topic: str, key: str | None) -> None:
+        self.dispatch(topic, key)
+        await self.redis.publish(self.channel, orjson.dumps({"origin": self.origin, "topic": topic, "key": key}))
+
+    def receive(self, data: bytes) -> None:
+        """Apply a message published by another process."""
+        message = orjson.loads(data)
+        if message.get("origin") != self.origin:
+            self.dispatch(message["topic"], message["key"])
+
+    async def start(self) -> None:
+        await self.subscriber.start()
+
+    async def stop(self) -> None:
+        await self.subscriber.stop()
+
+
+@lru_cache
+def get_invalidation_channel() -> LocalChannel:
+    """Return the invalidation channel, shared through Redis when it is configured."""
+    redis = get_redis()
+    if redis is None:
+        return LocalChannel()
+    return RedisChannel(redis)
@@ -0,0 +1,227 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from functools import lru_cache
+from typing import Any, Iterable
+
+import orjson
+
+from app.core.metrics import Samples, register_collector
+from app.core.redis import get_redis
+from app.core.settings import get_settings
+
+REDIS_KEY = "activity-serve:queue"
+
+
+class QueueFull(Exception):
+    """Raised when the queue stays above its maximum depth for longer than the put timeout."""
+
+
+class ActivityQueue(ABC):
+    """
+    A queue of work for the background workers, each entry is a dict holding at least the `activity`.
+
+    Producers are held back while the queue is deeper than `max_depth`, and fail with QueueFull if it doesn't
+    drain within `put_timeout` seconds. Claimed entries are acknowledged with `ack` once processed. Only a `durable`
+    queue keeps entries, claimed or not, across restarts, and can be read by other processes: otherwise entries are
+    only read by the `consumers` this process' workers run.
+    """
+
+    durable = False
+
+    def __init__(self, max_depth: int = 10_000, put_timeout: float = 5.0):
+        self.max_depth = max_depth
+        self.put_timeout = put_timeout
+        self.consumers = 0
+
+    @property
+    def consumed(self) -> bool:
+        """Whether anything reads the queue, a durable one is assumed to be read by standalone workers."""
+        return self.durable or self.consumers > 0
+
+    async def put(self, *entries: dict[str, Any], wait: bool = True) -> None:
+        """Add entries to the queue, waiting for room if it is too deep, or failing right away without `wait`."""
+        await self.put_many(entries, wait=wait)
+
+    async def put_many(self, entries: Iterable[dict[str, Any]], wait: bool = True) -> None:
+        """Add entries to the queue in order with one write, once there is room for them, see `put`."""
+        entries = list(entries)
+        if not entries:
+            return
+
+        deadline = time.monotonic() + (self.put_timeout if wait else 0)
+        delay = 0.01
+        while await self.depth() >= self.max_depth:
+            if time.monotonic() >= deadline:
+                raise QueueFull(f"Activity queue is over {self.max_depth} entries deep")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+        now = time.time()
+        await self._push([{**entry, "enqueued_at": now} for entry in entries])
+
+    @abstractmethod
+    async def claim(self, count: int) -> list[dict[str, Any]]:
+        """Take up to `count` entries off the front of the queue."""
+
+    async def ack(self, entry: dict[str, Any]) -> None:
+        """Acknowledge a claimed entry, it won't be requeued."""
+
+    async def release(self, *entries: dict[str, Any]) -> None:
+        """Put claimed entries back at the front of the queue, in order, for a consumer that can't process them."""
+
+    async def requeue_stale(self) -> int:
+        """Put entries claimed too long ago, by a consumer that died, back on the queue, returns how many."""
+        return 0
+
+    @abstractmethod
+    async def depth(self) -> int:
+        """Number of entries waiting to be claimed."""
+
+    async def lag(self) -> float:
+        """Seconds the oldest entry has been waiting."""
+        oldest = await self._peek()
+        return max(time.time() - oldest["enqueued_at"], 0.0) if oldest else 0.0
+
+    async def stats(self) -> dict[str, Any]:
+        return {"depth": await self.depth(), "lag": await self.lag(), "max_depth": self.max_depth}
+
+    @abstractmethod
+    async def _push(self, entries: list[dict[str, Any]]) -> None:
+        """Append entries, already stamped with `enqueued_at`, to the back of the queue."""
+
+    @abstractmethod
+    async def _peek(self) -> dict[str, Any] | None:
+        """The entry at the front of the queue, None if it is empty."""
+
+
+class MemoryQueue(ActivityQueue):
+    """An in-process queue, for a single server with in-process workers, its entries are lost on restart."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._entries: deque[dict[str, Any]] = deque()
+
+    async def claim(self, count: int) -> list[dict[str, Any]]:
+        return [self._entries.popleft() for _ in range(min(count, len(self._entries)))]
+
+    async def release(self, *entries: dict[str, Any]) -> None:
+        self._entries.extendleft(reversed(entries))
+
+    async def depth(self) -> int:
+        return len(self._entries)
+
+    async def _push(self, entries: list[dict[str, Any]]) -> None:
+        self._entries.extend(entries)
+
+    async def _peek(self) -> dict[str, Any] | None:
+        return self._entries[0] if self._entries else None
+
+
+class RedisQueue(ActivityQueue):
+    """
+    A Redis list shared by every server and worker process.
+
+    Claimed entries are moved atomically to a processing list, and their claim time recorded, until they are
+    acknowledged. Entries claimed more than `claim_timeout` seconds ago, by a worker that crashed or was killed,
+    are put back by `requeue_stale`, so every entry is processed at least once.
+    """
+
+    durable = True
+
+    def __init__(self, redis: Any, key: str = REDIS_KEY, claim_timeout: float = 300, **kwargs):
+        super().__init__(**kwargs)
+        self.redis = redis
+        self.key = key
+        self.processing_key = f"{key}:processing"
+        self.claims_key = f"{key}:claims"
+        self.claim_timeout = claim_timeout
+        self._claimed: dict[int, bytes] = {}
+
+    async def claim(self, count: int) -> list[dict[str, Any]]:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for _ in range(count):
+                pipe.lmove(self.key, self.processing_key, "LEFT", "RIGHT")
+            claimed = [raw for raw in await pipe.execute() if raw is not None]
+        if not claimed:
+            return []
+
+        await self.redis.zadd(self.claims_key, {raw: time.time() for raw in claimed})
+        entries = []
+        for raw in claimed:
+            entry = orjson.loads(raw)
+            self._claimed[id(entry)] = raw
+            entries.append(entry)
+        return entries
+
+    async def ack(self, entry: dict[str, Any]) -> None:
+        raw = self._claimed.pop(id(entry), None)
+        if raw is None:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.lrem(self.processing_key, 1, raw)
+            pipe.zrem(self.claims_key, raw)
+            await pipe.execute()
+
+    async def release(self, *entries: dict[str, Any]) -> None:
+        for entry in reversed(entries):
+            raw = self._claimed.pop(id(entry), None)
+            if raw is not None and await self.redis.lrem(self.processing_key, 1, raw):
+                await self.redis.lpush(self.key, raw)
+                await self.redis.zrem(self.claims_key, raw)
+
+    async def requeue_stale(self) -> int:
+        processing = await self.redis.lrange(self.processing_key, 0, -1)
+        if not processing:
+            return 0
+
+        # An entry without a claim time was moved by a worker that died before recording it
+        claimed_at = await self.redis.zmscore(self.claims_key, processing)
+        horizon = time.time() - self.claim_timeout
+        requeued = 0
+        for raw, at in zip(processing, claimed_at):
+            if at is not None and at > horizon:
+                continue
+            # Only the process that takes it off the processing list puts it back
+            if await self.redis.lrem(self.processing_key, 1, raw):
+                await self.redis.lpush(self.key, raw)
+                requeued += 1
+            await self.redis.zrem(self.claims_key, raw)
+        return requeued
+
+    async def depth(self) -> int:
+        return await self.redis.llen(self.key)
+
+    async def _push(self, entries: list[dict[str, Any]]) -> None:
+        await self.redis.rpush(self.key, *(orjson.dumps(entry) for entry in entries))
+
+    async def _peek(self) -> dict[str, Any] | None:
+        entry = await self.redis.lindex(self.key, 0)
+        return orjson.loads(entry) if entry else None
+
+
+@lru_cache
+def get_queue() -> ActivityQueue:
+    """Return the activity queue, shared through Redis when it is configured."""
+    settings = get_settings()
+    kwargs = {"max_depth": settings.queue_max_depth, "put_timeout": settings.queue_put_timeout}
+
+    redis = get_redis()
+    if redis is None:
+        return MemoryQueue(**kwargs)
+    return RedisQueue(redis, claim_timeout=settings.queue_claim_timeout, **kwargs)
+
+
+async def collect_queue_depth() -> Samples:
+    return [("activity_serve_queue_depth", {}, await get_queue().depth())]
+
+
+async def collect_queue_lag() -> Samples:
+    return [("activity_serve_queue_lag_seconds", {}, await get_queue().lag())]
+
+
+register_collector("activity_serve_queue_depth", "gauge", "Activities waiting in the queue.", collect_queue_depth)
+register_collector(
+    "activity_serve_queue_lag_seconds", "gauge", "Age of the oldest activity in the queue.", collect_queue_lag
+)
@@ -0,0 +1,203 @@
+import asyncio
+import time
+from functools import lru_cache
+from typing import Any, Awaitable, Callable
+
+import orjson
+import structlog
+from activity_store import ActivityStore
+from activity_store.utils import first_id
+
+from app.core.metrics import register_cache
+from app.core.redis import get_redis
+from app.core.settings import get_settings
+from app.services.bus import on_submit
+from app.services.cache import LRUCache
+from app.services.collections import get_root_cache
+
+logger = structlog.get_logger(__name__)
+
+REDIS_PREFIX = "activity-serve:responses:"
+
+# Loads an encoded response, returning the body and its validators (`ETag`, `Last-Modified`)
+Loader = Callable[[], Awaitable[tuple[bytes, dict[str, str]]]]
+
+# Fields of an activity naming the actors it is addressed to
+AUDIENCE_KEYS = ("to", "cc", "bto", "bcc", "audience")
+
+
+class ResponseCache:
+    """
+    Cache of encoded collection responses, shared by every anonymous reader.
+
+    Entries are grouped by the collection they were rendered from. `invalidate` doesn't drop a collection's
+    entries, it marks them stale: for `stale_ttl` seconds after an invalidation (or after an entry's `ttl`), stale
+    entries are still served while a single background refresh per entry replaces them, so a burst of writes to a
+    popular collection doesn't turn into a burst of store reads. Past that window a reader waits for a fresh load.
+
+    Entries are kept in a local LRU, or in Redis when a client is given.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 60, stale_ttl: float = 5, redis: Any = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.redis = redis
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._entries = LRUCache(maxsize, ttl=ttl + stale_ttl)
+        self._invalidated: dict[str, float] = {}
+        self._loading: dict[str, asyncio.Future] = {}
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.stale_hits) / total if total else 0.0,
+        }
+
+    async def get_or_load(self, collection_id: str, key: str, load: Loader) -> tuple[bytes, dict[str, str]]:
+        """
+        Get the response cached under `key`, or `load` it.
+
+        `load` returns the encoded body and its validator headers, and so does this.
+        """
+        entry, invalidated_at = await self._get(collection_id, key)
+
+        if entry is not None:
+            now = time.time()
+            age = now - entry["loaded_at"]
+            current = entry["loaded_at"] > invalidated_at
+
+            if current and age < self.ttl:
+                self.hits += 1
+                return entry["body"], entry["validators"]
+
+            if (current and age < self.ttl + self.stale_ttl) or (not current and now - invalidated_at < self.stale_ttl):
+                self.stale_hits += 1
+                self._load(collection_id, key, load)
+                return entry["body"], entry["validators"]
+
+        self.misses += 1
+        entry = await asyncio.shield(self._load(collection_id, key, load))
+        return entry["body"], entry["validators"]
+
+    async def invalidate(self, collection_id: str) -> None:
+        """Mark every cached response of a collection as stale, and drop its cached root."""
+        await get_root_cache().invalidate(collection_id)
+        now = time.time()
+
+        if self.redis is not None:
+            await self.redis.set(f"{REDIS_PREFIX}invalidated:{collection_id}", now, ex=int(self.ttl + self.stale_ttl))
+            return
+
+        if len(self._invalidated) >= self.maxsize:
+            # Entries don't outlive ttl + stale_ttl, so neither do the invalidations that could concern them
+            horizon = now - self.ttl - self.stale_ttl
+            self._invalidated = {key: at for key, at in self._invalidated.items() if at > horizon}
+        self._invalidated[collection_id] = now
+
+    async def _get(self, collection_id: str, key: str) -> tuple[dict[str, Any] | None, float]:
+        if self.redis is None:
+            return self._entries.get(key), self._invalidated.get(collection_id, 0.0)
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(f"{REDIS_PREFIX}{key}")
+            pipe.get(f"{REDIS_PREFIX}invalidated:{collection_id}")
+            data, invalidated_at = await pipe.execute()
+
+        invalidated_at = float(invalidated_at) if invalidated_at else 0.0
+        # Entries written before validators were kept count as misses
+        if b"validators" not in data:
+            return None, invalidated_at
+
+        entry = {
+            "body": data[b"body"],
+            "validators": orjson.loads(data[b"validators"]),
+            "loaded_at": float(data[b"loaded_at"]),
+        }
+        return entry, invalidated_at
+
+    async def _put(self, key: str, entry: dict[str, Any]) -> None:
+        if self.redis is None:
+            self._entries.set(key, entry)
+            return
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(f"{REDIS_PREFIX}{key}", mapping={**entry, "validators": orjson.dumps(entry["validators"])})
+            pipe.expire(f"{REDIS_PREFIX}{key}", int(self.ttl + self.stale_ttl))
+            await pipe.execute()
+
+    def _load(self, collection_id: str, key: str, load: Loader) -> asyncio.Future:
+        """Load an entry, sharing the load with everyone who asks for the same key meanwhile."""
+        if task := self._loading.get(key):
+            return task
+
+        async def load_entry() -> dict[str, Any]:
+            # Stamped before loading, so an invalidation during the load leaves the entry stale
+            loaded_at = time.time()
+            body, validators = await load()
+            entry = {"body": body, "validators": validators, "loaded_at": loaded_at}
+            await self._put(key, entry)
+            return entry
+
+        def done(task: asyncio.Future) -> None:
+            self._loading.pop(key, None)
+            # Retrieve the error, background refreshes have no one else to do it
+            if not task.cancelled() and (error := task.exception()):
+                logger.debug("Response cache load failed", key=key, error=str(error))
+
+        task = asyncio.ensure_future(load_entry())
+        task.add_done_callback(done)
+        self._loading[key] = task
+        return task
+
+
+def get_touched_collections(activity: dict[str, Any]) -> set[str]:
+    """The local collections a submitted activity lands in: the actor's outbox and the recipients' inboxes."""
+    collections = set()
+
+    if actor := first_id(activity.get("actor")):
+        collections.add(f"{actor}/outbox")
+
+    for key in AUDIENCE_KEYS:
+        recipients = activity.get(key) or []
+        if not isinstance(recipients, list):
+            recipients = [recipients]
+        for recipient in recipients:
+            recipient_id = first_id(recipient)
+            # Local users live at /u/<user-key>
+            if isinstance(recipient_id, str) and recipient_id.startswith("/u/") and recipient_id.count("/") == 2:
+                collections.add(f"{recipient_id}/inbox")
+
+    if (target := first_id(activity.get("target"))) and isinstance(target, str) and target.startswith("/"):
+        collections.add(target)
+
+    return collections
+
+
+@lru_cache
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide response cache, configured from settings."""
+    settings = get_settings()
+    response_cache = ResponseCache(
+        maxsize=settings.response_cache_size,
+        ttl=settings.response_cache_ttl,
+        stale_ttl=settings.response_cache_stale_ttl,
+        redis=get_redis(),
+    )
+    register_cache("responses", response_cache)
+    return response_cache
+
+
+@on_submit
+async def invalidate_touched_collections(store: ActivityStore, activity: dict[str, Any]) -> None:
+    """Mark the cached responses of every collection the activity touched as stale."""
+    response_cache = get_response_cache()
+    for collection_id in get_touched_collections(activity):
+        await response_cache.invalidate(collection_id)
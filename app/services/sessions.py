@@ -0,0 +1,83 @@
+"""
+Signed session cookies.
+
+A session is `<payload>.<signature>`, both base64url: the payload is the user ID, the issue time and the expiry time,
+signed with HMAC-SHA256 and `session_secret`. Checking a session is one HMAC and a revocation check, the provider
+token is only verified at login. Logging out removes the cookie, `revoke_sessions` also rejects every copy of the
+user's sessions issued until then, through the token cache's revocations so it reaches every server process.
+"""
+
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+from functools import lru_cache
+from typing import Any
+
+import structlog
+
+from app.core.settings import get_settings
+from app.services.tokens import get_token_cache
+
+logger = structlog.get_logger(__name__)
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+@lru_cache
+def get_session_secret() -> bytes:
+    """The session signing key, a random one per process if `session_secret` is not set."""
+    secret = get_settings().session_secret
+    if secret:
+        return secret.encode()
+
+    logger.warning("SESSION_SECRET is not set, sessions won't survive a restart or work across server processes")
+    return secrets.token_bytes(32)
+
+
+def sign(payload: bytes) -> bytes:
+    return hmac.new(get_session_secret(), payload, hashlib.sha256).digest()
+
+
+def create_session(user_id: str, max_age: int) -> str:
+    """Create a session for a user, valid for `max_age` seconds."""
+    now = time.time()
+    payload = f"{user_id}\n{now!r}\n{int(now) + max_age}".encode()
+    return f"{b64encode(payload)}.{b64encode(sign(payload))}"
+
+
+def verify_session(session: str) -> dict[str, Any] | None:
+    """
+    Return the claims of a validly signed, unexpired session, or None: the user ID as `sub` and the issue time as `iat`.
+
+    Whether the session was revoked since is checked with `TokenCache.is_revoked`, like verified tokens.
+    """
+    try:
+        payload, signature = session.split(".")
+        payload, signature = b64decode(payload), b64decode(signature)
+    except ValueError:
+        return None
+
+    if not hmac.compare_digest(signature, sign(payload)):
+        return None
+
+    try:
+        user_id, issued, expires = payload.decode().rsplit("\n", 2)
+        issued, expires = float(issued), int(expires)
+    except ValueError:
+        return None
+    if expires < time.time():
+        return None
+    return {"sub": user_id, "iat": issued, "exp": expires}
+
+
+async def revoke_sessions(user_id: str) -> None:
+    """Reject every session of a user issued until now, in every server process."""
+    await get_token_cache().purge_sub(user_id)
@@ -1 +1,128 @@
+import asyncio
+import itertools
+import time
+from contextlib import AsyncExitStack
+from typing import Annotated, Any
 
+import orjson
+from fastapi import Depends, Request
+from activity_store import ActivityStore
+
+from app.core.metrics import STORE_CALL_DURATION, STORE_CALL_ERRORS
+from app.core.tracing import record
+
+# Store calls timed into the metrics, everything else is passed through untouched
+INSTRUMENTED_CALLS = ("dereference", "dereference_raw", "query", "store")
+
+
+class InstrumentedStore:
+    """Wraps an ActivityStore to record the latency and errors of its calls, in the metrics and request trace."""
+
+    def __init__(self, store: ActivityStore):
+        self._store = store
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._store, name)
+        if name not in INSTRUMENTED_CALLS:
+            return attr
+
+        async def timed(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return await attr(*args, **kwargs)
+            except Exception:
+                STORE_CALL_ERRORS.inc(name)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start_time
+                STORE_CALL_DURATION.observe(elapsed, name)
+                record(f"store.{name}", elapsed)
+
+        return timed
+
+
+class StorePool:
+    """
+    A fixed set of ActivityStore connections, opened once for the lifetime of the app.
+
+    Stores are handed out round-robin, they are async and safe to share between concurrent requests.
+    """
+
+    def __init__(self, size: int = 1, timeout: float = 10.0):
+        self.size = size
+        self.timeout = timeout
+        self._stores: list[ActivityStore] = []
+        self._cycle = None
+        self._stack: AsyncExitStack | None = None
+
+    async def open(self) -> "StorePool":
+        stack = AsyncExitStack()
+        try:
+            for _ in range(self.size):
+                store = await asyncio.wait_for(stack.enter_async_context(ActivityStore()), self.timeout)
+                self._stores.append(InstrumentedStore(store))
+        except BaseException:
+            self._stores.clear()
+            await stack.aclose()
+            raise
+
+        self._stack = stack
+        self._cycle = itertools.cycle(self._stores)
+        return self
+
+    async def close(self) -> None:
+        stack, self._stack = self._stack, None
+        self._stores.clear()
+        self._cycle = None
+        if stack is not None:
+            await stack.aclose()
+
+    def get(self) -> ActivityStore:
+        """Get the next store in the pool."""
+        if self._cycle is None:
+            raise RuntimeError("Store pool is not open")
+        return next(self._cycle)
+
+    async def __aenter__(self) -> "StorePool":
+        return await self.open()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+
+async def store_many(store: ActivityStore, objects: list[dict[str, Any]], commit: dict[str, Any] | None = None) -> None:
+    """
+    Store several objects concurrently, then the `commit` object.
+
+    Readers that reach the others through `commit` see all of them or none: if any write fails, `commit` is not
+    written and the first error is raised. Writes overwrite, so retrying a failed batch is safe.
+    """
+    results = await asyncio.gather(*[store.store(obj) for obj in objects], return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    if commit is not None:
+        await store.store(commit)
+
+
+async def dereference_encoded(store: ActivityStore, object_id: str) -> bytes | None:
+    """
+    Dereference an object as encoded JSON, for routes that send it without changing it.
+
+    Backends that hold the stored JSON can implement `dereference_raw(id) -> bytes | None` to skip the decode and
+    re-encode, otherwise the object is dereferenced and encoded here.
+    """
+    if (dereference_raw := getattr(store, "dereference_raw", None)) is not None:
+        return await dereference_raw(object_id)
+
+    obj = await store.dereference(object_id)
+    return orjson.dumps(obj) if obj else None
+
+
+def get_store(request: Request) -> ActivityStore:
+    """Get a store from the pool opened in the app lifespan."""
+    return request.app.state.store_pool.get()
+
+
+Store = Annotated[ActivityStore, Depends(get_store)]
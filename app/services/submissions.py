@@ -0,0 +1,85 @@
+from datetime import datetime, UTC
+from typing import Any
+
+from activity_store import ActivityStore
+from nanoid import generate
+
+from app.services.queue import ActivityQueue
+from app.services.store import store_many
+
+
+def build_submission(user: dict[str, Any], activity: dict[str, Any]) -> dict[str, Any]:
+    """Build the pending submission status object of an activity posted by the user."""
+    return {
+        "@context": [
+            "https://www.w3.org/ns/activitystreams",
+            {"activity-serve": "https://example.org/ns/"},
+        ],
+        "id": f"{user['id']}/submissions/{generate()}",
+        "type": "Submission",
+        "attributedTo": user["id"],
+        "object": activity["id"],
+        "status": "pending",
+        "published": datetime.now(UTC).isoformat(),
+    }
+
+
+async def enqueue_submission(
+    store: ActivityStore, queue: ActivityQueue, user: dict[str, Any], activity: dict[str, Any]
+) -> dict[str, Any]:
+    """
+    Durably record a submission and queue its activity for the workers.
+
+    Returns the submission status object, stored at `/u/<user-key>/submissions/<key>`, which the worker moves
+    from `pending` to `processed` or `failed`.
+
+    Raises QueueFull if the queue is too deep, the submission is then recorded as failed.
+    """
+    [submission] = await enqueue_submissions(store, queue, user, [activity])
+    return submission
+
+
+async def enqueue_submissions(
+    store: ActivityStore, queue: ActivityQueue, user: dict[str, Any], activities: list[dict[str, Any]]
+) -> list[dict[str, Any]]:
+    """
+    Record the submissions of several activities with one concurrent store write, and queue them in order with
+    one queue write, see `enqueue_submission`.
+
+    Raises QueueFull if the queue is too deep, none of them are queued and they are all recorded as failed.
+    """
+    submissions = [build_submission(user, activity) for activity in activities]
+
+    # Stored first, so the worker can never complete a submission before it exists
+    await store_many(store, submissions)
+
+    try:
+        await queue.put_many(
+            {"activity": activity, "submission": submission} for activity, submission in zip(activities, submissions)
+        )
+    except Exception as e:
+        await store_many(store, [completed_submission(submission, e) for submission in submissions])
+        raise
+
+    return submissions
+
+
+def completed_submission(submission: dict[str, Any], error: Exception | None = None) -> dict[str, Any]:
+    """A copy of the submission marked as processed, or as failed with the error."""
+    submission = {
+        **submission,
+        "status": "failed" if error else "processed",
+        "updated": datetime.now(UTC).isoformat(),
+    }
+    if error:
+        submission["error"] = str(error)
+    return submission
+
+
+async def complete_submission(
+    store: ActivityStore, submission: dict[str, Any], error: Exception | None = None
+) -> dict[str, Any]:
+    """Mark a submission as processed, or as failed with the error."""
+    submission = completed_submission(submission, error)
+    await store.store(submission)
+    return submission
@@ -0,0 +1,197 @@
+import hashlib
+import time
+from functools import lru_cache
+from typing import Any
+
+import orjson
+
+from app.core.metrics import register_cache
+from app.core.redis import get_redis
+from app.core.settings import get_settings
+from app.services.cache import LRUCache
+from app.services.invalidation import get_invalidation_channel
+
+REDIS_PREFIX = "activity-serve:tokens:"
+
+# Cached for subjects that were never revoked
+NOT_REVOKED = 0.0
+
+
+def get_token_key(token: str) -> str:
+    """Hash a token so the raw credential is never used as a cache key."""
+    hsh = hashlib.new("blake2s", digest_size=32)
+    hsh.update(token.encode())
+    return hsh.hexdigest()
+
+
+class TokenCache:
+    """
+    Cache of verified token claims, keyed by a hash of the token.
+
+    Entries live in a bounded local LRU and, when a Redis client is given, in a shared tier. An entry
+    never outlives the token's `exp`, and `purge_sub` drops every entry for a subject and rejects tokens
+    issued (`iat`) before the purge, for `revoked_ttl` seconds. With an invalidation channel, the purge reaches the
+    local tier of every server process.
+
+    A subject's revocation time read from Redis is reused for `revocation_check_ttl` seconds, so checking a session
+    isn't a Redis round trip every time. Purges reach every process through the channel anyway; the lookup only
+    covers a missed message, or a process that started after the purge.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 10_000,
+        ttl: float = 300,
+        redis: Any = None,
+        channel: Any = None,
+        revoked_ttl: float = 86400,
+        revocation_check_ttl: float = 5,
+    ):
+        self.ttl = ttl
+        self.revoked_ttl = revoked_ttl
+        self.redis = redis
+        self.channel = channel
+        self.local = LRUCache(maxsize)
+        self._revoked: dict[str, float] = {}
+        self._revocations = LRUCache(maxsize, ttl=revocation_check_ttl)
+        if channel is not None:
+            channel.subscribe("tokens", self.purge_local)
+
+    @property
+    def hits(self) -> int:
+        return self.local.hits
+
+    @property
+    def misses(self) -> int:
+        return self.local.misses
+
+    def stats(self) -> dict[str, Any]:
+        return self.local.stats()
+
+    def _ttl_for(self, claims: dict[str, Any]) -> float:
+        ttl = self.ttl
+        if exp := claims.get("exp"):
+            ttl = min(ttl, exp - time.time())
+        return ttl
+
+    async def get(self, token: str) -> dict[str, Any] | None:
+        """Return the cached claims for a token, or None."""
+        key = get_token_key(token)
+
+        claims = self.local.get(key)
+        if claims is not None:
+            return claims
+
+        if self.redis is None:
+            return None
+
+        data = await self.redis.get(REDIS_PREFIX + key)
+        if data is None:
+            return None
+
+        claims = orjson.loads(data)
+        ttl = self._ttl_for(claims)
+        if ttl <= 0 or self._is_revoked_locally(claims):
+            return None
+
+        # Counted as a miss locally, but promote it so the next lookup stays in-process
+        self.local.set(key, claims, ttl=ttl)
+        return claims
+
+    async def put(self, token: str, claims: dict[str, Any]) -> None:
+        """Cache verified claims until the token expires or the cache ttl elapses."""
+        iat = claims.get("iat")
+        if iat is not None and iat > time.time() + 60:
+            # Issued in the future, don't trust the clock skew enough to keep it around
+            return
+
+        ttl = self._ttl_for(claims)
+        if ttl <= 0:
+            return
+
+        key = get_token_key(token)
+        self.local.set(key, claims, ttl=ttl)
+
+        if self.redis is not None:
+            sub_key = f"{REDIS_PREFIX}sub:{claims.get('sub')}"
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.set(REDIS_PREFIX + key, orjson.dumps(claims), ex=max(int(ttl), 1))
+                pipe.sadd(sub_key, key)
+                pipe.expire(sub_key, int(self.ttl))
+                await pipe.execute()
+
+    def _is_revoked_locally(self, claims: dict[str, Any]) -> bool:
+        revoked_at = self._revoked.get(claims.get("sub"))
+        return revoked_at is not None and claims.get("iat", 0) <= revoked_at
+
+    async def is_revoked(self, claims: dict[str, Any]) -> bool:
+        """Return True if the claims were issued before their subject was purged."""
+        if self._is_revoked_locally(claims):
+            return True
+
+        if self.redis is None:
+            return False
+
+        sub = claims.get("sub")
+        revoked_at = self._revocations.get(sub)
+        if revoked_at is None:
+            revoked_at = await self.redis.get(f"{REDIS_PREFIX}revoked:{sub}")
+            revoked_at = NOT_REVOKED if revoked_at is None else float(revoked_at)
+            self._revocations.set(sub, revoked_at)
+        return revoked_at != NOT_REVOKED and claims.get("iat", 0) <= revoked_at
+
+    def purge_local(self, sub: str | None) -> int:
+        """Drop the local entries for a subject and reject its older tokens, or drop every entry with None."""
+        if sub is None:
+            removed = len(self.local)
+            self.local.clear()
+            return removed
+
+        self._revocations.pop(sub)
+        now = time.time()
+        self._revoked = {key: at for key, at in self._revoked.items() if at > now - self.revoked_ttl}
+        self._revoked[sub] = now
+
+        removed = 0
+        for key, claims in self.local.items():
+            if claims.get("sub") == sub:
+                self.local.pop(key)
+                removed += 1
+        return removed
+
+    async def purge_sub(self, sub: str) -> int:
+        """Drop every cached token for a subject, returns the number of local entries removed."""
+        now = time.time()
+        removed = self.purge_local(sub)
+
+        if self.channel is not None:
+            await self.channel.publish("tokens", sub)
+
+        if self.redis is not None:
+            sub_key = f"{REDIS_PREFIX}sub:{sub}"
+            keys = await self.redis.smembers(sub_key)
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.delete(REDIS_PREFIX + (key.decode() if isinstance(key, bytes) else key))
+                pipe.delete(sub_key)
+                pipe.set(f"{REDIS_PREFIX}revoked:{sub}", now, ex=int(self.revoked_ttl))
+                await pipe.execute()
+
+        return removed
+
+
+@lru_cache
+def get_token_cache() -> TokenCache:
+    """Return the process-wide token cache, configured from settings."""
+    settings = get_settings()
+    token_cache = TokenCache(
+        maxsize=settings.token_cache_size,
+        ttl=settings.token_cache_ttl,
+        redis=get_redis(),
+        channel=get_invalidation_channel(),
+        # Provider tokens live an hour, but the purges of a user ID also revoke its sessions
+        revoked_ttl=max(86400, settings.session_max_age),
+        revocation_check_ttl=settings.token_revocation_check_ttl,
+    )
+    register_cache("tokens", token_cache)
+    return token_cache
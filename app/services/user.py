@@ -1,23 +1,201 @@
+import asyncio
 import nanoid
 import hashlib
 import struct
 from datetime import datetime, UTC
-from typing import Any
+from functools import lru_cache
+from typing import Any, Hashable
 
+import structlog
 from activity_store import ActivityStore
+from activity_store.utils import first_id
+
+from app.core.metrics import register_cache
+from app.core.redis import get_redis
+from app.core.settings import get_settings
+from app.core.tracing import span
+from app.services.bus import on_submit
+from app.services.cache import LRUCache
+from app.services.invalidation import get_invalidation_channel
+from app.services.store import store_many
+
+logger = structlog.get_logger(__name__)
+
+PROVISION_LOCK_PREFIX = "activity-serve:provision:"
+
+# Written once every identity stored before the index existed has its entries
+INDEX_BACKFILL_MARKER = "/sys/migrations/identity-index"
+INDEX_BACKFILL_LIMIT = 100_000
+
+# In-flight user lookups by identity ID
+_RESOLVING: dict[str, asyncio.Future] = {}
+
+
+class UserCache(LRUCache):
+    """
+    Cache of user objects, keyed by identity ID and, for sessions, by user ID.
+
+    The keys are also indexed by user ID, so invalidating a user drops its entries without scanning the cache.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float | None = None):
+        super().__init__(maxsize, ttl)
+        self._keys: dict[str, set[Hashable]] = {}
+
+    def set(self, key: Hashable, value: dict[str, Any], ttl: float | None = None) -> None:
+        # Unindex the user the key pointed at before
+        self.pop(key)
+        super().set(key, value, ttl)
+        self._keys.setdefault(value["id"], set()).add(key)
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop every entry of a user."""
+        for key in list(self._keys.get(user_id, ())):
+            self.pop(key)
+
+    def clear(self) -> None:
+        super().clear()
+        self._keys.clear()
+
+    def _removed(self, key: Hashable, value: dict[str, Any]) -> None:
+        if keys := self._keys.get(value["id"]):
+            keys.discard(key)
+            if not keys:
+                del self._keys[value["id"]]
+
+
+@lru_cache
+def get_user_cache() -> UserCache:
+    """Return the process-wide cache of user objects, by identity ID and, for sessions, by user ID."""
+    settings = get_settings()
+    user_cache = UserCache(maxsize=settings.user_cache_size, ttl=settings.user_cache_ttl)
+    register_cache("users", user_cache)
+    get_invalidation_channel().subscribe("users", invalidate_user)
+    return user_cache
+
+
+def invalidate_user(user_id: str | None) -> None:
+    """Drop a user from this process' identity cache, e.g. after the Person object changed, or all with None."""
+    user_cache = get_user_cache()
+    if user_id is None:
+        user_cache.clear()
+    else:
+        user_cache.invalidate(user_id)
+
+
+def is_local_actor(obj: Any) -> bool:
+    """Whether an object, or object ID, is a local user: a Person, or an ID like `/u/<user-key>`."""
+    object_id = first_id(obj)
+    if not isinstance(object_id, str):
+        return False
+    if isinstance(obj, dict) and obj.get("type") == "Person":
+        return True
+    return object_id.startswith("/u/") and object_id.count("/") == 2
+
+
+@on_submit
+async def invalidate_updated_user(store: ActivityStore, activity: dict[str, Any]) -> None:
+    """Invalidate cached users, in every server process, whose Person object was updated or deleted."""
+    obj = activity.get("object")
+    if activity.get("type") in ("Update", "Delete") and obj and is_local_actor(obj):
+        await get_invalidation_channel().publish("users", first_id(obj))
+
+
+def get_provider(claims: dict[str, Any]) -> str:
+    """The provider that authenticated the claims: Firebase's sign-in provider, or the issuer."""
+    return (claims.get("firebase") or {}).get("sign_in_provider") or claims.get("iss")
+
+
+def get_index_id(kind: str, *values: str) -> str:
+    """Generate the key of an identity index entry."""
+    hsh = hashlib.new("blake2s", digest_size=32)
+    for value in values:
+        hsh.update(value.encode())
+        hsh.update(b"\0")
+    key = hsh.hexdigest()[:48]
+    return f"/auth/index/{kind}/{key}"
+
+
+def get_verified_email(claims: dict[str, Any]) -> str | None:
+    """The claims' email, if the provider verified it."""
+    if claims.get("email") and claims.get("email_verified"):
+        return claims["email"].strip().lower()
+    return None
+
+
+def build_identity_index(claims: dict[str, Any], identity_id: str, email: bool = True) -> list[dict[str, Any]]:
+    """
+    Build the index entries pointing at an identity: one for the (provider, sub) of the claims, one for each
+    linked provider account Firebase reports, and one for the verified email unless `email` is False.
+    """
+    keys = {(get_provider(claims), claims["sub"])}
+    for provider, subs in ((claims.get("firebase") or {}).get("identities") or {}).items():
+        if provider != "email":
+            keys.update((provider, str(sub)) for sub in subs)
+
+    entries = [get_index_id("provider", provider, sub) for provider, sub in sorted(keys)]
+    if email and (verified_email := get_verified_email(claims)):
+        entries.append(get_index_id("email", verified_email))
+
+    return [{"id": entry_id, "type": "IdentityIndex", "identity": identity_id} for entry_id in entries]
+
+
+async def get_identity_by_index(store: ActivityStore, index_id: str) -> dict[str, Any] | None:
+    """Look up the Identity an index entry points at."""
+    entry = await store.dereference(index_id)
+    if entry:
+        return await store.dereference(entry["identity"])
+    return None
 
 
 async def get_identity_by_provider(store: ActivityStore, provider: str, sub: str) -> dict[str, Any] | None:
     """Look up an Identity by provider and subject ID."""
-    # Query for identities with matching provider and sub
-    query = {"type": "Identity", "provider": provider, "sub": sub}
+    return await get_identity_by_index(store, get_index_id("provider", provider, sub))
 
-    results = await store.query(query, limit=1)
 
-    if results and len(results) > 0:
-        return results[0]
+async def get_identity_by_email(store: ActivityStore, email: str) -> dict[str, Any] | None:
+    """Look up an Identity by verified email address, e.g. to link a new login to an existing user."""
+    return await get_identity_by_index(store, get_index_id("email", email.strip().lower()))
 
-    return None
+
+async def backfill_identity_index(store: ActivityStore) -> int:
+    """
+    Index the identities stored before the index existed, once, returns how many were indexed.
+
+    Provider entries are rewritten as they are, the email index stays unique: an email goes to the oldest identity
+    with it, and an existing entry is never overwritten.
+    """
+    if await store.dereference(INDEX_BACKFILL_MARKER):
+        return 0
+
+    identities = await store.query({"type": "Identity"}, limit=INDEX_BACKFILL_LIMIT) or []
+    identities = sorted(identities, key=lambda identity: identity.get("published") or "")
+
+    entries = []
+    emails = set()
+    for identity in identities:
+        claims = identity.get("claims") or {}
+        if not claims.get("sub"):
+            continue
+
+        entries += build_identity_index(claims, identity["id"], email=False)
+        email = get_verified_email(claims)
+        if email and email not in emails:
+            emails.add(email)
+            email_id = get_index_id("email", email)
+            if not await store.dereference(email_id):
+                entries.append({"id": email_id, "type": "IdentityIndex", "identity": identity["id"]})
+
+    complete = len(identities) < INDEX_BACKFILL_LIMIT
+    if not complete:
+        logger.warning(
+            "Identity index backfill stopped at its limit, later identities may not be indexed",
+            limit=INDEX_BACKFILL_LIMIT,
+        )
+
+    marker = {"id": INDEX_BACKFILL_MARKER, "type": "Object", "published": datetime.now(UTC).isoformat()}
+    await store_many(store, entries, commit=marker if complete else None)
+    return len(identities)
 
 
 def get_identity_id(claims: dict[str, Any]) -> str:
@@ -29,10 +207,8 @@ def get_identity_id(claims: dict[str, Any]) -> str:
     return f"/auth/identities/{key}"
 
 
-async def create_user(
-    store: ActivityStore, name: str, preferred_username: str = None, image: str = None
-) -> dict[str, Any]:
-    """Create a new user with generated user-key."""
+def build_user(name: str, preferred_username: str = None, image: str = None) -> list[dict[str, Any]]:
+    """Build a new user with generated user-key, returns the user followed by its inbox and outbox."""
 
     # Generate a unique user-key (8-character nanoid)
     user_key = nanoid.generate(size=8)
@@ -57,9 +233,6 @@ async def create_user(
     user["inbox"] = f"{user_id}/inbox"
     user["outbox"] = f"{user_id}/outbox"
 
-    # Create the user in the activity store
-    await store.store(user)
-
     # Create inbox and outbox collections
     inbox = {
         "@context": "https://www.w3.org/ns/activitystreams",
@@ -79,14 +252,11 @@ async def create_user(
         "items": [],
     }
 
-    await store.store(inbox)
-    await store.store(outbox)
-
-    return user
+    return [user, inbox, outbox]
 
 
-async def create_identity(store: ActivityStore, claims: dict[str, Any], user: dict[str, Any]) -> dict[str, Any]:
-    """Create a new identity linked to a user."""
+def build_identity(claims: dict[str, Any], user: dict[str, Any]) -> dict[str, Any]:
+    """Build a new identity linked to a user."""
 
     identity = {
         "@context": [
@@ -96,41 +266,112 @@ async def create_identity(store: ActivityStore, claims: dict[str, Any], user: di
         "id": get_identity_id(claims),
         "type": "Identity",
         "attributedTo": user["id"],
+        "provider": get_provider(claims),
+        "sub": claims["sub"],
         "published": datetime.now(UTC).isoformat(),
         "claims": claims,
         "image": claims.get("picture"),
         "name": claims.get("name"),
     }
 
-    await store.store(identity)
-
     return identity
 
 
-async def get_or_create_user(claims: str) -> dict[str, Any]:
-    """Get a user from an OAuth token, create the user if needed."""
+async def find_user(store: ActivityStore, identity_id: str) -> dict[str, Any] | None:
+    """Find the user an identity is attributed to."""
+    identity = await store.dereference(identity_id)
+    if identity:
+        return await store.dereference(identity.get("attributedTo"))
+    return None
+
+
+async def resolve_user(store: ActivityStore, claims: dict[str, Any], identity_id: str) -> dict[str, Any]:
+    """Find the user for an identity, or provision a new one, holding the cross-worker lock when Redis is set up."""
+    # Check if user already exists by looking up identity
+    if user := await find_user(store, identity_id):
+        return user
+
+    # If the identity is missing or its user is gone, just remake everything
+    redis = get_redis()
+    if redis is None:
+        return await provision_user(store, claims)
+
+    timeout = get_settings().provision_lock_timeout
+    async with redis.lock(f"{PROVISION_LOCK_PREFIX}{identity_id}", timeout=timeout, blocking_timeout=timeout):
+        # Another worker may have provisioned it while we waited for the lock
+        return await find_user(store, identity_id) or await provision_user(store, claims)
+
+
+async def provision_user(store: ActivityStore, claims: dict[str, Any]) -> dict[str, Any]:
+    """
+    Create a new user and the identity linking it to the claims.
+
+    If `link_identities_by_email` is set and another identity has the same verified email, the new identity is
+    linked to that identity's user instead. The email index is unique, an existing entry is never overwritten.
+
+    The identity is written last, once everything else is stored: lookups go through it, so they never find a
+    half-provisioned user.
+    """
+    objects = []
+    user = None
+
+    linked = None
+    if email := get_verified_email(claims):
+        linked = await get_identity_by_email(store, email)
+        if linked and get_settings().link_identities_by_email:
+            user = await store.dereference(linked.get("attributedTo"))
+
+    if user is None:
+        objects = build_user(name=claims.get("name"), image=claims.get("picture"))
+        user = objects[0]
+
+    identity = build_identity(claims, user)
+    objects += build_identity_index(claims, identity["id"], email=linked is None)
+
+    await store_many(store, objects, commit=identity)
+    return user
+
+
+async def get_or_create_user(store: ActivityStore, claims: str) -> dict[str, Any]:
+    """
+    Get a user from an OAuth token, create the user if needed.
+
+    Concurrent calls for the same identity share one lookup, so a burst of first requests provisions the user once.
+    """
     if not claims.get("sub").strip():
         raise ValueError("Auth claims do not include a subject 'sub' field")
 
     identity_id = get_identity_id(claims)
 
-    async with ActivityStore() as store:
-        # Check if user already exists by looking up identity
-        identity = await store.dereference(identity_id)
-        if identity:
-            user = await store.dereference(identity.get("attributedTo"))
-            if user:
-                return user
-            else:
-                pass
-                # This should not happen, but if it does, just remake everything
-
-        user = await create_user(store, name=claims.get("name"), image=claims.get("picture"))
-        identity = await create_identity(
-            store=store,
-            claims=claims,
-            user=user,
-        )
+    user_cache = get_user_cache()
+    if user := user_cache.get(identity_id):
+        return user
+
+    with span("user"):
+        task = _RESOLVING.get(identity_id)
+        if task is None:
+            task = asyncio.ensure_future(resolve_user(store, claims, identity_id))
+            _RESOLVING[identity_id] = task
+            task.add_done_callback(lambda _: _RESOLVING.pop(identity_id, None))
+
+        # Shielded so one caller going away doesn't cancel the lookup for the others
+        user = await asyncio.shield(task)
+        user_cache.set(identity_id, user)
+
+    # Return the user
+    return user
 
-        # Return the user
+
+async def get_user_by_id(store: ActivityStore, user_id: str) -> dict[str, Any] | None:
+    """Get a user by ID, for sessions that already know it, or None if the user is gone."""
+    user_cache = get_user_cache()
+    if user := user_cache.get(user_id):
         return user
+
+    with span("user"):
+        user = await store.dereference(user_id)
+    if not user:
+        return None
+
+    user_cache.set(user_id, user)
+    return user
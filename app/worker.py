@@ -0,0 +1,202 @@
+"""
+Background processing of submitted activities.
+
+The app lifespan starts a Worker with `worker_concurrency` consumers. To scale processing separately from the
+HTTP servers, set `WORKER_CONCURRENCY=0` on the servers and run standalone workers sharing the same Redis:
+
+    python -m app.worker
+"""
+
+import asyncio
+import signal
+import time
+from typing import Any
+
+import structlog
+
+from app.core.settings import get_settings
+from app.services.bus import run_after_submit, submit_activity
+from app.services.delivery import get_deliverer
+from app.services.queue import ActivityQueue, get_queue
+from app.services.submissions import complete_submission
+from app.services.store import StorePool
+
+logger = structlog.get_logger(__name__)
+
+
+class Worker:
+    """
+    Runs `concurrency` consumers that claim entries from the activity queue in batches and submit them to the
+    bus, or run the `after_submit` listeners (fan-out, delivery) of activities already submitted, then drive the
+    bus' own pending work with `bus.process_next()`.
+    """
+
+    def __init__(
+        self,
+        store_pool: StorePool,
+        queue: ActivityQueue,
+        concurrency: int = 1,
+        batch_size: int = 10,
+        idle_delay: float = 0.5,
+        recover_interval: float = 300.0,
+    ):
+        self.store_pool = store_pool
+        self.queue = queue
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.idle_delay = idle_delay
+        self.recover_interval = recover_interval
+        self._next_recovery = 0.0
+        self.processed = 0
+        self.failed = 0
+        self._stopping = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    async def recover(self) -> None:
+        """Requeue the entries left claimed by workers that died, on start and then every `recover_interval`."""
+        self._next_recovery = time.monotonic() + self.recover_interval
+        if requeued := await self.queue.requeue_stale():
+            logger.warning("Requeued stale queue entries", count=requeued)
+
+    def start(self) -> None:
+        self._stopping.clear()
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.concurrency)]
+        self.queue.consumers += len(self._tasks)
+        logger.info("Worker started", concurrency=self.concurrency, batch_size=self.batch_size)
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Let the consumers finish the batch they are on, cancelling them after `timeout` seconds."""
+        self._stopping.set()
+        tasks, self._tasks = self._tasks, []
+        if not tasks:
+            return
+        self.queue.consumers -= len(tasks)
+
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        logger.info("Worker stopped", processed=self.processed, failed=self.failed, cancelled=len(pending))
+
+    async def stats(self) -> dict[str, Any]:
+        return {
+            **await self.queue.stats(),
+            "consumers": len(self._tasks),
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+    async def _consume(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                done = await self.run_batch()
+            except Exception:
+                logger.exception("Worker batch failed")
+                done = 0
+
+            if not done:
+                if time.monotonic() >= self._next_recovery:
+                    try:
+                        await self.recover()
+                    except Exception:
+                        logger.exception("Requeueing stale queue entries failed")
+
+                # Idle, wait a bit unless we are told to stop
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.idle_delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run_batch(self) -> int:
+        """Process up to `batch_size` units of work, returns how many were done."""
+        from activity_bus import ActivityBus
+
+        store = self.store_pool.get()
+
+        entries = await self.queue.claim(self.batch_size)
+        for index, entry in enumerate(entries):
+            try:
+                await self.process(store, entry)
+            except Exception:
+                # Its failure was recorded as far as it got, retrying could submit the activity twice
+                logger.exception("Queue entry failed", activity_id=entry["activity"].get("id"))
+            except BaseException:
+                # Cancelled, e.g. at shutdown: this entry and the rest go back for another consumer
+                await self.queue.release(*entries[index:])
+                raise
+
+            try:
+                await self.queue.ack(entry)
+            except Exception:
+                logger.exception("Acknowledging a queue entry failed", activity_id=entry["activity"].get("id"))
+
+        done = len(entries)
+        bus = ActivityBus(store=store)
+        while done < self.batch_size and await bus.process_next():
+            done += 1
+
+        return done
+
+    async def process(self, store, entry: dict[str, Any]) -> None:
+        """Submit one queued activity to the bus, or run the `after_submit` listeners of a submitted one."""
+        activity = entry["activity"]
+        if entry.get("after_submit"):
+            await run_after_submit(store, activity)
+            return
+
+        error = None
+        try:
+            await submit_activity(store, activity)
+        except Exception as e:
+            error = e
+            self.failed += 1
+            logger.exception("Activity processing failed", activity_id=activity.get("id"))
+        else:
+            self.processed += 1
+            logger.debug(
+                "Activity processed",
+                activity_id=activity.get("id"),
+                lag=time.time() - entry.get("enqueued_at", time.time()),
+            )
+
+        if submission := entry.get("submission"):
+            await complete_submission(store, submission, error=error)
+
+
+def create_worker(store_pool: StorePool, concurrency: int | None = None) -> Worker:
+    """Create a worker configured from settings."""
+    settings = get_settings()
+    return Worker(
+        store_pool,
+        get_queue(),
+        concurrency=settings.worker_concurrency if concurrency is None else concurrency,
+        batch_size=settings.worker_batch_size,
+        idle_delay=settings.worker_idle_delay,
+        recover_interval=settings.queue_claim_timeout,
+    )
+
+
+async def main() -> None:
+    """Run a standalone worker until SIGINT or SIGTERM."""
+    settings = get_settings()
+    stop = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with StorePool(size=settings.store_pool_size, timeout=settings.store_connect_timeout) as store_pool:
+        # Activities processed here are delivered from here
+        deliverer = get_deliverer()
+        await deliverer.start(store_pool)
+
+        worker = create_worker(store_pool, concurrency=max(settings.worker_concurrency, 1))
+        await worker.recover()
+        worker.start()
+        await stop.wait()
+        await worker.stop(settings.worker_shutdown_timeout)
+        await deliverer.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+"""
+Cost of fanning a post out to a large following.
+
+Creates the inboxes of `--followers` local users following one author on the memory store, then times posting
+to the followers collection with fan-out on write (one inbox write per follower), and with fan-out on read (one
+stream write per post, then a merge per inbox read).
+
+    python -m benchmarks.fanout [--followers 10000] [--posts 5]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# The benchmark must never touch real backends
+os.environ["ACTIVITY_STORE_BACKEND"] = "memory"
+os.environ["ACTIVITY_STORE_CACHE"] = "memory"
+os.environ.pop("REDIS_URL", None)
+
+from activity_store import ActivityStore  # noqa: E402
+
+from app.core.settings import get_settings  # noqa: E402
+from app.services.fanout import fan_out, get_fanout_cache, merge_streams  # noqa: E402
+from app.services.store import store_many  # noqa: E402
+
+
+def make_post(author: str, n: int) -> dict:
+    return {
+        "id": f"{author}/activities/{n}",
+        "type": "Create",
+        "actor": author,
+        "to": [f"{author}/followers"],
+        "object": {"type": "Note", "content": f"Post {n}"},
+    }
+
+
+async def setup(store: ActivityStore, author: str, followers: int) -> list[str]:
+    members = [f"/u/{author.rsplit('/', 1)[-1]}-f{i}" for i in range(followers)]
+    await store_many(
+        store,
+        [
+            {"id": f"{author}/followers", "type": "OrderedCollection", "orderedItems": members},
+            *({"id": f"{member}/inbox", "type": "OrderedCollection", "orderedItems": []} for member in members),
+        ],
+    )
+    return members
+
+
+async def run(followers: int, posts: int) -> dict[str, float]:
+    settings = get_settings()
+    results = {}
+
+    async with ActivityStore() as store:
+        # Fan-out on write: every post writes every follower's inbox
+        settings.fanout_read_threshold = followers + 1
+        await setup(store, "/u/write", followers)
+        timings = []
+        for n in range(posts):
+            start = time.perf_counter()
+            await fan_out(store, make_post("/u/write", n))
+            timings.append((time.perf_counter() - start) * 1000)
+        results["write_post_ms"] = statistics.median(timings)
+
+        # Fan-out on read: every post writes the stream, readers merge it in
+        settings.fanout_read_threshold = followers - 1
+        members = await setup(store, "/u/read", followers)
+        get_fanout_cache().clear()
+        timings = []
+        for n in range(posts):
+            start = time.perf_counter()
+            await fan_out(store, make_post("/u/read", n))
+            timings.append((time.perf_counter() - start) * 1000)
+        results["read_post_ms"] = statistics.median(timings)
+
+        # The first read loads the collection members, the rest hit the cache
+        timings = []
+        for member in members[:1000]:
+            start = time.perf_counter()
+            await merge_streams(store, member, f"{member}/inbox")
+            timings.append((time.perf_counter() - start) * 1000)
+        results["read_merge_first_ms"] = timings[0]
+        results["read_merge_ms"] = statistics.median(timings[1:])
+
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--followers", type=int, default=10_000)
+    parser.add_argument("--posts", type=int, default=5)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.followers, args.posts))
+
+    print(f"{args.followers} followers")
+    print(f"  fan-out on write, per post          {results['write_post_ms']:10.1f} ms")
+    print(f"  fan-out on read, per post           {results['read_post_ms']:10.1f} ms")
+    print(f"  fan-out on read, first inbox merge  {results['read_merge_first_ms']:10.1f} ms")
+    print(f"  fan-out on read, per inbox merge    {results['read_merge_ms']:10.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Throughput and latency of the HTTP hot paths.
+
+Runs the app in-process against the memory store backend, authenticating with stock tokens, so no network is
+needed. Reports requests per second and p50/p95/p99 latency for each path, and compares them with the stored
+baseline, failing if any path regressed by more than the threshold.
+
+    python -m benchmarks.hot_paths [--requests N] [--concurrency C] [--threshold 0.2]
+    python -m benchmarks.hot_paths --save-baseline
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+# The benchmark must never touch real backends
+os.environ["ACTIVITY_STORE_BACKEND"] = "memory"
+os.environ["ACTIVITY_STORE_CACHE"] = "memory"
+os.environ.pop("REDIS_URL", None)
+
+import httpx  # noqa: E402
+import structlog  # noqa: E402
+
+from app.api.auth import add_stock_token  # noqa: E402
+from app.main import create_app  # noqa: E402
+
+BASELINE = Path(__file__).with_name("baseline.json")
+
+TOKEN = "benchmark-token"
+add_stock_token(
+    TOKEN,
+    {
+        "sub": "benchmark-user",
+        "iss": "https://example.com/",
+        "email": "benchmark@example.com",
+        "name": "Benchmark User",
+    },
+)
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def measure(send, requests: int, concurrency: int) -> dict[str, float]:
+    """Call `send(i)` `requests` times, `concurrency` at a time, returns throughput and latency percentiles."""
+    latencies = []
+
+    async def timed(i: int) -> None:
+        start = time.perf_counter()
+        response = await send(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 500:
+            raise RuntimeError(f"Request failed with {response.status_code}: {response.text}")
+
+    start = time.perf_counter()
+    for batch_start in range(0, requests, concurrency):
+        await asyncio.gather(*[timed(i) for i in range(batch_start, min(batch_start + concurrency, requests))])
+    elapsed = time.perf_counter() - start
+
+    return {
+        "rps": requests / elapsed,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+    }
+
+
+async def run(requests: int, concurrency: int) -> dict[str, dict[str, float]]:
+    app = create_app()
+    auth = {"Authorization": f"Bearer {TOKEN}"}
+    note = {"type": "Create", "object": {"type": "Note", "content": "Hello, benchmark!"}}
+
+    # Fresh identities for first-login provisioning
+    for i in range(requests):
+        add_stock_token(f"{TOKEN}-first-login-{i}", {"sub": f"benchmark-first-{i}", "iss": "https://example.com/"})
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            user = (await client.get("/me", headers=auth)).json()
+
+            # Give the collections something to serve
+            for _ in range(20):
+                await client.post(user["outbox"], headers=auth, json=note)
+
+            paths = {
+                "me": lambda i: client.get("/me", headers=auth),
+                "inbox_get": lambda i: client.get(user["inbox"], params={"page": "true"}),
+                "outbox_get": lambda i: client.get(user["outbox"], params={"page": "true"}),
+                "outbox_post": lambda i: client.post(user["outbox"], headers=auth, json=note),
+                "first_login": lambda i: client.get(
+                    "/me", headers={"Authorization": f"Bearer {TOKEN}-first-login-{i}"}
+                ),
+                "auth_failure": lambda i: client.get("/me", headers={"Authorization": "Bearer NOTVALID"}),
+            }
+
+            results = {}
+            for name, send in paths.items():
+                # Warm up, except for first login which only happens once per identity
+                if name != "first_login":
+                    await measure(send, min(requests // 10, 50), concurrency)
+                results[name] = await measure(send, requests, concurrency)
+
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """List the paths that got slower than the baseline by more than `threshold`."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result["rps"] < base["rps"] * (1 - threshold):
+            regressions.append(f"{name}: {result['rps']:.0f} req/s, baseline {base['rps']:.0f} req/s")
+        if result["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {result['p95_ms']:.2f}ms, baseline {base['p95_ms']:.2f}ms")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500, help="requests per path")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression, as a fraction")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    args = parser.parse_args()
+
+    # Logging every request to the terminal would dominate the numbers
+    structlog.configure(logger_factory=structlog.PrintLoggerFactory(file=open(os.devnull, "w")))
+
+    results = asyncio.run(run(args.requests, args.concurrency))
+
+    print(f"{'path':>14} {'req/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:>14} {r['rps']:10.0f} {r['p50_ms']:10.2f} {r['p95_ms']:10.2f} {r['p99_ms']:10.2f}")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return 0
+
+    regressions = compare(results, json.loads(args.baseline.read_text()), args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"{len(regressions)} regressions over {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
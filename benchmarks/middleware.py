@@ -0,0 +1,108 @@
+"""
+Per-request overhead of the logging and normalize middleware.
+
+Drives a bare ASGI endpoint directly, with and without the middleware stack, and fails if the stack adds more
+than the budget per request.
+
+    python -m benchmarks.middleware [--requests N] [--budget-us US]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import structlog
+
+from app.api.responses import ActivityStreamResponse
+from app.middleware.logging import LoggingMiddleware
+from app.middleware.normalize import NormalizeMiddleware
+
+# Both middleware together, per request, in microseconds
+BUDGET_US = 50.0
+
+COLLECTION = {
+    "@context": "https://www.w3.org/ns/activitystreams",
+    "id": "/u/abcdefgh/outbox",
+    "type": "OrderedCollection",
+    "totalItems": 20,
+    "orderedItems": [
+        {
+            "id": f"/u/abcdefgh/activities/{i}",
+            "type": "Create",
+            "actor": "/u/abcdefgh",
+            "object": {"id": f"/u/abcdefgh/notes/{i}", "type": "Note", "content": "Hello, world!"},
+        }
+        for i in range(20)
+    ],
+}
+
+
+def make_endpoint(content):
+    async def endpoint(scope, receive, send):
+        await ActivityStreamResponse(content)(scope, receive, send)
+
+    return endpoint
+
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message):
+    pass
+
+
+async def run(app, requests: int) -> float:
+    """Return the mean time per request, in microseconds."""
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/u/abcdefgh/outbox",
+        "headers": [],
+        "state": {},
+    }
+
+    start = time.perf_counter_ns()
+    for _ in range(requests):
+        await app(scope, receive, send)
+    return (time.perf_counter_ns() - start) / requests / 1000
+
+
+async def main(requests: int, budget: float) -> int:
+    # Keep the cost of formatting a log line, not of writing it to a terminal
+    structlog.configure(logger_factory=structlog.PrintLoggerFactory(file=open(os.devnull, "w")))
+
+    cases = (("clean ids", COLLECTION), ("trailing slash ids", {**COLLECTION, "id": "/u/abcdefgh/outbox/"}))
+
+    failed = False
+    for name, content in cases:
+        endpoint = make_endpoint(content)
+        stack = LoggingMiddleware(NormalizeMiddleware(endpoint))
+
+        # Warm up
+        await run(endpoint, requests // 10)
+        await run(stack, requests // 10)
+
+        bare = await run(endpoint, requests)
+        wrapped = await run(stack, requests)
+        overhead = wrapped - bare
+
+        print(f"{name:>20}: bare {bare:8.2f}us  with middleware {wrapped:8.2f}us  overhead {overhead:8.2f}us")
+
+        # Normalizing has to re-encode the body, the budget is for the common pass-through case
+        if name == "clean ids" and overhead > budget:
+            failed = True
+
+    print(f"budget: {budget:.2f}us per request for clean ids, {'FAIL' if failed else 'ok'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--budget-us", type=float, default=BUDGET_US)
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(main(args.requests, args.budget_us)))
@@ -0,0 +1,99 @@
+"""
+Time to first response of a fresh server process.
+
+Starts a new interpreter per run, imports the app, runs its lifespan startup against the memory store and serves
+one `/healthz` request in-process. Reports the median of each phase and fails if the time to first response,
+from spawning the process, is over the budget.
+
+    python -m benchmarks.startup [--runs N] [--budget-ms MS]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# From spawning the process to the first response, in milliseconds
+BUDGET_MS = 1500.0
+
+CHILD = """
+import time
+start = time.perf_counter()
+
+import asyncio
+import json
+
+import httpx
+
+from app.main import create_app
+
+imported = time.perf_counter()
+
+
+async def first_response():
+    app = create_app()
+    created = time.perf_counter()
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        started = time.perf_counter()
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            response = await client.get("/healthz")
+            response.raise_for_status()
+        responded = time.perf_counter()
+    return created, started, responded
+
+
+created, started, responded = asyncio.run(first_response())
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "lifespan_ms": (started - created) * 1000,
+    "first_request_ms": (responded - started) * 1000,
+}))
+"""
+
+
+def run_once() -> dict[str, float]:
+    env = {
+        **os.environ,
+        # The benchmark must never touch real backends
+        "ACTIVITY_STORE_BACKEND": "memory",
+        "ACTIVITY_STORE_CACHE": "memory",
+        "WORKER_CONCURRENCY": "0",
+    }
+    env.pop("REDIS_URL", None)
+
+    spawned = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD], env=env, capture_output=True, text=True, check=True).stdout
+    total_ms = (time.perf_counter() - spawned) * 1000
+
+    # The result is the last line, anything logged comes before it
+    result = json.loads(output.strip().splitlines()[-1])
+    result["total_ms"] = total_ms
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS, help="time to first response budget")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    medians = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+    for key, value in medians.items():
+        print(f"{key:>18} {value:10.1f}")
+
+    if medians["total_ms"] > args.budget_ms:
+        print(f"FAIL time to first response {medians['total_ms']:.1f}ms is over the {args.budget_ms:.0f}ms budget")
+        return 1
+    print(f"OK within the {args.budget_ms:.0f}ms budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
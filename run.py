@@ -1,4 +1,51 @@
+"""
+Run the server, configured through `Settings`:
+
+    python run.py                         # one process
+    WEB_CONCURRENCY=4 python run.py       # four server processes, needs REDIS_URL and SESSION_SECRET
+    SERVER_RELOAD=true python run.py      # development, reloads on changes
+"""
+
 import uvicorn
 
+from app.core.settings import Settings, get_settings
+
+
+def check_settings(settings: Settings, workers: int) -> None:
+    """Raise if the settings can't serve with this many server processes."""
+    if workers > 1 and not settings.redis_url:
+        raise RuntimeError(
+            "WEB_CONCURRENCY > 1 needs REDIS_URL, the server processes' caches and queues wouldn't be shared"
+        )
+    if workers > 1 and not settings.session_secret:
+        raise RuntimeError(
+            "WEB_CONCURRENCY > 1 needs SESSION_SECRET, a session signed by one server process wouldn't work on another"
+        )
+    if workers == 1 and settings.server_max_requests:
+        raise RuntimeError(
+            "SERVER_MAX_REQUESTS needs WEB_CONCURRENCY > 1, a single server process exits instead of being recycled"
+        )
+
+
+def main() -> None:
+    settings = get_settings()
+    workers = 1 if settings.server_reload else max(settings.web_concurrency, 1)
+    try:
+        check_settings(settings, workers)
+    except RuntimeError as e:
+        raise SystemExit(str(e))
+
+    uvicorn.run(
+        "app.main:create_app",
+        factory=True,
+        host=settings.host,
+        port=settings.port,
+        workers=workers,
+        reload=settings.server_reload,
+        limit_max_requests=settings.server_max_requests,
+        timeout_graceful_shutdown=settings.server_graceful_timeout,
+    )
+
+
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    main()
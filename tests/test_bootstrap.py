@@ -0,0 +1,20 @@
+import pytest
+
+from activity_store import ActivityStore
+from app.services.bootstrap import bootstrap_system
+
+
+@pytest.mark.asyncio
+async def test_bootstrap_keeps_existing_objects():
+    """Bootstrapping again creates nothing over what is already stored."""
+    async with ActivityStore() as store:
+        await bootstrap_system(store)
+
+        behaviors = await store.dereference("/sys/behaviors")
+        await store.store({**behaviors, "items": ["/sys/behaviors/example"]})
+
+        await bootstrap_system(store)
+
+        behaviors = await store.dereference("/sys/behaviors")
+        assert behaviors["items"] == ["/sys/behaviors/example"]
+        assert (await store.dereference("/ns/Identity"))["name"] == "Identity"
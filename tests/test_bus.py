@@ -0,0 +1,85 @@
+import asyncio
+
+import activity_bus
+import pytest
+
+from app.services import bus
+from app.services.queue import MemoryQueue
+from app.worker import Worker
+
+
+class FakeBus:
+    def __init__(self, store):
+        pass
+
+    async def submit(self, activity):
+        return activity
+
+
+@pytest.mark.asyncio
+async def test_listeners_never_fail_the_submission(monkeypatch):
+    """Inline listeners run before returning, `after_submit` ones from the queue, and errors are only logged."""
+    queue = MemoryQueue()
+    queue.consumers = 1
+    called = []
+
+    async def failing(store, activity):
+        called.append("failing")
+        raise RuntimeError("boom")
+
+    async def inline(store, activity):
+        called.append("inline")
+
+    async def after(store, activity):
+        called.append("after")
+
+    monkeypatch.setattr(activity_bus, "ActivityBus", FakeBus)
+    monkeypatch.setattr(bus, "get_queue", lambda: queue)
+    monkeypatch.setattr(bus, "_LISTENERS", [failing, inline])
+    monkeypatch.setattr(bus, "_AFTER_LISTENERS", [failing, after])
+
+    activity = {"id": "/u/abc/activities/1", "type": "Create"}
+    assert await bus.submit_activity(None, activity) == activity
+    assert called == ["failing", "inline"]
+
+    [entry] = await queue.claim(10)
+    assert entry["after_submit"]
+    await Worker(store_pool=None, queue=queue).process(None, entry)
+    assert called == ["failing", "inline", "failing", "after"]
+
+
+@pytest.mark.asyncio
+async def test_full_queue_runs_listeners_inline(monkeypatch):
+    """A full queue doesn't hold the submission back, its `after_submit` listeners run right away instead."""
+    queue = MemoryQueue(max_depth=0, put_timeout=60)
+    queue.consumers = 1
+    called = []
+
+    async def after(store, activity):
+        called.append("after")
+
+    monkeypatch.setattr(activity_bus, "ActivityBus", FakeBus)
+    monkeypatch.setattr(bus, "get_queue", lambda: queue)
+    monkeypatch.setattr(bus, "_AFTER_LISTENERS", [after])
+
+    await asyncio.wait_for(bus.submit_activity(None, {"id": "/u/abc/activities/1"}), 1)
+    assert called == ["after"]
+    assert await queue.depth() == 0
+
+
+@pytest.mark.asyncio
+async def test_unread_queue_runs_listeners_inline(monkeypatch):
+    """Without a worker reading the in-process queue, `after_submit` listeners run right away."""
+    queue = MemoryQueue()
+    called = []
+
+    async def after(store, activity):
+        called.append("after")
+
+    monkeypatch.setattr(activity_bus, "ActivityBus", FakeBus)
+    monkeypatch.setattr(bus, "get_queue", lambda: queue)
+    monkeypatch.setattr(bus, "_AFTER_LISTENERS", [after])
+
+    await bus.submit_activity(None, {"id": "/u/abc/activities/1"})
+    assert called == ["after"]
+    assert await queue.depth() == 0
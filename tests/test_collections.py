@@ -0,0 +1,114 @@
+import time
+
+import pytest
+
+from app.services.collections import (
+    RootCache,
+    collection_page,
+    collection_root,
+    decode_cursor,
+    encode_cursor,
+    encode_since,
+    get_position_cache,
+    index_of,
+)
+
+
+@pytest.fixture
+def collection():
+    return {
+        "id": "/u/abc/outbox",
+        "type": "OrderedCollection",
+        "items": [{"id": f"/u/abc/activities/{i}", "type": "Create"} for i in range(5)],
+    }
+
+
+def test_collection_root(collection):
+    """The root carries the total and a link to the first page, not the items."""
+    root = collection_root(collection)
+    assert root["totalItems"] == 5
+    assert root["first"] == "/u/abc/outbox?page=true"
+    assert "items" not in root
+
+
+def test_collection_pages(collection):
+    """Pages walk the collection forwards and backwards with opaque cursors."""
+    first = collection_page(collection, limit=2)
+    assert first["type"] == "OrderedCollectionPage"
+    assert first["partOf"] == "/u/abc/outbox"
+    assert [item["id"] for item in first["orderedItems"]] == ["/u/abc/activities/0", "/u/abc/activities/1"]
+    assert first["prev"] == f"/u/abc/outbox?page=true&limit=2&since={encode_since(5, '/u/abc/activities/0')}"
+
+    second = collection_page(collection, limit=2, after=encode_cursor("/u/abc/activities/1"))
+    assert [item["id"] for item in second["orderedItems"]] == ["/u/abc/activities/2", "/u/abc/activities/3"]
+    assert "next" in second and "prev" in second
+
+    back = collection_page(collection, limit=2, before=encode_cursor("/u/abc/activities/2"))
+    assert back["orderedItems"] == first["orderedItems"]
+
+    last = collection_page(collection, limit=2, after=encode_cursor("/u/abc/activities/3"))
+    assert len(last["orderedItems"]) == 1
+    assert "next" not in last
+
+
+def test_collection_bad_cursor(collection):
+    assert decode_cursor(encode_cursor("/u/abc/activities/1")) == "/u/abc/activities/1"
+
+    with pytest.raises(ValueError):
+        collection_page(collection, limit=2, after=encode_cursor("/u/abc/activities/missing"))
+
+
+def test_collection_since(collection):
+    """A delta cursor returns only the items added after it, oldest first if they don't fit one page."""
+    items = collection["items"]
+    head = collection_page(collection, limit=2)
+    since = head["prev"].rpartition("since=")[2]
+
+    nothing = collection_page(collection, limit=2, since=since)
+    assert nothing["orderedItems"] == []
+    assert nothing["prev"] == head["prev"]
+
+    collection["items"] = [{"id": f"/u/abc/activities/{i}", "type": "Create"} for i in (8, 7, 6, 5)] + items
+    delta = collection_page(collection, limit=2, since=since)
+    assert [item["id"] for item in delta["orderedItems"]] == ["/u/abc/activities/6", "/u/abc/activities/5"]
+
+    rest = collection_page(collection, limit=2, before=encode_cursor("/u/abc/activities/6"))
+    assert [item["id"] for item in rest["orderedItems"]] == ["/u/abc/activities/8", "/u/abc/activities/7"]
+    assert rest["prev"].endswith(f"since={encode_since(9, '/u/abc/activities/8')}")
+
+    # Still found after an older item was removed
+    del collection["items"][-1]
+    assert len(collection_page(collection, limit=10, since=since)["orderedItems"]) == 4
+
+    with pytest.raises(ValueError):
+        collection_page(collection, limit=2, since=encode_since(5, "/u/abc/activities/missing"))
+    with pytest.raises(ValueError):
+        collection_page(collection, limit=2, since=encode_cursor("not-a-position"))
+
+
+def test_index_of_cached_positions():
+    """Positions are reused as items are added, and rebuilt once items were removed."""
+    items = [{"id": f"/c/{i}"} for i in range(5)]
+    assert index_of("/c", items, "/c/3") == 3
+
+    items.insert(0, {"id": "/c/new"})
+    assert index_of("/c", items, "/c/3") == 4
+    assert get_position_cache().get("/c")["/c/3"] == 1
+
+    del items[1:3]
+    assert index_of("/c", items, "/c/3") == 2
+    with pytest.raises(ValueError):
+        index_of("/c", items, "/c/1")
+
+
+def test_root_cache_skips_stale_roots():
+    """A root loaded before its collection was invalidated isn't cached."""
+    root_cache = RootCache()
+    loaded_at = time.monotonic()
+    root_cache.drop("/u/abc/outbox")
+
+    root_cache.set("/u/abc/outbox", {"totalItems": 1}, loaded_at=loaded_at)
+    assert root_cache.get("/u/abc/outbox") is None
+
+    root_cache.set("/u/abc/outbox", {"totalItems": 2}, loaded_at=time.monotonic())
+    assert root_cache.get("/u/abc/outbox") == {"totalItems": 2}
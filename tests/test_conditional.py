@@ -0,0 +1,19 @@
+from fastapi.testclient import TestClient
+
+
+def test_conditional_get(test_auth, client: TestClient):
+    """Unchanged actors and collections are answered 304 to a matching If-None-Match."""
+    user = client.get("/me", headers=test_auth).json()
+
+    for path, headers in ((user["outbox"], {}), (user["inbox"], {}), ("/me", test_auth)):
+        response = client.get(path, headers=headers)
+        response.raise_for_status()
+        etag = response.headers["etag"]
+
+        response = client.get(path, headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        assert response.content == b""
+
+        response = client.get(path, headers={**headers, "If-None-Match": '"something-else"'})
+        assert response.status_code == 200
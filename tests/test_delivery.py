@@ -0,0 +1,216 @@
+import httpx
+import orjson
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from app.services.delivery import (
+    Deliverer,
+    ForbiddenAddress,
+    encode_for_delivery,
+    get_remote_members,
+    get_remote_recipients,
+    is_public_address,
+    resolve_public,
+)
+
+BASE_URL = "https://local.example"
+
+
+class RemoteServer:
+    """A stand-in remote server: actors with a shared inbox, and inboxes recording what they receive."""
+
+    def __init__(self, failures: int = 0, status: int = 503):
+        self.failures = failures
+        self.status = status
+        self.received: list[tuple[str, dict]] = []
+        self.actor_fetches = 0
+        self.app = Starlette(
+            routes=[
+                Route("/users/{name}", self.actor),
+                Route("/inbox", self.inbox, methods=["POST"]),
+                Route("/users/{name}/inbox", self.inbox, methods=["POST"]),
+            ]
+        )
+
+    async def actor(self, request: Request):
+        self.actor_fetches += 1
+        actor_id = str(request.url)
+        return JSONResponse(
+            {
+                "id": actor_id,
+                "type": "Person",
+                "inbox": f"{actor_id}/inbox",
+                "endpoints": {"sharedInbox": f"{request.base_url}inbox"},
+            }
+        )
+
+    async def inbox(self, request: Request):
+        if self.failures > 0:
+            self.failures -= 1
+            return Response(status_code=self.status)
+        self.received.append((request.url.path, orjson.loads(await request.body())))
+        return Response(status_code=202)
+
+
+async def resolve_example(host: str, port: int) -> str:
+    # The remote servers of the tests all live at a documentation address
+    return "93.184.215.14"
+
+
+def make_deliverer(server: RemoteServer, **kwargs) -> Deliverer:
+    kwargs.setdefault("resolver", resolve_example)
+    return Deliverer(BASE_URL, transport=httpx.ASGITransport(app=server.app), backoff_base=0.001, **kwargs)
+
+
+ACTIVITY = {
+    "id": "/u/abc/activities/1",
+    "type": "Create",
+    "actor": "/u/abc",
+    "to": ["https://remote.example/users/alice", "https://www.w3.org/ns/activitystreams#Public"],
+    "cc": ["https://remote.example/users/bob", "/u/xyz"],
+    "bcc": ["https://remote.example/users/carol"],
+    "object": {"id": "/u/abc/notes/1", "type": "Note", "attributedTo": "/u/abc", "content": "/not/a/link"},
+}
+
+
+def test_encode_for_delivery():
+    """Delivered activities have absolute IDs and no blind recipients."""
+    assert get_remote_recipients(ACTIVITY) == {
+        "https://remote.example/users/alice",
+        "https://remote.example/users/bob",
+        "https://remote.example/users/carol",
+    }
+
+    activity = orjson.loads(encode_for_delivery(ACTIVITY, BASE_URL))
+    assert activity["id"] == f"{BASE_URL}/u/abc/activities/1"
+    assert activity["cc"] == ["https://remote.example/users/bob", f"{BASE_URL}/u/xyz"]
+    assert activity["object"]["attributedTo"] == f"{BASE_URL}/u/abc"
+    assert activity["object"]["content"] == "/not/a/link"
+    assert "bcc" not in activity
+
+
+@pytest.mark.asyncio
+async def test_shared_inbox_delivery():
+    """Recipients on one server get a single delivery, to its shared inbox."""
+    server = RemoteServer()
+    deliverer = make_deliverer(server)
+    await deliverer.start()
+    try:
+        deliverer.submit(ACTIVITY)
+        await deliverer.join()
+    finally:
+        await deliverer.stop()
+
+    assert [path for path, _ in server.received] == ["/inbox"]
+    assert server.received[0][1]["id"] == f"{BASE_URL}/u/abc/activities/1"
+    assert deliverer.stats()["delivered"] == 1
+
+
+@pytest.mark.asyncio
+async def test_delivery_retries():
+    """Failed deliveries are retried, in order, until they succeed."""
+    server = RemoteServer(failures=2)
+    deliverer = make_deliverer(server)
+    # Known actors, so the activities are queued in the order they are submitted
+    for name in ("alice", "bob", "carol"):
+        deliverer.actors.set(f"https://remote.example/users/{name}", {"inbox": "https://remote.example/inbox"})
+    await deliverer.start()
+    try:
+        for i in range(3):
+            deliverer.submit({**ACTIVITY, "id": f"/u/abc/activities/{i}"})
+        await deliverer.join()
+    finally:
+        await deliverer.stop()
+
+    assert [activity["id"] for _, activity in server.received] == [f"{BASE_URL}/u/abc/activities/{i}" for i in range(3)]
+    assert deliverer.retried == 2
+    assert deliverer.dead == 0
+
+
+@pytest.mark.asyncio
+async def test_dead_letter():
+    """Deliveries rejected permanently, or out of attempts, are dead-lettered."""
+    server = RemoteServer(failures=10, status=403)
+    deliverer = make_deliverer(server)
+    await deliverer.start()
+    try:
+        deliverer.submit(ACTIVITY)
+        await deliverer.join()
+    finally:
+        await deliverer.stop()
+    assert (deliverer.retried, deliverer.dead) == (0, 1)
+
+    server = RemoteServer(failures=10, status=500)
+    deliverer = make_deliverer(server, max_attempts=3)
+    await deliverer.start()
+    try:
+        deliverer.submit(ACTIVITY)
+        await deliverer.join()
+    finally:
+        await deliverer.stop()
+    assert (deliverer.retried, deliverer.dead) == (2, 1)
+    assert server.received == []
+
+
+@pytest.mark.asyncio
+async def test_non_public_addresses_refused():
+    """Actors and inboxes on loopback, private or link-local addresses are never requested."""
+    assert is_public_address("93.184.215.14")
+    for address in ("127.0.0.1", "10.1.2.3", "169.254.169.254", "::1", "fd00::1", "::ffff:192.168.0.1"):
+        assert not is_public_address(address)
+
+    with pytest.raises(ForbiddenAddress):
+        await resolve_public("localhost", 80)
+
+    server = RemoteServer()
+    deliverer = make_deliverer(server, resolver=resolve_public)
+    await deliverer.start()
+    try:
+        with pytest.raises(ForbiddenAddress):
+            await deliverer.request("GET", "http://169.254.169.254/latest/meta-data")
+
+        # An inbox named by a remote actor is checked too
+        deliverer.actors.set("https://remote.example/users/alice", {"inbox": "http://127.0.0.1:6379/inbox"})
+        deliverer.addresses.set(("remote.example", 443), "93.184.215.14")
+        deliverer.submit({**ACTIVITY, "cc": [], "bcc": []})
+        await deliverer.join()
+    finally:
+        await deliverer.stop()
+
+    assert server.received == []
+    assert deliverer.dead == 1
+
+
+class DictStore:
+    def __init__(self, *objects):
+        self.objects = {obj["id"]: obj for obj in objects}
+
+    async def dereference(self, object_id):
+        return self.objects.get(object_id)
+
+
+@pytest.mark.asyncio
+async def test_followers_delivery():
+    """The remote members of the actor's own followers get it, one delivery per server, others' followers don't."""
+    followers = [f"https://remote.example/users/f{i}" for i in range(20)]
+    store = DictStore(
+        {"id": "/u/abc/followers", "type": "OrderedCollection", "orderedItems": ["/u/local", *followers]},
+        {"id": "/u/xyz/followers", "type": "OrderedCollection", "orderedItems": ["https://remote.example/users/z"]},
+    )
+    activity = {**ACTIVITY, "to": ["/u/abc/followers", "/u/xyz/followers"], "cc": [], "bcc": []}
+    assert await get_remote_members(store, activity) == set(followers)
+
+    server = RemoteServer()
+    deliverer = make_deliverer(server)
+    await deliverer.start()
+    try:
+        deliverer.submit(activity, await get_remote_members(store, activity))
+        await deliverer.join()
+    finally:
+        await deliverer.stop()
+
+    assert [path for path, _ in server.received] == ["/inbox"]
+    assert server.actor_fetches == 20
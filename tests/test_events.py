@@ -0,0 +1,105 @@
+import orjson
+import pytest
+from fastapi import HTTPException
+
+from app.api.stream import stream_events, stream_outbox
+from app.services.events import RESET, EventHub, RedisEventHub, TooManyConnections
+
+
+@pytest.mark.asyncio
+async def test_publish_reaches_topic_subscribers():
+    """Subscribers get the events of their topics, once even if they follow several of its topics."""
+    hub = EventHub()
+    inbox = hub.subscribe(["/u/a/inbox", "/u/big/followers"])
+    other = hub.subscribe(["/u/b/inbox"])
+
+    await hub.publish(["/u/a/inbox", "/u/big/followers"], {"id": "/u/c/activities/1"})
+
+    events = await inbox.get(timeout=1)
+    assert [orjson.loads(data) for _, data in events] == [{"id": "/u/c/activities/1"}]
+    assert await other.get(timeout=0.01) == []
+
+    hub.unsubscribe(inbox)
+    hub.unsubscribe(other)
+    assert len(hub) == 0
+
+
+@pytest.mark.asyncio
+async def test_replay_and_reset():
+    """Resuming replays the buffered events after the last one seen, or asks for a refetch once it's gone."""
+    hub = EventHub(buffer_size=3)
+    for n in range(4):
+        await hub.publish(["/u/a/inbox" if n % 2 else "/u/b/inbox"], {"n": n})
+    first_id, second_id = hub._buffer[0][1], hub._buffer[1][1]
+
+    topics = frozenset(["/u/a/inbox"])
+    assert [orjson.loads(data) for _, data in hub.replay(topics, first_id)] == [{"n": 3}]
+    assert hub.replay(topics, second_id) == [(hub._buffer[2][1], b'{"n":3}')]
+    assert hub.replay(topics, "evicted") is None
+
+    subscription = hub.subscribe(topics)
+    hub.reset()
+    assert await subscription.get(timeout=1) == [RESET]
+    assert hub.replay(topics, second_id) is None
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_overflows():
+    hub = EventHub(queue_size=2)
+    subscription = hub.subscribe(["/u/a/inbox"])
+    for n in range(3):
+        await hub.publish(["/u/a/inbox"], {"n": n})
+
+    assert len(await subscription.get(timeout=1)) == 2
+    assert subscription.overflowed
+
+
+@pytest.mark.asyncio
+async def test_stream_events():
+    """The stream sends its retry delay, resumes, then pushes new events and heartbeats."""
+    hub = EventHub()
+    await hub.publish(["/u/a/outbox"], {"n": 0})
+    last_event_id = hub._buffer[0][1]
+    await hub.publish(["/u/a/outbox"], {"n": 1})
+
+    stream = stream_events(hub, ["/u/a/outbox"], last_event_id, heartbeat=0.01)
+    assert await anext(stream) == b"retry: 3000\n\n"
+    assert (await anext(stream)).endswith(b'\ndata: {"n":1}\n\n')
+    assert await anext(stream) == b": ping\n\n"
+
+    await hub.publish(["/u/a/outbox"], {"n": 2})
+    assert (await anext(stream)).endswith(b'\ndata: {"n":2}\n\n')
+
+    await stream.aclose()
+    assert len(hub) == 0
+
+
+def test_connection_limit():
+    """Subscribing takes one of the hub's connection slots, until unsubscribed."""
+    hub = EventHub(max_connections=1)
+    subscription = hub.subscribe(["/u/a/inbox"])
+    with pytest.raises(TooManyConnections):
+        hub.subscribe(["/u/b/inbox"])
+
+    hub.unsubscribe(subscription)
+    hub.unsubscribe(hub.subscribe(["/u/b/inbox"]))
+    assert len(hub) == 0
+
+
+def test_redis_event_hub_receive():
+    """Events from other processes are dispatched, our own were already dispatched locally."""
+    hub = RedisEventHub(redis=None)
+    subscription = hub.subscribe(["/u/a/inbox"])
+
+    hub.receive(orjson.dumps({"origin": "other", "id": "1", "topics": ["/u/a/inbox"], "data": {"n": 1}}))
+    hub.receive(orjson.dumps({"origin": hub.origin, "id": "2", "topics": ["/u/a/inbox"], "data": {"n": 2}}))
+
+    assert list(subscription._events) == [("1", b'{"n":1}')]
+
+
+@pytest.mark.asyncio
+async def test_outbox_stream_only_for_owner():
+    """Outbox events carry direct messages in full, so other users can't follow someone else's outbox."""
+    with pytest.raises(HTTPException) as info:
+        await stream_outbox("a", request=None, user={"id": "/u/b"})
+    assert info.value.status_code == 403
@@ -0,0 +1,110 @@
+from contextlib import asynccontextmanager
+
+import pytest
+
+from app.core.settings import get_settings
+from app.services import fanout
+from app.services.fanout import fan_out, get_fanout_cache, get_recent_merges, merge_streams, merge_streams_throttled
+
+
+class DictStore:
+    """Keeps objects in a dict, counting writes."""
+
+    def __init__(self, objects=()):
+        self.objects = {obj["id"]: obj for obj in objects}
+        self.writes = 0
+
+    async def dereference(self, object_id):
+        obj = self.objects.get(object_id)
+        return dict(obj) if obj else None
+
+    async def store(self, obj):
+        self.writes += 1
+        self.objects[obj["id"]] = dict(obj)
+
+
+def make_store(followers: int) -> DictStore:
+    members = [f"/u/f{i}" for i in range(followers)]
+    return DictStore(
+        [
+            {"id": "/u/author/followers", "type": "OrderedCollection", "orderedItems": members},
+            *({"id": f"{member}/inbox", "type": "OrderedCollection", "orderedItems": []} for member in members),
+        ]
+    )
+
+
+def post(n: int) -> dict:
+    return {"id": f"/u/author/activities/{n}", "type": "Create", "actor": "/u/author", "to": ["/u/author/followers"]}
+
+
+@pytest.fixture(autouse=True)
+def clear_fanout_cache():
+    get_fanout_cache().clear()
+    get_recent_merges().clear()
+
+
+@pytest.mark.asyncio
+async def test_fan_out_on_write(monkeypatch):
+    """Followers get the activity in their inbox, once, however often it is fanned out."""
+    monkeypatch.setattr(get_settings(), "fanout_read_threshold", 100)
+    store = make_store(10)
+
+    inbox_ids, large = await fan_out(store, post(1))
+    assert len(inbox_ids) == 10 and large == []
+    assert await fan_out(store, post(1)) == ([], [])
+    assert store.objects["/u/f3/inbox"]["orderedItems"] == ["/u/author/activities/1"]
+
+
+@pytest.mark.asyncio
+async def test_fan_out_on_read(monkeypatch):
+    """Above the threshold, activities are written once and merged into inboxes when they are read."""
+    monkeypatch.setattr(get_settings(), "fanout_read_threshold", 5)
+    store = make_store(10)
+
+    await fan_out(store, post(1))
+    await fan_out(store, post(2))
+    assert store.objects["/u/f3/inbox"]["orderedItems"] == []
+    assert store.writes == 3  # the stream twice, the registry once
+
+    assert await merge_streams(store, "/u/f3", "/u/f3/inbox")
+    assert store.objects["/u/f3/inbox"]["orderedItems"] == ["/u/author/activities/2", "/u/author/activities/1"]
+    assert not await merge_streams(store, "/u/f3", "/u/f3/inbox")
+
+    await fan_out(store, post(3))
+    assert await merge_streams(store, "/u/f3", "/u/f3/inbox")
+    assert store.objects["/u/f3/inbox"]["orderedItems"][0] == "/u/author/activities/3"
+    assert len(store.objects["/u/f3/inbox"]["orderedItems"]) == 3
+
+    # Not a follower
+    assert not await merge_streams(store, "/u/someone", "/u/someone/inbox")
+
+    # Merged on reads at most once per `fanout_cache_ttl`
+    await fan_out(store, post(4))
+    assert await merge_streams_throttled(store, "/u/f3", "/u/f3/inbox")
+    await fan_out(store, post(5))
+    assert not await merge_streams_throttled(store, "/u/f3", "/u/f3/inbox")
+
+
+@pytest.mark.asyncio
+async def test_inbox_updates_take_the_redis_lock(monkeypatch):
+    """With Redis, every inbox update holds that inbox's cross-process lock."""
+    locks = []
+
+    class FakeRedis:
+        @asynccontextmanager
+        async def lock(self, name, timeout, blocking_timeout):
+            locks.append(name)
+            yield
+
+    monkeypatch.setattr(fanout, "get_redis", FakeRedis)
+    monkeypatch.setattr(get_settings(), "fanout_read_threshold", 100)
+
+    await fan_out(make_store(3), post(1))
+    assert sorted(locks) == [f"activity-serve:fanout:/u/f{i}/inbox" for i in range(3)]
+
+
+@pytest.mark.asyncio
+async def test_only_own_collections_expanded():
+    """Addressing another user's followers reaches none of them."""
+    activity = {**post(1), "actor": "/u/intruder", "id": "/u/intruder/activities/1"}
+    assert await fan_out(make_store(3), activity) == ([], [])
@@ -0,0 +1,142 @@
+import asyncio
+import datetime
+import time
+
+import httpx
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from jose import jwt
+
+from app.core.settings import Settings
+from app.services import google_auth
+from app.services.google_auth import SigningKeys, verify_google_token
+
+
+def make_certificate(private_key) -> str:
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "test")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(private_key.public_key())
+        .serial_number(1)
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(private_key, hashes.SHA256())
+    )
+    return certificate.public_bytes(serialization.Encoding.PEM).decode()
+
+
+@pytest.fixture
+def private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture
+def signing_keys(monkeypatch, private_key):
+    fetches = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        fetches.append(request.url)
+        return httpx.Response(
+            200, json={"key-1": make_certificate(private_key)}, headers={"Cache-Control": "public, max-age=3600"}
+        )
+
+    keys = SigningKeys("https://keys.example.com/certs", transport=httpx.MockTransport(handler))
+    keys.fetches = fetches
+    monkeypatch.setattr(google_auth, "get_signing_keys", lambda: keys)
+    monkeypatch.setattr(google_auth, "get_settings", lambda: Settings(google_client_id="client-id"))
+    return keys
+
+
+def sign(private_key, kid: str = "key-1", **claims) -> str:
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    now = int(time.time())
+    claims = {
+        "iss": "https://accounts.google.com",
+        "aud": "client-id",
+        "sub": "abc",
+        "iat": now,
+        "exp": now + 60,
+        **claims,
+    }
+    return jwt.encode(claims, pem, algorithm="RS256", headers={"kid": kid})
+
+
+@pytest.mark.asyncio
+async def test_verify_google_token(signing_keys, private_key):
+    """Tokens are verified locally, fetching the keys once."""
+    assert (await verify_google_token(sign(private_key)))["sub"] == "abc"
+    assert (await verify_google_token(sign(private_key, sub="xyz")))["sub"] == "xyz"
+    assert len(signing_keys.fetches) == 1
+
+
+@pytest.mark.asyncio
+async def test_verify_google_token_rejects(signing_keys, private_key):
+    """Tokens for another audience, expired or signed with an unknown key are rejected."""
+    with pytest.raises(ValueError):
+        await verify_google_token(sign(private_key, aud="someone-else"))
+
+    with pytest.raises(ValueError):
+        await verify_google_token(sign(private_key, exp=int(time.time()) - 10))
+
+    with pytest.raises(ValueError):
+        await verify_google_token(sign(private_key, kid="key-2"))
+
+    other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with pytest.raises(ValueError):
+        await verify_google_token(sign(other_key))
+
+
+@pytest.mark.asyncio
+async def test_expired_keys_served_while_refresh_fails(private_key):
+    """Past expiry, a failing endpoint leaves the old keys in use for the grace period, fetched at most once."""
+    responses = [httpx.Response(200, json={"key-1": make_certificate(private_key)})]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if responses:
+            return responses.pop()
+        raise httpx.ConnectError("unreachable")
+
+    keys = SigningKeys("https://keys.example.com/certs", default_ttl=1, transport=httpx.MockTransport(handler))
+    assert await keys.get("key-1") is not None
+    keys._expires_at -= 10
+    keys._attempted_at -= 100
+
+    results = await asyncio.gather(*[keys.get("key-1") for _ in range(5)])
+    assert all(key is not None for key in results)
+    await asyncio.sleep(0.01)
+    assert keys.can_refresh(time.time()) is False  # the failed fetch isn't retried right away
+
+    # Past the grace period, lookups fail fast until the next attempt is due
+    keys._expires_at -= keys.grace_period
+    with pytest.raises(RuntimeError):
+        await keys.get("key-1")
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_doesnt_cancel_refresh(private_key):
+    """Callers share a refresh, one of them going away doesn't cancel it for the others."""
+    release = asyncio.Event()
+
+    class SlowTransport(httpx.AsyncBaseTransport):
+        async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+            await release.wait()
+            return httpx.Response(200, json={"key-1": make_certificate(private_key)})
+
+    keys = SigningKeys("https://keys.example.com/certs", transport=SlowTransport())
+    first = asyncio.create_task(keys.get("key-1"))
+    second = asyncio.create_task(keys.get("key-1"))
+    await asyncio.sleep(0.01)
+
+    first.cancel()
+    release.set()
+    assert await second is not None
+    with pytest.raises(asyncio.CancelledError):
+        await first
@@ -6,3 +6,11 @@ def test_health_check(client: TestClient):
     response = client.get("/healthz")
 
     assert response.status_code == 200
+
+
+def test_queue_health(client: TestClient):
+    """The queue health endpoint reports depth and lag."""
+    response = client.get("/healthz/queue")
+
+    assert response.status_code == 200
+    assert {"depth", "lag", "processed", "failed"} <= response.json().keys()
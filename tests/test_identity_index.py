@@ -0,0 +1,74 @@
+import pytest
+
+from activity_store import ActivityStore
+from app.core.settings import get_settings
+from app.services.bootstrap import bootstrap_system
+from app.services.user import (
+    build_identity,
+    build_user,
+    get_identity_by_email,
+    get_identity_by_provider,
+    get_or_create_user,
+)
+
+
+def make_claims(sub, email):
+    return {
+        "sub": sub,
+        "iss": "https://securetoken.google.com/example",
+        "name": "Indexed User",
+        "email": email,
+        "email_verified": True,
+        "firebase": {"sign_in_provider": "google.com", "identities": {"google.com": [f"google-{sub}"]}},
+    }
+
+
+@pytest.mark.asyncio
+async def test_identity_index():
+    """Identities are found by provider and sub, and by verified email."""
+    claims = make_claims("indexed-user", "Indexed@Example.com")
+
+    async with ActivityStore() as store:
+        user = await get_or_create_user(store, claims)
+
+        identity = await get_identity_by_provider(store, "google.com", "indexed-user")
+        assert identity["attributedTo"] == user["id"]
+
+        identity = await get_identity_by_provider(store, "google.com", "google-indexed-user")
+        assert identity["attributedTo"] == user["id"]
+
+        identity = await get_identity_by_email(store, "indexed@example.com")
+        assert identity["attributedTo"] == user["id"]
+
+        assert await get_identity_by_provider(store, "google.com", "someone-else") is None
+
+
+@pytest.mark.asyncio
+async def test_link_identities_by_email(monkeypatch):
+    """With linking on, a new login with a known verified email joins the existing user."""
+    monkeypatch.setattr(get_settings(), "link_identities_by_email", True)
+
+    async with ActivityStore() as store:
+        first = await get_or_create_user(store, make_claims("linked-first", "linked@example.com"))
+        second = await get_or_create_user(store, make_claims("linked-second", "linked@example.com"))
+
+        assert first["id"] == second["id"]
+
+
+@pytest.mark.asyncio
+async def test_bootstrap_backfills_identity_index():
+    """Identities stored before the index existed are indexed when the app is bootstrapped."""
+    claims = make_claims("unindexed-user", "unindexed@example.com")
+
+    async with ActivityStore() as store:
+        user = build_user(name="Unindexed User")[0]
+        await store.store(user)
+        await store.store(build_identity(claims, user))
+        assert await get_identity_by_email(store, "unindexed@example.com") is None
+
+        await bootstrap_system(store)
+
+        identity = await get_identity_by_email(store, "unindexed@example.com")
+        assert identity["attributedTo"] == user["id"]
+        identity = await get_identity_by_provider(store, "google.com", "unindexed-user")
+        assert identity["attributedTo"] == user["id"]
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import orjson
+import pytest
+
+from app.core.redis import RedisSubscriber
+from app.services.invalidation import LocalChannel, RedisChannel
+from app.services.tokens import TokenCache
+
+
+@pytest.mark.asyncio
+async def test_purge_reaches_every_token_cache():
+    """A purge in one cache drops the subject's tokens from every cache on the channel."""
+    channel = LocalChannel()
+    first, second = TokenCache(channel=channel), TokenCache(channel=channel)
+    claims = {"sub": "abc", "iat": time.time() - 10, "exp": time.time() + 60}
+    await first.put("token-a", claims)
+    await second.put("token-a", claims)
+
+    await first.purge_sub("abc")
+
+    assert await second.get("token-a") is None
+    assert await second.is_revoked(claims)
+
+
+def test_redis_channel_receive():
+    """Messages from other processes are dispatched, our own were already applied locally."""
+    channel = RedisChannel(redis=None)
+    received = []
+    channel.subscribe("users", received.append)
+
+    channel.receive(orjson.dumps({"origin": "other", "topic": "users", "key": "/u/abc"}))
+    channel.receive(orjson.dumps({"origin": channel.origin, "topic": "users", "key": "/u/xyz"}))
+    channel.dispatch_all()
+
+    assert received == ["/u/abc", None]
+
+
+class FakePubSub:
+    def __init__(self, messages: list):
+        self.messages = messages
+
+    async def subscribe(self, channel: str):
+        pass
+
+    async def listen(self):
+        for message in self.messages:
+            if isinstance(message, Exception):
+                raise message
+            yield message
+        await asyncio.Event().wait()
+
+    async def aclose(self):
+        pass
+
+
+class FakeRedis:
+    def __init__(self, *connections: list):
+        self.connections = list(connections)
+
+    def pubsub(self):
+        return FakePubSub(self.connections.pop(0))
+
+
+@pytest.mark.asyncio
+async def test_redis_subscriber_resubscribes():
+    """Messages are passed on, and a dropped subscription is re-established and reported."""
+    redis = FakeRedis(
+        [{"type": "subscribe"}, {"type": "message", "data": b"1"}, ConnectionError("gone")],
+        [{"type": "message", "data": b"2"}],
+    )
+    events = []
+    subscriber = RedisSubscriber(redis, "channel", events.append, lambda: events.append("resubscribed"), 0)
+
+    await subscriber.start()
+    for _ in range(10):
+        await asyncio.sleep(0)
+    await subscriber.stop()
+
+    assert events == [b"1", "resubscribed", b"2"]
@@ -0,0 +1,56 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.metrics import router as metrics_router
+from app.core.metrics import Counter, Histogram, render_metrics
+from app.middleware.metrics import MetricsMiddleware
+
+
+@pytest.fixture
+def metrics_client():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(metrics_router)
+
+    @app.get("/things/{key}")
+    async def _(key: str):
+        return {"key": key}
+
+    with TestClient(app) as client:
+        yield client
+
+
+def test_request_duration_by_route(metrics_client):
+    """Requests are labelled by route template, not by path."""
+    metrics_client.get("/things/a")
+    metrics_client.get("/things/b")
+    metrics_client.get("/missing")
+
+    response = metrics_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'activity_serve_http_request_duration_seconds_count{method="GET",route="/things/{key}",status="200"} 2' in (
+        response.text
+    )
+    assert 'route="unmatched",status="404"' in response.text
+    assert "/things/a" not in response.text
+
+
+@pytest.mark.asyncio
+async def test_render_metrics():
+    """Counters and cumulative histogram buckets are rendered in the text format."""
+    counter = Counter("test_things_total", "Things.", ("kind",))
+    counter.inc("a")
+    counter.inc("a", amount=2)
+    histogram = Histogram("test_seconds", "Seconds.", buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+
+    text = await render_metrics()
+    assert "# TYPE test_things_total counter" in text
+    assert 'test_things_total{kind="a"} 3' in text
+    assert 'test_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_seconds_bucket{le="1.0"} 2' in text
+    assert 'test_seconds_bucket{le="+Inf"} 2' in text
+    assert "test_seconds_count 2" in text
@@ -0,0 +1,35 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from fastapi.testclient import TestClient
+
+from app.middleware.logging import LoggingMiddleware
+from app.middleware.normalize import NormalizeMiddleware
+
+
+@pytest.fixture
+def normalize_client():
+    app = FastAPI()
+    app.add_middleware(LoggingMiddleware)
+    app.add_middleware(NormalizeMiddleware)
+
+    @app.get("/json")
+    async def _():
+        return ORJSONResponse({"id": "/u/abc/", "items": [{"actor": "/u/abc/", "content": "a/"}]})
+
+    @app.get("/text")
+    async def _():
+        return PlainTextResponse("/u/abc/")
+
+    with TestClient(app) as client:
+        yield client
+
+
+def test_normalize_ids(normalize_client):
+    """Trailing slashes are removed from IDs in JSON responses only."""
+    response = normalize_client.get("/json")
+    assert response.json() == {"id": "/u/abc", "items": [{"actor": "/u/abc", "content": "a/"}]}
+    assert response.headers["content-length"] == str(len(response.content))
+
+    response = normalize_client.get("/text")
+    assert response.text == "/u/abc/"
@@ -1,5 +1,8 @@
 import pytest
 from fastapi.testclient import TestClient
+
+from app.core.settings import get_settings
+from app.services.queue import get_queue
 from .helpers import assert_response
 
 
@@ -23,3 +26,101 @@ def test_send_activity(test_auth, client: TestClient):
         json={"type": "Create", "actor": user["id"], "object": {"type": "Note", "content": "Hello, world!"}},
     )
     assert_response(response, {"type": "Create", "object": {}})
+
+
+def test_outbox_pages(test_auth, client: TestClient):
+    """The outbox root links to its first page."""
+    user = client.get("/me", headers=test_auth).json()
+
+    response = client.get(user["outbox"])
+    assert_response(response, {"type": "OrderedCollection"})
+    root = response.json()
+    assert "totalItems" in root
+
+    response = client.get(root["first"], params={"limit": 5})
+    assert_response(response, {"type": "OrderedCollectionPage"})
+    assert len(response.json()["orderedItems"]) <= 5
+
+    response = client.get(user["outbox"], params={"after": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+def test_send_activity_async(test_auth, client: TestClient, monkeypatch):
+    """In async mode the activity is queued and its submission can be followed."""
+    monkeypatch.setattr(get_settings(), "outbox_submit_mode", "async")
+    user = client.get("/me", headers=test_auth).json()
+    note = {"type": "Create", "object": {"type": "Note", "content": "Hello, later!"}}
+
+    # Refused without Redis, the in-memory queue doesn't survive a restart
+    response = client.post(user["outbox"], headers=test_auth, json=note)
+    assert response.status_code == 503
+
+    # The in-process queue standing in for Redis
+    monkeypatch.setattr(get_queue(), "durable", True)
+    response = client.post(user["outbox"], headers=test_auth, json=note)
+    assert response.status_code == 202
+    assert response.json()["status"] == "pending"
+
+    response = client.get(response.headers["location"], headers=test_auth)
+    assert_response(response, {"type": "Submission"})
+    assert response.json()["status"] in ("pending", "processed")
+
+
+def test_send_batch(test_auth, client: TestClient):
+    """A batch reports a result for every activity, in order."""
+    user = client.get("/me", headers=test_auth).json()
+    note = {"type": "Create", "object": {"type": "Note", "content": "Hello, batch!"}}
+
+    response = client.post(
+        f"{user['outbox']}/batch",
+        headers=test_auth,
+        json=[note, {**note, "actor": "/u/someone-else"}, note],
+    )
+    response.raise_for_status()
+    result = response.json()
+    assert (result["totalItems"], result["accepted"], result["failed"]) == (3, 2, 1)
+    assert [item["status"] for item in result["items"]] == ["processed", "failed", "processed"]
+    assert result["items"][0]["id"].startswith(f"{user['id']}/activities/")
+
+    response = client.post(
+        f"{user['outbox']}/batch",
+        headers={**test_auth, "Content-Type": "application/x-ndjson"},
+        content=b'{"type": "Create", "object": {"type": "Note"}}\nnot json\n',
+    )
+    response.raise_for_status()
+    assert [item["status"] for item in response.json()["items"]] == ["processed", "failed"]
+
+
+def test_send_batch_async(test_auth, client: TestClient, monkeypatch):
+    """In async mode every queued item gets its own submission status."""
+    monkeypatch.setattr(get_settings(), "outbox_submit_mode", "async")
+    monkeypatch.setattr(get_queue(), "durable", True)
+    user = client.get("/me", headers=test_auth).json()
+    note = {"type": "Create", "object": {"type": "Note", "content": "Hello, later!"}}
+
+    response = client.post(f"{user['outbox']}/batch", headers=test_auth, json=[note, note])
+    response.raise_for_status()
+    items = response.json()["items"]
+    assert [item["status"] for item in items] == ["queued", "queued"]
+    assert items[0]["submission"] != items[1]["submission"]
+
+    response = client.get(items[0]["submission"], headers=test_auth)
+    assert_response(response, {"type": "Submission"})
+    assert response.json()["object"] == items[0]["id"]
+
+
+def test_send_batch_too_large(test_auth, client: TestClient, monkeypatch):
+    """Batches over the limits are refused while they are read."""
+    monkeypatch.setattr(get_settings(), "outbox_batch_max_size", 2)
+    user = client.get("/me", headers=test_auth).json()
+    ndjson = {**test_auth, "Content-Type": "application/x-ndjson"}
+
+    response = client.post(f"{user['outbox']}/batch", headers=ndjson, content=b'{"type": "Create"}\n' * 3)
+    assert response.status_code == 413
+
+    response = client.post(f"{user['outbox']}/batch", headers={**test_auth, "Content-Length": "many"}, content=b"[]")
+    assert response.status_code == 400
+
+    monkeypatch.setattr(get_settings(), "outbox_batch_max_bytes", 10)
+    response = client.post(f"{user['outbox']}/batch", headers=test_auth, json=[{"type": "Create"}])
+    assert response.status_code == 413
@@ -0,0 +1,21 @@
+import asyncio
+import pytest
+
+from activity_store import ActivityStore
+from app.services.user import get_or_create_user
+
+
+@pytest.mark.asyncio
+async def test_concurrent_first_login():
+    """Concurrent first requests for a new identity provision a single user."""
+    claims = {
+        "sub": "concurrent-first-login",
+        "iss": "https://example.com/",
+        "name": "Concurrent User",
+    }
+
+    async with ActivityStore() as store:
+        users = await asyncio.gather(*[get_or_create_user(store, claims) for _ in range(10)])
+
+        assert len({user["id"] for user in users}) == 1
+        assert await store.dereference(users[0]["inbox"])
@@ -0,0 +1,161 @@
+import asyncio
+
+import activity_bus
+import pytest
+
+from app.services.queue import MemoryQueue, QueueFull, RedisQueue
+from app.worker import Worker
+
+
+class FakeBus:
+    def __init__(self, store):
+        pass
+
+    async def process_next(self):
+        return False
+
+
+@pytest.mark.asyncio
+async def test_queue_claims_in_batches():
+    """Entries come off the queue in order, in batches."""
+    queue = MemoryQueue()
+    await queue.put(*[{"activity": {"id": f"/a/{i}"}} for i in range(5)])
+    assert await queue.depth() == 5
+    assert await queue.lag() >= 0
+
+    batch = await queue.claim(3)
+    assert [entry["activity"]["id"] for entry in batch] == ["/a/0", "/a/1", "/a/2"]
+    assert "enqueued_at" in batch[0]
+
+    assert len(await queue.claim(3)) == 2
+    assert await queue.claim(3) == []
+    assert await queue.lag() == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_backpressure():
+    """Producers fail once the queue stays too deep."""
+    queue = MemoryQueue(max_depth=2, put_timeout=0.05)
+    await queue.put({"activity": {}}, {"activity": {}})
+
+    with pytest.raises(QueueFull):
+        await queue.put({"activity": {}})
+
+    with pytest.raises(QueueFull):
+        await asyncio.wait_for(queue.put({"activity": {}}, wait=False), 0.01)
+
+    await queue.claim(1)
+    await queue.put({"activity": {}})
+    assert await queue.depth() == 2
+
+
+class FakeRedis:
+    """The list and sorted set commands RedisQueue uses, in memory."""
+
+    def __init__(self):
+        self.lists: dict[str, list[bytes]] = {}
+        self.zsets: dict[str, dict[bytes, float]] = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def rpush(self, key, *values):
+        self.lists.setdefault(key, []).extend(values)
+
+    async def lpush(self, key, value):
+        self.lists.setdefault(key, []).insert(0, value)
+
+    async def lmove(self, source, destination, src, dest):
+        if not self.lists.get(source):
+            return None
+        value = self.lists[source].pop(0)
+        self.lists.setdefault(destination, []).append(value)
+        return value
+
+    async def lrem(self, key, count, value):
+        if value in self.lists.get(key, []):
+            self.lists[key].remove(value)
+            return 1
+        return 0
+
+    async def lrange(self, key, start, end):
+        return list(self.lists.get(key, []))
+
+    async def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    async def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    async def zrem(self, key, value):
+        self.zsets.get(key, {}).pop(value, None)
+
+    async def zmscore(self, key, members):
+        return [self.zsets.get(key, {}).get(member) for member in members]
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append(getattr(self.redis, name)(*args))
+
+    async def execute(self):
+        return [await call for call in self.calls]
+
+
+@pytest.mark.asyncio
+async def test_redis_queue_requeues_unacknowledged_entries():
+    """Claimed entries stay in the processing list until acknowledged, stale claims go back on the queue."""
+    redis = FakeRedis()
+    queue = RedisQueue(redis, claim_timeout=60)
+    await queue.put(*[{"activity": {"id": f"/a/{i}"}} for i in range(3)])
+
+    first, second = await queue.claim(2)
+    await queue.ack(first)
+    assert await queue.depth() == 1
+    assert len(redis.lists[queue.processing_key]) == 1
+
+    # A live claim is left alone, a stale one is requeued first
+    assert await queue.requeue_stale() == 0
+    redis.zsets[queue.claims_key] = {raw: 0.0 for raw in redis.zsets[queue.claims_key]}
+    assert await queue.requeue_stale() == 1
+    assert [entry["activity"]["id"] for entry in await queue.claim(10)] == ["/a/1", "/a/2"]
+    assert redis.lists[queue.processing_key] != []
+
+
+class FakeStorePool:
+    def get(self):
+        return None
+
+
+class FlakyWorker(Worker):
+    """Fails on `/a/1` and is cancelled on `/a/2`."""
+
+    async def process(self, store, entry):
+        activity_id = entry["activity"]["id"]
+        if activity_id == "/a/1":
+            raise RuntimeError("boom")
+        if activity_id == "/a/2":
+            raise asyncio.CancelledError()
+
+
+@pytest.mark.asyncio
+async def test_worker_releases_unprocessed_entries(monkeypatch):
+    """A failed entry doesn't stop the batch, and an interrupted batch puts its unprocessed entries back in order."""
+    monkeypatch.setattr(activity_bus, "ActivityBus", FakeBus)
+    queue = MemoryQueue()
+    await queue.put(*[{"activity": {"id": f"/a/{i}"}} for i in range(4)])
+
+    with pytest.raises(asyncio.CancelledError):
+        await FlakyWorker(FakeStorePool(), queue, batch_size=10).run_batch()
+
+    assert [entry["activity"]["id"] for entry in await queue.claim(10)] == ["/a/2", "/a/3"]
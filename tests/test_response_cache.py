@@ -0,0 +1,71 @@
+import asyncio
+import pytest
+
+from app.api.user import collection_cache_key
+from app.core.settings import get_settings
+from app.services.response_cache import ResponseCache, get_touched_collections
+
+
+def counting_loader():
+    calls = []
+
+    async def load():
+        calls.append(1)
+        return f'{{"version": {len(calls)}}}'.encode(), {"etag": f'"{len(calls)}"'}
+
+    return load, calls
+
+
+@pytest.mark.asyncio
+async def test_response_cache_hit():
+    """Concurrent misses share one load, later reads are hits."""
+    cache = ResponseCache()
+    load, calls = counting_loader()
+
+    results = await asyncio.gather(*[cache.get_or_load("/u/abc/outbox", "/u/abc/outbox?", load) for _ in range(5)])
+    assert results == [(b'{"version": 1}', {"etag": '"1"'})] * 5
+    assert await cache.get_or_load("/u/abc/outbox", "/u/abc/outbox?", load) == (b'{"version": 1}', {"etag": '"1"'})
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_response_cache_stale_while_revalidate():
+    """Right after an invalidation the stale body is served while it refreshes."""
+    cache = ResponseCache(stale_ttl=60)
+    load, calls = counting_loader()
+
+    await cache.get_or_load("/u/abc/outbox", "key", load)
+    await cache.invalidate("/u/abc/outbox")
+
+    assert await cache.get_or_load("/u/abc/outbox", "key", load) == (b'{"version": 1}', {"etag": '"1"'})
+    await asyncio.sleep(0)
+    assert await cache.get_or_load("/u/abc/outbox", "key", load) == (b'{"version": 2}', {"etag": '"2"'})
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_response_cache_invalidated():
+    """Past the stale window an invalidated entry is loaded again before responding."""
+    cache = ResponseCache(stale_ttl=0)
+    load, calls = counting_loader()
+
+    await cache.get_or_load("/u/abc/outbox", "key", load)
+    await cache.invalidate("/u/abc/outbox")
+    assert await cache.get_or_load("/u/abc/outbox", "key", load) == (b'{"version": 2}', {"etag": '"2"'})
+
+
+def test_touched_collections():
+    activity = {"actor": "/u/abc", "to": ["/u/def", "https://www.w3.org/ns/activitystreams#Public"], "cc": "/u/ghi"}
+    assert get_touched_collections(activity) == {"/u/abc/outbox", "/u/def/inbox", "/u/ghi/inbox"}
+
+
+def test_collection_cache_key():
+    """Only the parameters that change the response are in the key, normalized."""
+    outbox = "/u/a/outbox"
+    page_size = get_settings().collection_page_size
+
+    assert collection_cache_key(outbox, False, 5, None, None, None) == outbox
+    assert collection_cache_key(outbox, True, None, None, None, None) == f"{outbox}?limit={page_size}"
+    assert collection_cache_key(outbox, True, page_size, None, None, None) == f"{outbox}?limit={page_size}"
+    assert collection_cache_key(outbox, False, 5, "abc", None, None) == f"{outbox}?limit=5&after=abc"
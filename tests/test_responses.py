@@ -0,0 +1,71 @@
+import orjson
+import pytest
+
+from app.api.responses import ActivityStreamResponse
+
+
+async def send_response(response: ActivityStreamResponse, method: str, headers: dict[str, str] | None = None):
+    """Send a response to a request with the given method and headers, returning the status and headers sent."""
+    scope = {
+        "type": "http",
+        "method": method,
+        "headers": [(key.lower().encode(), value.encode()) for key, value in (headers or {}).items()],
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    await response(scope, receive, send)
+    start = messages[0]
+    return start["status"], {key.decode(): value.decode() for key, value in start["headers"]}
+
+
+def test_encoded_passthrough():
+    """Pre-encoded JSON is sent as is, with the same headers as the object it encodes."""
+    obj = {"id": "/u/abc", "type": "Person", "name": "Test User"}
+
+    from_dict = ActivityStreamResponse(obj)
+    from_bytes = ActivityStreamResponse(orjson.dumps(obj))
+
+    assert from_bytes.body == from_dict.body
+    assert from_bytes.validators()["etag"] == from_dict.validators()["etag"]
+    assert from_bytes.headers["content-type"] == from_dict.headers["content-type"]
+
+
+@pytest.mark.asyncio
+async def test_validators_only_for_reads():
+    """GET responses carry an ETag and Last-Modified, responses to a POST don't."""
+    obj = {"id": "/u/abc", "type": "Person", "updated": "2024-01-02T03:04:05+00:00"}
+
+    status, headers = await send_response(ActivityStreamResponse(obj), "GET")
+    assert status == 200
+    assert headers["etag"]
+    assert headers["last-modified"] == "Tue, 02 Jan 2024 03:04:05 GMT"
+
+    status, headers = await send_response(ActivityStreamResponse(obj), "POST")
+    assert status == 200
+    assert "etag" not in headers
+    assert "last-modified" not in headers
+
+
+@pytest.mark.asyncio
+async def test_not_modified():
+    """A GET matching the ETag, or not modified since, is answered 304 with the validators."""
+    obj = {"id": "/u/abc", "type": "Person", "updated": "2024-01-02T03:04:05+00:00"}
+    etag = ActivityStreamResponse(obj).validators()["etag"]
+
+    status, headers = await send_response(ActivityStreamResponse(obj), "GET", {"If-None-Match": etag})
+    assert status == 304
+    assert headers["etag"] == etag
+
+    request = {"If-Modified-Since": "Wed, 03 Jan 2024 00:00:00 GMT"}
+    status, headers = await send_response(ActivityStreamResponse(obj), "GET", request)
+    assert status == 304
+    assert headers["last-modified"] == "Tue, 02 Jan 2024 03:04:05 GMT"
+
+    status, _ = await send_response(ActivityStreamResponse(obj), "POST", {"If-None-Match": etag})
+    assert status == 200
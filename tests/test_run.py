@@ -0,0 +1,19 @@
+import pytest
+
+from app.core.settings import Settings
+from run import check_settings
+
+
+def test_check_settings():
+    """Several server processes need Redis and a shared session secret, recycling needs several processes."""
+    shared = {"redis_url": "redis://localhost", "session_secret": "secret"}
+
+    check_settings(Settings(), 1)
+    check_settings(Settings(**shared, server_max_requests=1000), 4)
+
+    with pytest.raises(RuntimeError, match="REDIS_URL"):
+        check_settings(Settings(session_secret="secret"), 4)
+    with pytest.raises(RuntimeError, match="SESSION_SECRET"):
+        check_settings(Settings(redis_url="redis://localhost"), 4)
+    with pytest.raises(RuntimeError, match="SERVER_MAX_REQUESTS"):
+        check_settings(Settings(**shared, server_max_requests=1000), 1)
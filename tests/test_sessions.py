@@ -0,0 +1,63 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.settings import get_settings
+from app.services.sessions import create_session, revoke_sessions, verify_session
+from app.services.tokens import get_token_cache
+
+
+def test_verify_session():
+    """Sessions carry the user ID, and are rejected once tampered with or expired."""
+    session = create_session("/u/abc", max_age=60)
+    assert verify_session(session)["sub"] == "/u/abc"
+
+    payload, signature = session.split(".")
+    assert verify_session(f"{create_session('/u/xyz', max_age=60).split('.')[0]}.{signature}") is None
+    assert verify_session(f"{payload}.{signature[:-2]}AA") is None
+    assert verify_session("garbage") is None
+    assert verify_session(create_session("/u/abc", max_age=-1)) is None
+
+
+def test_login_and_logout(test_auth, client: TestClient):
+    """Logging in sets a session cookie that authenticates later requests on its own."""
+    response = client.post("/auth", headers=test_auth)
+    assert response.status_code == 200
+    user = response.json()
+
+    cookie = get_settings().session_cookie
+    assert client.cookies.get(cookie)
+    assert client.get("/me").json()["id"] == user["id"]
+
+    response = client.delete("/auth")
+    assert response.status_code == 204
+    assert not client.cookies.get(cookie)
+    assert client.get("/me").status_code == 401
+
+
+def test_invalid_session(client: TestClient):
+    """A forged session is not a user."""
+    client.cookies.set(get_settings().session_cookie, create_session("/u/abc", max_age=60) + "x")
+    assert client.get("/me").status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_revoke_sessions():
+    """Sessions issued before a revocation are rejected, later ones are not."""
+    revoked = verify_session(create_session("/u/revoked", max_age=60))
+    await revoke_sessions("/u/revoked")
+
+    assert await get_token_cache().is_revoked(revoked)
+    assert not await get_token_cache().is_revoked(verify_session(create_session("/u/revoked", max_age=60)))
+
+
+def test_logout_everywhere(test_auth, client: TestClient):
+    """Logging out everywhere also rejects copies of the session."""
+    client.post("/auth", headers=test_auth)
+    cookie = get_settings().session_cookie
+    session = client.cookies.get(cookie)
+
+    response = client.delete("/auth", params={"everywhere": True})
+    assert response.status_code == 204
+
+    client.cookies.set(cookie, session)
+    assert client.get("/me").status_code == 401
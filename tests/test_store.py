@@ -0,0 +1,35 @@
+import pytest
+
+from app.services.store import store_many
+
+
+class RecordingStore:
+    """Records writes, failing the ones for IDs in `fail`."""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.stored = []
+
+    async def store(self, obj):
+        if obj["id"] in self.fail:
+            raise RuntimeError(f"Could not store {obj['id']}")
+        self.stored.append(obj["id"])
+
+
+@pytest.mark.asyncio
+async def test_store_many_commits_last():
+    store = RecordingStore()
+    await store_many(store, [{"id": "/a"}, {"id": "/b"}], commit={"id": "/commit"})
+
+    assert sorted(store.stored[:2]) == ["/a", "/b"]
+    assert store.stored[-1] == "/commit"
+
+
+@pytest.mark.asyncio
+async def test_store_many_failure_skips_commit():
+    store = RecordingStore(fail=["/b"])
+
+    with pytest.raises(RuntimeError):
+        await store_many(store, [{"id": "/a"}, {"id": "/b"}], commit={"id": "/commit"})
+
+    assert "/commit" not in store.stored
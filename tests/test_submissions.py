@@ -0,0 +1,40 @@
+import pytest
+
+from app.services.queue import MemoryQueue, QueueFull
+from app.services.submissions import enqueue_submissions
+
+
+class DictStore:
+    def __init__(self):
+        self.objects = {}
+
+    async def store(self, obj):
+        self.objects[obj["id"]] = obj
+
+
+USER = {"id": "/u/abc"}
+ACTIVITIES = [{"id": f"/u/abc/activities/{n}", "type": "Create"} for n in range(3)]
+
+
+@pytest.mark.asyncio
+async def test_enqueue_submissions():
+    """Every activity gets a pending submission, and they are queued in order."""
+    store, queue = DictStore(), MemoryQueue()
+    submissions = await enqueue_submissions(store, queue, USER, ACTIVITIES)
+
+    assert [submission["object"] for submission in submissions] == [activity["id"] for activity in ACTIVITIES]
+    assert all(store.objects[submission["id"]]["status"] == "pending" for submission in submissions)
+    entries = await queue.claim(10)
+    assert [entry["activity"]["id"] for entry in entries] == [activity["id"] for activity in ACTIVITIES]
+    assert entries[0]["submission"]["id"] == submissions[0]["id"]
+
+
+@pytest.mark.asyncio
+async def test_enqueue_submissions_queue_full():
+    """Nothing is queued when the queue is full, and every submission is recorded as failed."""
+    store, queue = DictStore(), MemoryQueue(max_depth=0, put_timeout=0)
+    with pytest.raises(QueueFull):
+        await enqueue_submissions(store, queue, USER, ACTIVITIES)
+
+    assert [submission["status"] for submission in store.objects.values()] == ["failed"] * 3
+    assert await queue.depth() == 0
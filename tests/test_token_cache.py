@@ -0,0 +1,74 @@
+import time
+import pytest
+
+from app.services.tokens import TokenCache
+
+
+@pytest.mark.asyncio
+async def test_token_cache_hit_and_miss():
+    """Verified claims are served from the cache until they expire."""
+    cache = TokenCache(maxsize=2, ttl=300)
+    claims = {"sub": "abc", "iat": time.time(), "exp": time.time() + 60}
+
+    assert await cache.get("token-a") is None
+    await cache.put("token-a", claims)
+    assert await cache.get("token-a") == claims
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Expired tokens are never cached
+    await cache.put("token-b", {**claims, "exp": time.time() - 1})
+    assert await cache.get("token-b") is None
+
+    # The cache is bounded
+    await cache.put("token-c", claims)
+    await cache.put("token-d", claims)
+    assert len(cache.local) == 2
+
+
+@pytest.mark.asyncio
+async def test_token_cache_purge_sub():
+    """Purging a subject drops its tokens and rejects ones issued before the purge."""
+    cache = TokenCache()
+    now = time.time()
+    await cache.put("token-a", {"sub": "abc", "iat": now - 10, "exp": now + 60})
+    await cache.put("token-b", {"sub": "xyz", "iat": now - 10, "exp": now + 60})
+
+    assert await cache.purge_sub("abc") == 1
+    assert await cache.get("token-a") is None
+    assert await cache.get("token-b") is not None
+
+    assert await cache.is_revoked({"sub": "abc", "iat": now - 10})
+    assert not await cache.is_revoked({"sub": "abc", "iat": now + 10})
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.gets = 0
+
+    async def get(self, key):
+        self.gets += 1
+        return self.values.get(key)
+
+
+@pytest.mark.asyncio
+async def test_revocation_lookups_cached():
+    """Revocation lookups in Redis are reused for a while, a purge in this process takes effect right away."""
+    redis = FakeRedis()
+    cache = TokenCache(redis=redis, revocation_check_ttl=60)
+    claims = {"sub": "abc", "iat": time.time() - 10}
+
+    assert not await cache.is_revoked(claims)
+    assert not await cache.is_revoked(claims)
+    assert redis.gets == 1
+
+    # Purged by another process, this one sees it once the lookup expires
+    redis.values["activity-serve:tokens:revoked:abc"] = str(time.time()).encode()
+    assert not await cache.is_revoked(claims)
+    cache._revocations.clear()
+    assert await cache.is_revoked(claims)
+    assert redis.gets == 2
+
+    # Purged through the channel
+    cache.purge_local("xyz")
+    assert await cache.is_revoked({"sub": "xyz", "iat": time.time() - 10})
@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.tracing import record, span
+from app.middleware.profile import ProfileMiddleware
+from app.middleware.tracing import TracingMiddleware
+
+
+def busy_loop(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+@pytest.fixture
+def tracing_client():
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware)
+    app.add_middleware(ProfileMiddleware, token="secret")
+
+    @app.get("/traced")
+    async def _():
+        record("store.dereference", 0.002)
+        record("store.dereference", 0.001)
+        with span("bus.submit"):
+            await asyncio.sleep(0)
+        return {"ok": True}
+
+    @app.get("/busy")
+    async def _():
+        busy_loop(0.05)
+        return {"ok": True}
+
+    with TestClient(app) as client:
+        yield client
+
+
+def test_server_timing(tracing_client):
+    """Spans are totalled by name into the Server-Timing header."""
+    response = tracing_client.get("/traced")
+
+    timings = response.headers["server-timing"].split(", ")
+    assert timings[0] == 'store.dereference;dur=3.00;desc="2x"'
+    assert timings[1].startswith("bus.submit;dur=")
+
+
+def test_profile_request(tracing_client):
+    """Requests with the profile token get the collapsed stacks instead of the response."""
+    response = tracing_client.get("/busy", headers={"X-Profile": "secret"})
+
+    assert response.headers["content-type"].startswith("text/plain")
+    assert response.headers["x-profile-status"] == "200"
+    assert "busy_loop" in response.text
+
+    response = tracing_client.get("/busy", headers={"X-Profile": "wrong"})
+    assert response.json() == {"ok": True}
@@ -0,0 +1,63 @@
+from fastapi.testclient import TestClient
+
+from app.services.user import UserCache, get_identity_id, get_user_cache, invalidate_user, is_local_actor
+
+
+def test_user_cache(test_auth, test_auth_info, client: TestClient):
+    """Authenticated requests resolve the user from the identity cache."""
+    user = client.get("/me", headers=test_auth).json()
+
+    user_cache = get_user_cache()
+    identity_id = get_identity_id(test_auth_info)
+    assert user_cache.get(identity_id)["id"] == user["id"]
+
+    invalidate_user(user["id"])
+    assert user_cache.get(identity_id) is None
+
+    # The next request fills it again
+    assert client.get("/me", headers=test_auth).json()["id"] == user["id"]
+    assert user_cache.get(identity_id)["id"] == user["id"]
+
+
+def test_update_invalidates_user(test_auth, test_auth_info, client: TestClient):
+    """Updating the Person through the outbox drops it from the cache."""
+    user = client.get("/me", headers=test_auth).json()
+
+    response = client.post(
+        user["outbox"],
+        headers=test_auth,
+        json={"type": "Update", "actor": user["id"], "object": {**user, "name": "Updated User"}},
+    )
+    response.raise_for_status()
+
+    assert get_user_cache().get(get_identity_id(test_auth_info)) is None
+
+
+def test_user_cache_index():
+    """A user's entries are dropped together, and evicted keys leave the index."""
+    user_cache = UserCache(maxsize=3)
+    user_cache.set("/auth/identities/a", {"id": "/u/abc"})
+    user_cache.set("/u/abc", {"id": "/u/abc"})
+    user_cache.set("/auth/identities/b", {"id": "/u/def"})
+
+    user_cache.invalidate("/u/abc")
+    assert user_cache.get("/auth/identities/a") is None
+    assert user_cache.get("/u/abc") is None
+    assert user_cache.get("/auth/identities/b") == {"id": "/u/def"}
+
+    # Relinked to another user, the key is no longer dropped with the first one
+    user_cache.set("/auth/identities/b", {"id": "/u/ghi"})
+    user_cache.invalidate("/u/def")
+    assert user_cache.get("/auth/identities/b") == {"id": "/u/ghi"}
+
+    for key in ("1", "2", "3", "4"):
+        user_cache.set(key, {"id": f"/u/{key}"})
+    assert user_cache._keys == {"/u/2": {"2"}, "/u/3": {"3"}, "/u/4": {"4"}}
+
+
+def test_local_actor():
+    assert is_local_actor("/u/abc")
+    assert is_local_actor({"id": "https://example.com/people/abc", "type": "Person"})
+    assert not is_local_actor("/u/abc/activities/123")
+    assert not is_local_actor({"id": "/u/abc/outbox", "type": "OrderedCollection"})
+    assert not is_local_actor({"type": "Person"})